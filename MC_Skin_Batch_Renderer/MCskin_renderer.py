@@ -2,9 +2,12 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, colorchooser
 from PIL import Image, ImageTk
 import os
-import subprocess
 import threading
-import time
+from render_pool import max_worker_count, load_worker_layout
+from render_journal import find_unfinished_journals, JOURNAL_SUFFIX
+from render_quality import QUALITY_NAMES, DEFAULT_QUALITY, quality_samples, quality_settings
+from render_budget import parse_duration
+from render_core import BatchRenderer, ASPECT_RATIOS, MODEL_NUMS, batch_time_str, build_batch_jobs, format_duration
 
 class SkinRendererApp:
     def __init__(self, root):
@@ -36,11 +39,19 @@ class SkinRendererApp:
         self.blender_path = ""
         self.is_rendering = False
         self.model_options = ['standard', 'slim']  # Available model options
-        self.aspect_ratios = {'1:1': (1024, 1024), '4:3': (1024, 768), '3:4': (768, 1024), '16:9': (1024, 576), '9:16': (576, 1024)}
+        self.aspect_ratios = dict(ASPECT_RATIOS)
         self.selected_aspect_ratio = '1:1'
         self.render_devices = ['CPU', 'GPU']  # Available render devices
         self.selected_device = 'CPU'  # Default to CPU
-        self.model_nums = ['1', '2', '3', '4', '5', 'a']  # Available model numbers
+        self.quality_presets = list(QUALITY_NAMES)  # draft, standard, final, custom
+        self.selected_quality = DEFAULT_QUALITY
+        self.worker_count = 1  # Number of concurrent Blender workers
+        self.worker_threads = 0  # Render threads per worker (0 = split cores evenly)
+        # Use the layout tuned for this machine by autotune.py, if any
+        tuned_layout = load_worker_layout()
+        if tuned_layout:
+            self.worker_count, self.worker_threads = tuned_layout
+        self.model_nums = list(MODEL_NUMS)  # Available model numbers
         # Model display names mapping
         self.model_names = {
             '1': '1-Front/Back_Right Hand on Hip',
@@ -487,6 +498,107 @@ class SkinRendererApp:
                                  font= ("Arial", 10))
         device_menu.pack(side=tk.LEFT, padx=5)
         
+        # Render quality preset (custom: pick the sample count)
+        quality_row = tk.Frame(render_card, bg=self.card_bg)
+        quality_row.pack(fill=tk.X, pady=10)
+        
+        tk.Label(quality_row, 
+                text="Render Quality:", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT, padx=5)
+        
+        self.quality_var = tk.StringVar(value=self.selected_quality)
+        quality_menu = ttk.Combobox(quality_row, 
+                                  textvariable=self.quality_var,
+                                  values=self.quality_presets,
+                                  state="readonly",
+                                  width=10,
+                                  font= ("Arial", 10))
+        quality_menu.pack(side=tk.LEFT, padx=5)
+        quality_menu.bind("<<ComboboxSelected>>", self.on_quality_selected)
+        
+        tk.Label(quality_row, 
+                text="Samples:", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT)
+        
+        self.samples_var = tk.IntVar(value=quality_samples(quality_settings(self.selected_quality)))
+        self.samples_spinbox = ttk.Spinbox(quality_row, 
+                                          from_=1, 
+                                          to=4096, 
+                                          textvariable=self.samples_var,
+                                          state="disabled",
+                                          width=6,
+                                          font= ("Arial", 10))
+        self.samples_spinbox.pack(side=tk.LEFT, padx=5)
+        
+        # Time budget for the whole batch (renders drop in quality to finish in time)
+        budget_row = tk.Frame(render_card, bg=self.card_bg)
+        budget_row.pack(fill=tk.X, pady=10)
+        
+        tk.Label(budget_row, 
+                text="Time Budget:", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT, padx=5)
+        
+        self.budget_var = tk.StringVar(value="")
+        budget_entry = ttk.Entry(budget_row, 
+                                textvariable=self.budget_var,
+                                width=10,
+                                font= ("Arial", 10))
+        budget_entry.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(budget_row, 
+                text="e.g. 2h or 90m (empty = no limit)", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT)
+        
+        # Worker layout selection (parallel workers x render threads per worker)
+        workers_row = tk.Frame(render_card, bg=self.card_bg)
+        workers_row.pack(fill=tk.X, pady=10)
+        
+        tk.Label(workers_row, 
+                text="Worker Layout:", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT, padx=5)
+        
+        self.worker_count_var = tk.IntVar(value=self.worker_count)
+        workers_spinbox = ttk.Spinbox(workers_row, 
+                                     from_=1, 
+                                     to=max_worker_count(), 
+                                     textvariable=self.worker_count_var,
+                                     state="readonly",
+                                     width=5,
+                                     font= ("Arial", 10))
+        workers_spinbox.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(workers_row, 
+                text="workers ×", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT)
+        
+        self.worker_threads_var = tk.IntVar(value=self.worker_threads)
+        threads_spinbox = ttk.Spinbox(workers_row, 
+                                     from_=0, 
+                                     to=max_worker_count(), 
+                                     textvariable=self.worker_threads_var,
+                                     state="readonly",
+                                     width=5,
+                                     font= ("Arial", 10))
+        threads_spinbox.pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(workers_row, 
+                text="threads (0 = Auto)", 
+                font= ("Arial", 10), 
+                fg=self.text_color,
+                bg=self.card_bg).pack(side=tk.LEFT)
+        
         # Model number selection
         model_num_row = tk.Frame(render_card, bg=self.card_bg)
         model_num_row.pack(fill=tk.X, pady=10)
@@ -518,6 +630,16 @@ class SkinRendererApp:
                     break
         model_num_menu.bind("<<ComboboxSelected>>", on_model_select)
         
+        # Render every pose for each skin in one batch
+        self.render_all_poses_var = tk.BooleanVar(value=False)
+        all_poses_check = tk.Checkbutton(model_num_row, 
+                                       text="All Poses", 
+                                       variable=self.render_all_poses_var,
+                                       font= ("Arial", 10), 
+                                       fg=self.text_color,
+                                       bg=self.card_bg)
+        all_poses_check.pack(side=tk.LEFT, padx=5)
+        
         # Render background color settings
         color_row = tk.Frame(render_card, bg=self.card_bg)
         color_row.pack(fill=tk.X, pady=10)
@@ -580,6 +702,19 @@ class SkinRendererApp:
                                  command=self.browse_background_image)
         browse_bg_btn.pack(side=tk.LEFT, padx=5)
         
+        # Render cache settings
+        cache_row = tk.Frame(render_card, bg=self.card_bg)
+        cache_row.pack(fill=tk.X, pady=10)
+        
+        self.use_render_cache_var = tk.BooleanVar(value=True)
+        cache_check = tk.Checkbutton(cache_row, 
+                                    text="Reuse cached renders of unchanged skins", 
+                                    variable=self.use_render_cache_var,
+                                    font= ("Arial", 10), 
+                                    fg=self.text_color,
+                                    bg=self.card_bg)
+        cache_check.pack(side=tk.LEFT, padx=5)
+        
         # Render button
         btn_row = tk.Frame(render_card, bg=self.card_bg)
         btn_row.pack(fill=tk.X, pady=10)
@@ -590,6 +725,12 @@ class SkinRendererApp:
                                    style='Accent.TButton')
         self.render_btn.pack(fill=tk.X, ipady=2)
         
+        # Resume an interrupted batch from its journal
+        self.resume_btn = ttk.Button(btn_row, 
+                                   text="Resume Batch", 
+                                   command=self.resume_rendering)
+        self.resume_btn.pack(fill=tk.X, pady=(5, 0))
+        
         # Progress bar
         progress_row = tk.Frame(render_card, bg=self.card_bg)
         progress_row.pack(fill=tk.X, pady=10)
@@ -736,6 +877,26 @@ class SkinRendererApp:
         self.selected_aspect_ratio = self.ratio_var.get()
         print(f"Selected ratio: {self.selected_aspect_ratio}")
     
+    def on_quality_selected(self, event):
+        """Handle user selected render quality; only custom quality takes the sample count"""
+        self.selected_quality = self.quality_var.get()
+        if self.selected_quality == 'custom':
+            self.samples_spinbox.config(state="normal")
+        else:
+            self.samples_var.set(quality_samples(quality_settings(self.selected_quality)))
+            self.samples_spinbox.config(state="disabled")
+        print(f"Selected quality: {self.selected_quality}")
+    
+    def render_quality(self):
+        """Quality settings of the selected preset (see render_quality.py)"""
+        if self.selected_quality == 'custom':
+            try:
+                samples = max(1, int(self.samples_var.get()))
+            except (tk.TclError, ValueError):
+                samples = None
+            return quality_settings('custom', samples=samples)
+        return quality_settings(self.selected_quality)
+    
     def choose_bg_color(self):
         """Choose render background color"""
         # Open color picker
@@ -1079,8 +1240,21 @@ class SkinRendererApp:
         if not self.output_dir:
             messagebox.showerror("Error", "Please select output directory")
             return False
+        if self.budget_var.get().strip():
+            try:
+                parse_duration(self.budget_var.get())
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return False
         return True
     
+    def time_budget(self):
+        """Seconds the batch may take, None without a (valid) time budget"""
+        try:
+            return parse_duration(self.budget_var.get()) if self.budget_var.get().strip() else None
+        except ValueError:
+            return None
+    
     def start_rendering(self):
         """Start batch rendering"""
         if not self.validate_inputs():
@@ -1099,245 +1273,95 @@ class SkinRendererApp:
         # Execute rendering in new thread to avoid blocking GUI
         threading.Thread(target=self.render_batch).start()
     
-    def render_batch(self):
-        """Batch render skins"""
-        import datetime
-        import time
-        
-        total_skins = len(self.skin_files)
-        render_times = []
-        batch_start_time = time.time()
-        
-        for i, skin_info in enumerate(self.skin_files):
-            # Record single skin render start time
-            skin_start_time = time.time()
-            
-            # Calculate progress
-            progress = (i + 1) / total_skins * 100
-            self.progress_var.set(progress)
-            
-            # Update status
-            skin_name = os.path.basename(skin_info['path'])
-            self.status_var.set(f"Rendering: {skin_name} ({i+1}/{total_skins})")
-            
-            # Record rendering start time
-            render_time = datetime.datetime.now()
-            time_str = render_time.strftime("%Y-%m-%d-%H%M")
-            
-            # Generate output filename (ensure no conflict)
-            base_name = os.path.splitext(skin_name)[0]
-            # Convert ratio format from '1:1' to '11', '4:3' to '43', etc.
-            ratio_code = self.selected_aspect_ratio.replace(':', '')
-            output_file = os.path.join(self.output_dir, f"{time_str}_{base_name}_{skin_info['model']}_{ratio_code}_render.png")
-            
-            # Ensure filename doesn't conflict
-            counter = 1
-            while os.path.exists(output_file):
-                output_file = os.path.join(self.output_dir, f"{time_str}_{base_name}_{skin_info['model']}_render_{counter}.png")
-                counter += 1
-            
-            # Execute Blender rendering
-            self.render_single_skin(skin_info, output_file)
-            
-            # Record single skin render end time and duration
-            skin_end_time = time.time()
-            skin_render_time = skin_end_time - skin_start_time
-            render_times.append(skin_render_time)
-            
-            # Calculate prediction time
-            if i > 0:
-                avg_time = sum(render_times) / len(render_times)
-                remaining_skins = total_skins - (i + 1)
-                remaining_time = avg_time * remaining_skins
-                
-                # Format time
-                hours = int(remaining_time // 3600)
-                minutes = int((remaining_time % 3600) // 60)
-                seconds = int(remaining_time % 60)
-                
-                if hours > 0:
-                    time_str = f"Estimated remaining time: {hours}h{minutes}m{seconds}s"
-                elif minutes > 0:
-                    time_str = f"Estimated remaining time: {minutes}m{seconds}s"
-                else:
-                    time_str = f"Estimated remaining time: {seconds}s"
-                
-                # Update prediction time display
-                self.time_var.set(time_str)
+    def resume_rendering(self):
+        """Resume an interrupted batch, rendering only what is not finished yet"""
+        if not self.blender_path:
+            messagebox.showerror("Error", "Please select Blender executable path")
+            return
+        
+        if self.is_rendering:
+            messagebox.showinfo("Note", "Rendering is already in progress")
+            return
+        
+        # Suggest the newest batch in the output directory that never finished
+        initial_dir = self.output_dir or os.getcwd()
+        unfinished = find_unfinished_journals(initial_dir) if os.path.isdir(initial_dir) else []
+        journal_file = filedialog.askopenfilename(
+            title="Select Batch Journal",
+            initialdir=initial_dir,
+            initialfile=os.path.basename(unfinished[0]) if unfinished else "",
+            filetypes=[("Batch journal", f"*{JOURNAL_SUFFIX}"), ("All files", "*.*")]
+        )
+        if not journal_file:
+            return
+        
+        self.is_rendering = True
+        self.render_btn.config(state=tk.DISABLED, text="Rendering...")
+        threading.Thread(target=self.render_batch, args=(journal_file,)).start()
+    
+    def render_batch(self, resume_journal=None):
+        """Batch render skins
+
+        With resume_journal, the batch recorded in that journal is resumed instead.
+        """
+        renderer = BatchRenderer(self.blender_path, self.worker_count_var.get(), self.worker_threads_var.get(),
+                                 use_cache=self.use_render_cache_var.get(), on_progress=self.on_render_progress,
+                                 budget=self.time_budget())
+        try:
+            if resume_journal:
+                summary = renderer.resume(resume_journal)
+            else:
+                # The pool's scheduler groups the jobs by model file
+                time_str = batch_time_str(self.output_dir)
+                jobs = build_batch_jobs(self.skin_files, self.output_dir, time_str, self.selected_aspect_ratio,
+                                        self.device_var.get(), self.render_bg_color, self.model_num_var.get(),
+                                        self.render_all_poses_var.get(), self.render_quality())
+                background_image = self.background_image_path if self.use_background_image else None
+                summary = renderer.render(jobs, self.output_dir, time_str, background_image or None)
+        except Exception as e:
+            print(f"Unknown error during batch rendering: {e}")
+            self.status_var.set("Rendering Failed!")
+            self.render_btn.config(state=tk.NORMAL, text="Start Batch Render")
+            self.is_rendering = False
+            messagebox.showerror("Error", f"Batch rendering failed: {e}")
+            return
         
         # Rendering completed
-        total_time = time.time() - batch_start_time
-        hours = int(total_time // 3600)
-        minutes = int((total_time % 3600) // 60)
-        seconds = int(total_time % 60)
-        
-        if hours > 0:
-            total_time_str = f"Total time: {hours}h{minutes}m{seconds}s"
-        elif minutes > 0:
-            total_time_str = f"Total time: {minutes}m{seconds}s"
-        else:
-            total_time_str = f"Total time: {seconds}s"
+        total_time_str = f"Total time: {format_duration(summary['elapsed'])}"
         
-        self.status_var.set("Rendering Completed!")
         self.time_var.set(total_time_str)
         self.render_btn.config(state=tk.NORMAL, text="Start Batch Render")
         self.is_rendering = False
-        messagebox.showinfo("Completed", f"Successfully rendered {total_skins} skins")
-    
-    def render_single_skin(self, skin_info, output_file):
-        """Render a single skin"""
-        skin_file = skin_info['path']
-        model_type = skin_info['model']
-        
-        # Get the directory of the current script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        print(f"Current script directory: {script_dir}")
-        
-        # Select corresponding blender file based on model type
-        model_dir = os.path.join(script_dir, "model")
-        model_num = self.model_num_var.get()
-        if model_num == 'a':
-            # For model a (original model 4), use the original skin file
-            if model_type == 'standard':
-                model_file = os.path.join(model_dir, f"Steve-model{model_num}.blend")  # Use original model 4 file (now model a)
-            else:
-                model_file = os.path.join(model_dir, f"Alex-model{model_num}.blend")  # Use original model 4 file (now model a)
+        if summary['failed']:
+            self.status_var.set(f"Rendering completed with {summary['failed']} failed renders")
+            messagebox.showwarning("Completed with errors",
+                                   f"Rendered {summary['done']} of {summary['total']} images, "
+                                   f"{summary['failed']} failed.\nSee the output manifest for the errors:\n"
+                                   f"{summary['manifest']}")
         else:
-            if model_type == 'standard':
-                model_file = os.path.join(model_dir, f"Steve-model{model_num}.blend")
-            else:
-                model_file = os.path.join(model_dir, f"Alex-model{model_num}.blend")
-        
-        print(f"Using model file: {model_file}")
-        
-        # Use standalone Blender script
-        script_path = os.path.join(script_dir, "blender_render_script.py")
-        
-        # Get selected ratio
-        width, height = self.aspect_ratios[self.selected_aspect_ratio]
-        
-        # Convert hex color to RGB float values between 0-1
-        def hex_to_rgb(hex_color):
-            hex_color = hex_color.lstrip('#')
-            if len(hex_color) == 6:
-                # RGB format
-                r, g, b = tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4))
-                a = 1.0  # Default opacity
-            elif len(hex_color) == 8:
-                # RGBA format
-                r, g, b, a = tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4, 6))
-            else:
-                # Default transparent
-                r, g, b, a = 0.0, 0.0, 0.0, 0.0
-            return f"{r},{g},{b},{a}"
-        
-        # Build Blender command
-        cmd = [
-            self.blender_path,
-            '--background',
-            model_file,
-            '--python',
-            script_path,
-            '--',
-            skin_file,
-            output_file,
-            str(width),
-            str(height),
-            self.device_var.get(),
-            hex_to_rgb(self.render_bg_color)
-        ]
-        
-        print(f"Executing command: {' '.join(cmd)}")
-        
-        # Execute command
-        print(f"Blender path: {self.blender_path}")
-        print(f"Command exists: {os.path.exists(self.blender_path)}")
-        print(f"Model file exists: {os.path.exists(model_file)}")
-        print(f"Script file exists: {os.path.exists(script_path)}")
-        print(f"Skin file exists: {os.path.exists(skin_file)}")
-        
-        try:
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60)
-            print(f"Blender output:\n{result.stdout}")
-            if result.stderr:
-                print(f"Blender warnings/errors:\n{result.stderr}")
-            print(f"Successfully rendered to: {output_file}")
-            
-            # Apply background image if enabled
-            if self.use_background_image and self.background_image_path and os.path.exists(output_file):
-                self.apply_background_image(output_file)
-                print(f"Successfully applied background image to: {output_file}")
-                
-        except subprocess.CalledProcessError as e:
-            # Rendering error, but continue with next skin
-            print(f"Error rendering {skin_file}: {e}")
-            print(f"Command return code: {e.returncode}")
-            print(f"Command output: {e.stdout}")
-            print(f"Command error: {e.stderr}")
-        except subprocess.TimeoutExpired:
-            print(f"Rendering {skin_file} timed out")
-        except Exception as e:
-            print(f"Unknown error rendering {skin_file}: {e}")
+            self.status_var.set("Rendering Completed!")
+            messagebox.showinfo("Completed", f"Successfully rendered {summary['done']} images "
+                                             f"of {summary['skins']} skins")
     
-    def apply_background_image(self, rendered_image_path):
-        """Apply background image to rendered transparent image"""
-        try:
-            from PIL import Image
-            
-            print(f"Starting background image application process")
-            print(f"  Rendered image: {rendered_image_path}")
-            print(f"  Background image: {self.background_image_path}")
-            
-            # Open rendered image with transparent background
-            rendered_img = Image.open(rendered_image_path).convert("RGBA")
-            print(f"  Rendered image size: {rendered_img.size}")
-            
-            # Open background image
-            bg_img = Image.open(self.background_image_path).convert("RGBA")
-            print(f"  Background image original size: {bg_img.size}")
-            
-            # Calculate scaling factors to maintain aspect ratio
-            render_width, render_height = rendered_img.size
-            bg_width, bg_height = bg_img.size
-            
-            # Calculate scaling factor for width and height
-            scale_x = render_width / bg_width
-            scale_y = render_height / bg_height
-            
-            # Use the larger scaling factor to ensure the entire background is covered
-            scale = max(scale_x, scale_y)
-            
-            # Calculate new background image dimensions
-            new_bg_width = int(bg_width * scale)
-            new_bg_height = int(bg_height * scale)
-            
-            # Resize background image while maintaining aspect ratio
-            bg_img = bg_img.resize((new_bg_width, new_bg_height), Image.LANCZOS)
-            print(f"  Background image resized to: {bg_img.size} with scale factor {scale:.2f}")
-            
-            # Create a new image with rendered size
-            bg_opaque = Image.new("RGBA", rendered_img.size, (255, 255, 255, 255))
-            
-            # Calculate position to center the background image (may be cropped)
-            x_offset = (render_width - new_bg_width) // 2
-            y_offset = (render_height - new_bg_height) // 2
-            
-            # Paste the resized background image onto the opaque background
-            bg_opaque.paste(bg_img, (x_offset, y_offset), bg_img)
-            print(f"  Background image centered at ({x_offset}, {y_offset})")
-            
-            # Composite the rendered image on top of the opaque background
-            result_img = Image.alpha_composite(bg_opaque, rendered_img)
-            print(f"  Completed image compositing")
-            
-            # Save the result (overwrite the original rendered image)
-            result_img.save(rendered_image_path, "PNG")
-            print(f"  Background image applied successfully")
-            
-        except Exception as e:
-            print(f"Error applying background image: {e}")
-            import traceback
-            traceback.print_exc()
+    def on_render_progress(self, event):
+        """Show batch progress events in the status, progress and time displays"""
+        if event['event'] == 'status':
+            self.status_var.set(event['message'])
+        elif event['event'] == 'batch':
+            self.progress_var.set(event['completed'] / event['total'] * 100 if event['total'] else 100)
+        elif event['event'] == 'started':
+            skin_name = os.path.basename(event['skin_path'])
+            self.status_var.set(f"Rendering: {skin_name} ({event['completed'] + 1}/{event['total']})")
+        elif event['event'] == 'progress':
+            # Live progress of the render inside Blender
+            skin_name = os.path.basename(event['skin_path'])
+            detail = f"Sample {event['sample']}/{event['samples']}" if event['sample'] else event['phase']
+            self.status_var.set(f"Rendering: {skin_name} ({event['completed'] + 1}/{event['total']}) - {detail}")
+        elif event['event'] == 'result':
+            self.progress_var.set(event['progress'])
+            if event['remaining_time'] is not None:
+                # Update prediction time display
+                self.time_var.set(f"Estimated remaining time: {format_duration(event['remaining_time'])}")
 
 if __name__ == "__main__":
     root = tk.Tk()
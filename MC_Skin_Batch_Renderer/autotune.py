@@ -0,0 +1,146 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+from PIL import Image
+from render_pool import RenderPool, available_cores, parse_worker_layout, save_worker_layout, LAYOUT_FILE
+
+"""
+Worker layout auto-tuner
+
+Renders a short fixed set of skins against every model file in model/ under
+several workers x threads layouts, then saves the layout with the best
+skins-per-minute for this machine. The GUI uses the saved layout as its default.
+
+Usage:
+python autotune.py --blender [blender_path] [--skins a.png b.png] [--layouts 1x16,2x8,4x4]
+"""
+
+def default_layouts(core_count=None):
+    """Candidate layouts: power-of-two worker counts sharing all cores"""
+    if core_count is None:
+        core_count = len(available_cores())
+    layouts = []
+    workers = 1
+    while workers <= core_count:
+        layouts.append((workers, core_count // workers))
+        workers *= 2
+    if layouts[-1][0] != core_count:
+        layouts.append((core_count, 1))
+    return layouts
+
+def make_calibration_skins(skin_dir, count=2):
+    """Create a deterministic set of simple 64x64 skins for calibration"""
+    paths = []
+    for i in range(count):
+        img = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+        # Fill each 8x8 cell with a color derived from its position, so every skin differs
+        for y in range(0, 64, 8):
+            for x in range(0, 64, 8):
+                color = ((x * 4 + i * 60) % 256, (y * 4 + i * 30) % 256, (x + y + i * 90) % 256, 255)
+                img.paste(color, (x, y, x + 8, y + 8))
+        path = os.path.join(skin_dir, f"calibration_{i}.png")
+        img.save(path)
+        paths.append(path)
+    return paths
+
+def find_model_files(model_dir=None):
+    """All Steve/Alex model files (poses 1-5 and a)"""
+    if model_dir is None:
+        model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+    return sorted(glob.glob(os.path.join(model_dir, "*.blend")))
+
+def measure_layout(blender_path, workers, threads, model_files, skin_paths, output_dir,
+                   width=1024, height=1024, device='CPU', timeout=300):
+    """Render every skin against every model file with one layout, return skins per minute"""
+    jobs = []
+    for model_file in model_files:
+        for skin_path in skin_paths:
+            job_id = str(len(jobs))
+            jobs.append({
+                'id': job_id,
+                'model_file': model_file,
+                'skin_path': skin_path,
+                'output_path': os.path.join(output_dir, f"{workers}x{threads}_{job_id}.png"),
+                'width': width,
+                'height': height,
+                'device': device,
+                'bg_color': "0,0,0,0"
+            })
+
+    pool = RenderPool(blender_path, workers, timeout=timeout, threads=threads)
+    start_time = time.time()
+    results = pool.run(jobs)
+    elapsed = time.time() - start_time
+
+    failed = sum(1 for status in results.values() if status.get('status') != 'done')
+    skins_per_minute = (len(jobs) - failed) / elapsed * 60 if elapsed > 0 else 0.0
+    return {
+        'workers': pool.num_workers,
+        'threads': pool.threads,
+        'jobs': len(jobs),
+        'failed': failed,
+        'elapsed': elapsed,
+        'skins_per_minute': skins_per_minute
+    }
+
+def autotune(blender_path, layouts=None, skin_paths=None, model_files=None,
+             width=1024, height=1024, device='CPU', save_path=LAYOUT_FILE):
+    """Measure each layout and save the fastest one; returns (best, all results)"""
+    if layouts is None:
+        layouts = default_layouts()
+    if model_files is None:
+        model_files = find_model_files()
+
+    work_dir = tempfile.mkdtemp(prefix="mcskin_autotune_")
+    try:
+        if not skin_paths:
+            skin_paths = make_calibration_skins(work_dir)
+
+        results = []
+        for workers, threads in layouts:
+            print(f"Measuring layout {workers} workers x {threads} threads...")
+            output_dir = os.path.join(work_dir, f"{workers}x{threads}")
+            os.makedirs(output_dir, exist_ok=True)
+            result = measure_layout(blender_path, workers, threads, model_files, skin_paths,
+                                    output_dir, width, height, device)
+            print(f"  {result['skins_per_minute']:.1f} skins/min "
+                  f"({result['jobs']} jobs, {result['failed']} failed, {result['elapsed']:.1f}s)")
+            results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Only layouts that rendered everything are eligible
+    candidates = [r for r in results if r['failed'] == 0] or results
+    best = max(candidates, key=lambda r: r['skins_per_minute'])
+    if save_path:
+        save_worker_layout(best['workers'], best['threads'], best['skins_per_minute'], results, save_path)
+        print(f"Saved worker layout {best['workers']}x{best['threads']} to {save_path}")
+    return best, results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest worker layout for this machine")
+    parser.add_argument('--blender', required=True, help="Path to the Blender executable")
+    parser.add_argument('--skins', nargs='*', help="Skins to render (default: generated calibration skins)")
+    parser.add_argument('--layouts', help="Comma-separated layouts to try, e.g. 1x16,2x8,4x4")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    parser.add_argument('--output', default=LAYOUT_FILE, help="Where to save the tuned layout")
+    args = parser.parse_args(argv)
+
+    layouts = None
+    if args.layouts:
+        layouts = [parse_worker_layout(layout) for layout in args.layouts.split(',')]
+
+    best, results = autotune(args.blender, layouts, args.skins, width=args.width, height=args.height,
+                             device=args.device, save_path=args.output)
+    print(f"Best layout: {best['workers']} workers x {best['threads']} threads "
+          f"({best['skins_per_minute']:.1f} skins/min)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from PIL import Image
+from autotune import find_model_files
+from render_core import ASPECT_RATIOS, parse_model_file
+from render_pool import RenderPool, load_worker_layout, parse_worker_layout
+from render_retry import RetryPolicy
+from render_service import percentile
+from render_backend import create_backend
+from render_quality import add_quality_arguments, quality_from_args, quality_settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+End-to-end render benchmark
+
+Generates a deterministic corpus of synthetic 64x64 skins (half standard, half
+slim), renders it through every model file in model/ at every aspect ratio
+preset, and reports skins per minute, latency percentiles and peak memory.
+Standard skins go to the Steve model files and slim skins to the Alex ones.
+
+Each case (model file x aspect ratio) starts a fresh worker pool, so Blender
+startup and .blend loading are part of the numbers like in a real batch.
+Latency is the time from a worker picking up a job to its finished output;
+render is the Cycles part of it as measured inside Blender.
+
+With the fake backend (--backend fake:latency=0.001) no Blender runs, which
+measures the orchestrator's own overhead; --jobs repeats the corpus to reach
+large job counts per case. --quality draft (or final) benchmarks another
+render quality preset (see render_quality.py).
+
+Usage:
+python benchmark.py --blender [blender_path] [--skins 8] [--workers 4x4] [--report report.json]
+python benchmark.py --blender [blender_path] --compare baseline.json
+python benchmark.py --backend fake --jobs 100000 --models Steve-model1.blend --ratios 1:1
+"""
+
+# Seed of the synthetic corpus; the same seed and count always give the same skins
+DEFAULT_SEED = 2024
+
+# Base layer areas of the 64x64 skin layout (left, top, right, bottom)
+BASE_AREAS = [(8, 0, 24, 8), (0, 8, 32, 16),  # Head
+              (4, 16, 12, 20), (0, 20, 16, 32),  # Right leg
+              (20, 16, 36, 20), (16, 20, 40, 32),  # Body
+              (44, 16, 52, 20), (40, 20, 56, 32),  # Right arm
+              (20, 48, 28, 52), (16, 52, 32, 64),  # Left leg
+              (36, 48, 44, 52), (32, 52, 48, 64)]  # Left arm
+
+# Second layer areas (hat, jacket, sleeves, trousers), only partly covered
+OVERLAY_AREAS = [(40, 0, 56, 8), (32, 8, 64, 16), (0, 32, 56, 48), (0, 48, 16, 64), (48, 48, 64, 64)]
+
+# Columns that are empty in a slim (3 pixel arm) skin; see detect_model_type
+SLIM_EMPTY_AREAS = [(50, 16, 52, 20), (54, 20, 56, 32), (42, 48, 44, 52), (46, 52, 48, 64)]
+
+def make_synthetic_skin(path, slim=False, seed=0):
+    """Write a 64x64 skin with random blocky colors in the standard UV layout"""
+    rng = random.Random(seed)
+    img = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+    palette = [(rng.randrange(256), rng.randrange(256), rng.randrange(256), 255) for _ in range(6)]
+    for left, top, right, bottom in BASE_AREAS:
+        for y in range(top, bottom, 2):
+            for x in range(left, right, 2):
+                img.paste(rng.choice(palette), (x, y, min(x + 2, right), min(y + 2, bottom)))
+    for left, top, right, bottom in OVERLAY_AREAS:
+        for y in range(top, bottom, 4):
+            for x in range(left, right, 4):
+                if rng.random() < 0.3:
+                    img.paste(rng.choice(palette), (x, y, min(x + 4, right), min(y + 4, bottom)))
+    if slim:
+        for area in SLIM_EMPTY_AREAS:
+            img.paste((0, 0, 0, 0), area)
+    img.save(path)
+    return path
+
+def make_benchmark_corpus(skin_dir, count=8, seed=DEFAULT_SEED):
+    """Create count synthetic skins, alternating standard and slim; returns [(path, model_type)]"""
+    corpus = []
+    for i in range(count):
+        model_type = 'slim' if i % 2 else 'standard'
+        path = os.path.join(skin_dir, f"benchmark_{model_type}_{i:03d}.png")
+        make_synthetic_skin(path, model_type == 'slim', seed * 1000 + i)
+        corpus.append((path, model_type))
+    return corpus
+
+def peak_rss_mb():
+    """Peak resident memory in MB of this process and of the largest finished child (Blender)"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+class RecordCollector:
+    """Keeps the pool's timing records in memory (same interface as TimingLog)"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        """Keep one timing record"""
+        self.records.append(record)
+
+def latency_summary(values):
+    """p50/p90/p99 and mean of a list of seconds"""
+    return {
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'mean': sum(values) / len(values) if values else None
+    }
+
+def run_case(blender_path, workers, threads, model_file, ratio, skin_paths, output_dir, device='CPU',
+             job_count=None, backend=None, quality=None):
+    """Render the skins through one model file at one aspect ratio; returns the case result
+
+    job_count renders that many jobs by cycling through the skins (default: each skin once).
+    """
+    width, height = ASPECT_RATIOS[ratio]
+    jobs = []
+    for index in range(job_count or len(skin_paths)):
+        skin_path = skin_paths[index % len(skin_paths)]
+        job_id = str(len(jobs))
+        jobs.append({
+            'id': job_id,
+            'model_file': model_file,
+            'skin_path': skin_path,
+            'output_path': os.path.join(output_dir, f"{job_id}.png"),
+            'width': width,
+            'height': height,
+            'device': device,
+            'bg_color': "0,0,0,0",
+            'quality': quality
+        })
+
+    collector = RecordCollector()
+    # No retries, a failure should show up in the numbers
+    pool = RenderPool(blender_path, workers, threads=threads, retry_policy=RetryPolicy(max_attempts=1),
+                      timing_log=collector, backend=backend)
+    start_time = time.time()
+    results = pool.run(jobs)
+    elapsed = time.time() - start_time
+
+    done = [record for record in collector.records if record['status'] == 'done']
+    latencies = [record['total'] - record['phases'].get('queue_wait', 0.0) for record in done]
+    renders = [record['phases']['render'] for record in done if 'render' in record['phases']]
+    failed = sum(1 for status in results.values() if status.get('status') != 'done')
+    return {
+        'model_file': os.path.basename(model_file),
+        'ratio': ratio,
+        'width': width,
+        'height': height,
+        'jobs': len(jobs),
+        'failed': failed,
+        'elapsed': elapsed,
+        'skins_per_minute': (len(jobs) - failed) / elapsed * 60 if elapsed > 0 else 0.0,
+        'latency': latency_summary(latencies),
+        'render': latency_summary(renders),
+        'latencies': latencies
+    }
+
+def run_benchmark(blender_path, workers=1, threads=0, skin_count=8, seed=DEFAULT_SEED, model_files=None,
+                  ratios=None, device='CPU', job_count=None, backend=None, quality=None):
+    """Run every model file x aspect ratio case; returns the benchmark report"""
+    if model_files is None:
+        model_files = find_model_files()
+    model_files = [model_file for model_file in model_files if parse_model_file(model_file)]
+    ratios = ratios or list(ASPECT_RATIOS)
+    quality = quality or quality_settings()
+
+    work_dir = tempfile.mkdtemp(prefix="mcskin_benchmark_")
+    cases = []
+    start_time = time.time()
+    try:
+        corpus = make_benchmark_corpus(work_dir, skin_count, seed)
+        for model_file in model_files:
+            model_type, pose = parse_model_file(model_file)
+            skin_paths = [path for path, skin_type in corpus if skin_type == model_type]
+            if not skin_paths:
+                continue
+            for ratio in ratios:
+                print(f"Benchmarking {os.path.basename(model_file)} at {ratio} ({len(skin_paths)} skins)...")
+                output_dir = os.path.join(work_dir, f"{os.path.basename(model_file)}_{ratio.replace(':', 'x')}")
+                os.makedirs(output_dir, exist_ok=True)
+                case = run_case(blender_path, workers, threads, model_file, ratio, skin_paths, output_dir, device,
+                                job_count, backend, quality)
+                case['pose'] = pose
+                print(f"  {case['skins_per_minute']:.1f} skins/min, latency p50 {format_seconds(case['latency']['p50'])} "
+                      f"p99 {format_seconds(case['latency']['p99'])}, {case['failed']} failed")
+                cases.append(case)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    elapsed = time.time() - start_time
+
+    jobs = sum(case['jobs'] for case in cases)
+    failed = sum(case['failed'] for case in cases)
+    render_time = sum(case['elapsed'] for case in cases)
+    latencies = [latency for case in cases for latency in case.pop('latencies')]
+    own_rss, blender_rss = peak_rss_mb()
+    return {
+        'seed': seed,
+        'skins': skin_count,
+        'workers': workers,
+        'threads': threads,
+        'device': device,
+        'quality': quality,
+        'backend': backend.name if backend is not None else 'blender',
+        'cpu_count': os.cpu_count(),
+        'jobs': jobs,
+        'failed': failed,
+        'elapsed': elapsed,
+        'skins_per_minute': (jobs - failed) / render_time * 60 if render_time > 0 else 0.0,
+        'latency': latency_summary(latencies),
+        'peak_rss_mb': {'orchestrator': own_rss, 'blender': blender_rss},
+        'cases': cases
+    }
+
+def format_seconds(value):
+    """Seconds for the report table"""
+    if value is None:
+        return "-"
+    return f"{value * 1000:.1f}ms" if value < 0.1 else f"{value:.2f}s"
+
+def compare_reports(report, baseline):
+    """Relative skins-per-minute change per case against a baseline report"""
+    baseline_cases = {(case['model_file'], case['ratio']): case for case in baseline.get('cases', [])}
+    changes = []
+    for case in report['cases']:
+        old = baseline_cases.get((case['model_file'], case['ratio']))
+        if old and old.get('skins_per_minute'):
+            changes.append((case['model_file'], case['ratio'], old['skins_per_minute'], case['skins_per_minute']))
+    return changes
+
+def print_report(report, baseline=None):
+    """Print the benchmark results as a table"""
+    quality = report.get('quality') or {}
+    print(f"Quality: {quality.get('preset', 'standard')} ({quality.get('samples', 128)} samples)")
+    print(f"{'model file':<22} {'ratio':<6} {'jobs':>5} {'failed':>6} {'skins/min':>10} "
+          f"{'p50':>8} {'p90':>8} {'p99':>8} {'render p50':>11}")
+    for case in report['cases']:
+        print(f"{case['model_file']:<22} {case['ratio']:<6} {case['jobs']:>5} {case['failed']:>6} "
+              f"{case['skins_per_minute']:>10.1f} {format_seconds(case['latency']['p50']):>8} "
+              f"{format_seconds(case['latency']['p90']):>8} {format_seconds(case['latency']['p99']):>8} "
+              f"{format_seconds(case['render']['p50']):>11}")
+    latency = report['latency']
+    print(f"Total: {report['jobs']} renders, {report['failed']} failed, {report['skins_per_minute']:.1f} skins/min, "
+          f"latency p50 {format_seconds(latency['p50'])} p90 {format_seconds(latency['p90'])} "
+          f"p99 {format_seconds(latency['p99'])}")
+    rss = report['peak_rss_mb']
+    if rss['orchestrator'] is not None:
+        print(f"Peak RSS: orchestrator {rss['orchestrator']:.0f} MB, Blender {rss['blender']:.0f} MB")
+
+    if baseline:
+        print(f"Compared to baseline ({baseline.get('skins_per_minute', 0):.1f} skins/min overall):")
+        for model_file, ratio, old, new in compare_reports(report, baseline):
+            print(f"  {model_file:<22} {ratio:<6} {old:>8.1f} -> {new:>8.1f} skins/min ({(new / old - 1) * 100:+.1f}%)")
+
+def add_benchmark_arguments(parser):
+    """Benchmark options (shared with mcskin benchmark)"""
+    parser.add_argument('--skins', type=int, default=8, help="Synthetic skins in the corpus, half of them slim")
+    parser.add_argument('--jobs', type=int, help="Renders per case, cycling through the corpus (default: one per skin)")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="Seed of the synthetic corpus")
+    parser.add_argument('--ratios', help="Comma-separated aspect ratios (default: all presets)")
+    parser.add_argument('--models', help="Comma-separated model file names (default: every file in model/)")
+    parser.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    parser.add_argument('--report', help="Save the report as JSON, e.g. to compare later")
+    parser.add_argument('--compare', help="Baseline report JSON to compare skins/min against")
+    add_quality_arguments(parser)
+
+def benchmark_main(args, workers, threads, backend=None):
+    """Run the benchmark for parsed arguments and print the report"""
+    ratios = args.ratios.split(',') if args.ratios else None
+    for ratio in ratios or []:
+        if ratio not in ASPECT_RATIOS:
+            print(f"Unknown aspect ratio: {ratio}")
+            return 2
+    model_files = find_model_files()
+    if args.models:
+        names = set(args.models.split(','))
+        model_files = [model_file for model_file in model_files if os.path.basename(model_file) in names]
+
+    report = run_benchmark(args.blender, workers, threads, args.skins, args.seed, model_files, ratios, args.device,
+                           args.jobs, backend, quality_from_args(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to: {args.report}")
+    return 0 if report['failed'] == 0 else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering with a synthetic skin corpus")
+    parser.add_argument('--blender', help="Path to the Blender executable")
+    parser.add_argument('--workers', help="Worker layout, e.g. 8 or 4x4 (default: tuned layout or 1)")
+    parser.add_argument('--backend', default='blender', help="Render backend, e.g. fake:latency=0.01")
+    add_benchmark_arguments(parser)
+    args = parser.parse_args(argv)
+    backend = create_backend(args.backend, args.blender)
+    if backend.name in ('blender', 'baked') and not args.blender:
+        parser.error("--blender is required for the blender backend")
+    if args.workers:
+        workers, threads = parse_worker_layout(args.workers)
+    else:
+        workers, threads = load_worker_layout() or (1, 0)
+    return benchmark_main(args, workers, threads, backend)
+
+if __name__ == "__main__":
+    sys.exit(main())
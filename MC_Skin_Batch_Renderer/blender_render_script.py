@@ -1,86 +1,148 @@
 import bpy
 import os
 import sys
+import json
+import time
 
 """
 Blender Skin Rendering Script
 Used to replace skin textures of Minecraft character models and render output
 
 Usage:
-blender --background [blender_file] --python blender_render_script.py -- [skin_path] [output_path] [width] [height]
-"""
+blender --background [blender_file] --python blender_render_script.py -- [skin_path] [output_path] [width] [height] [device] [bg_color]
 
-# Get command line arguments
-argv = sys.argv
-argv = argv[argv.index('--') + 1:]  # Skip arguments before --
+Worker mode (load the model once, then render job after job read from stdin):
+blender --background [blender_file] --python blender_render_script.py -- --worker
 
-if len(argv) < 2:
-    print("Error: Missing parameters")
-    print("Usage: blender --background [blender_file] --python blender_render_script.py -- [skin_path] [output_path] [width] [height] [device] [bg_color]")
-    sys.exit(1)
+Each job is one JSON line on stdin, for example:
+{"id": "1", "skin_path": "...", "output_path": "...", "width": 1024, "height": 1024, "device": "CPU", "bg_color": "0,0,0,0"}
+Send {"cmd": "quit"} or close stdin to stop the worker.
 
-skin_path = argv[0]
-output_path = argv[1]
+Manifest mode (render every job of a JSON/NDJSON manifest for this model in one invocation):
+blender --background [blender_file] --python blender_render_script.py -- --manifest [manifest_path]
 
-# Check current blend file
-current_blend_file = bpy.data.filepath
-print(f"Current blend file: {current_blend_file}")
+The manifest is either a JSON list of jobs, a JSON object {"defaults": {...}, "jobs": [...]},
+or one JSON job per line (NDJSON). Jobs use the same fields as worker mode.
 
-# Set default dimensions
-width = 1024
-height = 1024
+Status lines are written to stdout prefixed with STATUS_PREFIX so they can be told apart from Blender output.
+A job's done/failed status carries "timings": a list of [phase, start, end] spans (epoch seconds) for
+setup (render settings), texture (skin replacement), render (Cycles) and write (saving the PNG).
 
-# Set default device to CPU
-device = "CPU"
+A job with "bake": true renders no skin; it writes the model's UV and lighting maps for this
+camera and resolution to output_path (a NumPy .npz file) for gather rendering (see render_bake.py):
+{"id": "b", "bake": true, "output_path": "...npz", "width": 1024, "height": 1024, "device": "CPU"}
 
-# Set default background color
-bg_color = (0, 0, 0, 0)  # Default transparent background
+A render job with "lightmap_path" renders the skin emission-only, multiplied by the pose's
+lighting baked into that EXR lightmap (baked on first use, "lightmap_size" pixels square, at
+"lightmap_bake_samples" samples), so Cycles only needs a few samples per skin instead of full
+path tracing. Such jobs ignore the samples and light paths of their "quality".
 
-# Get width and height parameters (if provided)
-if len(argv) >= 4:
-    try:
-        width = int(argv[2])
-        height = int(argv[3])
-        print(f"Using custom dimensions: {width}x{height}")
-    except ValueError:
-        print("Warning: Width/height parameters are not valid integers, using default size 1024x1024")
+A job's "quality" sets Cycles samples, adaptive threshold, max bounces, denoising and
+clamping (see render_quality.py); without it a render uses 128 adaptive samples and the
+.blend's own light path settings:
+"quality": {"preset": "draft", "samples": 16, "adaptive_threshold": 0.1, "max_bounces": 2, "denoise": true, ...}
 
-# Get device parameter (if provided)
-if len(argv) >= 5:
-    device = argv[4].upper()
-    if device not in ["CPU", "GPU"]:
-        print(f"Warning: Invalid device '{device}', using default 'CPU'")
-        device = "CPU"
+Any mode also accepts --threads [count] after -- to fix the number of CPU render threads
+(0 or omitted lets Blender use every core). Jobs may override it with a "threads" field.
+"""
+
+# Prefix of machine-readable status lines
+STATUS_PREFIX = "@@MCSKIN "
+
+# Default render settings
+DEFAULT_WIDTH = 1024
+DEFAULT_HEIGHT = 1024
+DEFAULT_DEVICE = "CPU"
+DEFAULT_BG_COLOR = (0, 0, 0, 0)  # Default transparent background
+DEFAULT_THREADS = 0  # 0 = auto-detect (use all cores)
 
-# Get background color parameter (if provided)
-if len(argv) >= 6:
+def parse_bg_color(value):
+    """Parse background color from 'r,g,b[,a]' string or list"""
     try:
-        bg_color = tuple(map(float, argv[5].split(',')))
+        if isinstance(value, str):
+            bg_color = tuple(map(float, value.split(',')))
+        else:
+            bg_color = tuple(float(c) for c in value)
         if len(bg_color) == 3:
             bg_color = bg_color + (1.0,)  # If only RGB, add Alpha channel
         elif len(bg_color) == 4:
             pass  # Already contains Alpha channel
         else:
             print("Warning: Invalid background color format, using default transparent background")
-            bg_color = (0, 0, 0, 0)
+            bg_color = DEFAULT_BG_COLOR
     except:
         print("Warning: Invalid background color format, using default transparent background")
-        bg_color = (0, 0, 0, 0)
+        bg_color = DEFAULT_BG_COLOR
+    return bg_color
 
-print(f"Using render device: {device}")
-print(f"Background color: {bg_color}")
+def parse_device(value):
+    """Parse render device, falling back to CPU"""
+    device = str(value).upper()
+    if device not in ["CPU", "GPU"]:
+        print(f"Warning: Invalid device '{device}', using default 'CPU'")
+        device = DEFAULT_DEVICE
+    return device
 
-print(f"Skin path: {skin_path}")
-print(f"Output path: {output_path}")
+def pop_option(argv, name, default=None):
+    """Remove '--name value' from argv and return value (or default)"""
+    if name in argv:
+        index = argv.index(name)
+        if index + 1 < len(argv):
+            value = argv[index + 1]
+            del argv[index:index + 2]
+            return value
+        del argv[index]
+    return default
 
-# Check if file exists
-if not os.path.exists(skin_path):
-    print(f"Error: Skin file not found: {skin_path}")
-    sys.exit(1)
+def emit_status(**fields):
+    """Write a machine-readable status line to stdout"""
+    print(STATUS_PREFIX + json.dumps(fields, ensure_ascii=False))
+    sys.stdout.flush()
+
+# Cycles samples when a job sets no quality
+DEFAULT_SAMPLES = 128
+
+# Job quality settings (see render_quality.py) -> Cycles scene settings
+QUALITY_ATTRIBUTES = {
+    'adaptive_threshold': 'adaptive_threshold',
+    'max_bounces': 'max_bounces',
+    'denoise': 'use_denoising',
+    'clamp_direct': 'sample_clamp_direct',
+    'clamp_indirect': 'sample_clamp_indirect'
+}
+
+# The .blend's own values of those settings, saved before a job first changes them
+blend_quality = None
+
+def apply_quality(scene, quality=None):
+    """Apply a job's quality settings to Cycles; settings that are None keep the .blend's value"""
+    global blend_quality
+    quality = quality or {}
+    cycles = scene.cycles
+    if blend_quality is None:
+        blend_quality = {attr: getattr(cycles, attr) for attr in list(QUALITY_ATTRIBUTES.values()) + ['denoiser']
+                         if hasattr(cycles, attr)}
+    
+    cycles.samples = int(quality.get('samples') or DEFAULT_SAMPLES)
+    cycles.use_adaptive_sampling = True
+    for name, attr in QUALITY_ATTRIBUTES.items():
+        if attr not in blend_quality:
+            continue
+        value = quality.get(name)
+        setattr(cycles, attr, blend_quality[attr] if value is None else value)
+    
+    # OpenImageDenoise runs on the CPU, so it also works where OptiX denoising isn't available
+    if 'denoiser' in blend_quality:
+        try:
+            cycles.denoiser = 'OPENIMAGEDENOISE' if quality.get('denoise') else blend_quality['denoiser']
+        except TypeError:
+            print("Warning: OpenImageDenoise is not available in this Blender build")
+    print(f"Render quality: {quality.get('preset', 'standard')}, {cycles.samples} samples")
 
 # Set up rendering parameters
-def setup_rendering(scene, device, bg_color):
-    """Set up rendering parameters"""
+def setup_rendering(scene, device, bg_color, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, threads=DEFAULT_THREADS,
+                    quality=None):
+    """Set up rendering parameters (quality: see apply_quality)"""
     # Set render engine
     if bpy.app.version >= (2, 80, 0):
         scene.render.engine = 'CYCLES' if 'CYCLES' in scene.render.engine else 'BLENDER_EEVEE'
@@ -135,10 +197,17 @@ def setup_rendering(scene, device, bg_color):
     scene.render.resolution_y = height
     scene.render.resolution_percentage = 100
     
+    # Set CPU thread count, so concurrent workers don't oversubscribe the CPU
+    if threads > 0:
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = threads
+        print(f"Using {threads} render threads")
+    else:
+        scene.render.threads_mode = 'AUTO'
+    
     # Set sampling (if using Cycles)
     if scene.render.engine == 'CYCLES':
-        scene.cycles.samples = 128  # Balance quality and speed
-        scene.cycles.use_adaptive_sampling = True
+        apply_quality(scene, quality)
         
         # Set render device (CPU or GPU)
         if device == "GPU":
@@ -190,6 +259,30 @@ def setup_rendering(scene, device, bg_color):
             scene.cycles.device = 'CPU'
             print("Using CPU for rendering")
 
+# Player material names
+PLAYER_MATERIAL_NAMES = ['Steve皮肤', 'Alex皮肤', 'Steve Skin', 'Alex Skin']
+
+def is_skin_material(material):
+    """Whether a material carries the player skin
+    
+    Model a (original model 4) also has village/villager materials, there only the
+    player character materials count; in the other models every material does.
+    """
+    current_blend_file = bpy.data.filepath
+    is_modela = "modela" in current_blend_file.lower() or "model_a" in current_blend_file.lower()
+    if is_modela:
+        return any(player_mat in material.name for player_mat in PLAYER_MATERIAL_NAMES)
+    return True
+
+def skin_texture_node(material):
+    """The image texture node holding the skin in a node material, or None"""
+    if not material.use_nodes or not is_skin_material(material):
+        return None
+    for node in material.node_tree.nodes:
+        if node.type == 'TEX_IMAGE':
+            return node
+    return None
+
 # Replace skin texture
 def replace_skin_texture(skin_file_path):
     """Replace the model's skin texture"""
@@ -198,31 +291,18 @@ def replace_skin_texture(skin_file_path):
     # Load new skin image
     new_skin = bpy.data.images.load(skin_file_path)
     
-    # Check if it's model a (original model 4), only replace player character skin materials
-    current_blend_file = bpy.data.filepath
-    is_modela = "modela" in current_blend_file.lower() or "model_a" in current_blend_file.lower()
-    
-    # Player material names
-    player_material_names = ['Steve皮肤', 'Alex皮肤', 'Steve Skin', 'Alex Skin']
-    
     # Iterate through all materials
     for material in bpy.data.materials:
         print(f"Checking material: {material.name}")
         
         # For model a, only process player character materials
         # For other models (including model 5), process all materials
-        if is_modela:
-            # Only process player character materials, not village/villager materials
-            if any(player_mat in material.name for player_mat in player_material_names):
-                print(f"  Processing player material: {material.name}")
-                process_material = True
-            else:
-                print(f"  Skipping non-player material: {material.name}")
-                process_material = False
-        else:
-            # For other models, process all materials
+        if is_skin_material(material):
             print(f"  Processing material: {material.name}")
             process_material = True
+        else:
+            print(f"  Skipping non-player material: {material.name}")
+            process_material = False
         
         if process_material:
             # Check if using nodes (Blender 2.8+)
@@ -250,29 +330,579 @@ def replace_skin_texture(skin_file_path):
     
     return texture_updated
 
-# Get current scene
-scene = bpy.context.scene
+def release_skin_image(skin_file_path):
+    """Remove images loaded for a skin so a long-lived worker does not accumulate them"""
+    for img in list(bpy.data.images):
+        if img.filepath == skin_file_path:
+            bpy.data.images.remove(img)
 
-# Set render parameters
-setup_rendering(scene, device, bg_color)
+# Settings applied by the last setup_rendering call (worker mode only re-applies on change)
+current_settings = None
 
-# Set output path
-scene.render.filepath = output_path
+# Second layer areas (hat, jacket, sleeves, trousers) of the 64x64 skin layout: (left, top, right, bottom)
+OVERLAY_AREAS = [(32, 0, 64, 16), (16, 32, 56, 48), (0, 32, 16, 48), (0, 48, 16, 64), (48, 48, 64, 64)]
 
-# Replace skin texture
-if replace_skin_texture(skin_path):
-    print("Skin texture updated successfully")
-else:
-    print("Warning: No skin texture nodes found, you may need to check the Blender file manually")
+def make_mask_skin(name, base_only=False):
+    """Opaque white 64x64 skin; with base_only the second layer areas are transparent"""
+    image = bpy.data.images.new(name, 64, 64, alpha=True)
+    pixels = [1.0] * (64 * 64 * 4)
+    if base_only:
+        for left, top, right, bottom in OVERLAY_AREAS:
+            for y in range(top, bottom):
+                row = (63 - y) * 64  # Blender image rows start at the bottom
+                for x in range(left, right):
+                    pixels[(row + x) * 4 + 3] = 0.0
+    image.pixels = pixels
+    return image
+
+def override_setting(saved, owner, name, value):
+    """Set owner.name to value, remembering the old value in the saved list"""
+    saved.append((owner, name, getattr(owner, name)))
+    setattr(owner, name, value)
+
+def restore_settings(saved):
+    """Undo override_setting calls, newest first"""
+    for owner, name, value in reversed(saved):
+        setattr(owner, name, value)
+    del saved[:]
+
+def uv_color(tree, texture, added):
+    """The UV coordinates a skin texture node is sampled at (after any mapping node)"""
+    if texture.inputs['Vector'].links:
+        return texture.inputs['Vector'].links[0].from_socket
+    coordinates = tree.nodes.new('ShaderNodeTexCoord')
+    added.append(coordinates)
+    return coordinates.outputs['UV']
+
+def lightmap_color(lightmap):
+    """Emission color function for use_emission_shading: skin color times the baked lightmap"""
+    def color(tree, texture, added):
+        node = tree.nodes.new('ShaderNodeTexImage')
+        node.image = lightmap
+        node.interpolation = 'Linear'
+        multiply = tree.nodes.new('ShaderNodeVectorMath')
+        multiply.operation = 'MULTIPLY'
+        added += [node, multiply]
+        tree.links.new(uv_color(tree, texture, added), node.inputs['Vector'])
+        tree.links.new(texture.outputs['Color'], multiply.inputs[0])
+        tree.links.new(node.outputs['Color'], multiply.inputs[1])
+        return multiply.outputs['Vector']
+    return color
+
+def use_emission_shading(skin_color, holdout_others=False):
+    """Make skin materials emit a color instead of being lit
+    
+    skin_color(tree, texture, added) returns the socket to emit, appending any
+    node it creates to added. The skin texture's alpha still cuts out
+    transparent texels. With holdout_others every other material becomes a
+    holdout. Returns what restore_shading needs to undo the change.
+    """
+    changes = []
+    for material in bpy.data.materials:
+        if not material.use_nodes:
+            continue
+        texture = skin_texture_node(material)
+        if texture is None and not holdout_others:
+            continue
+        tree = material.node_tree
+        output = None
+        for node in tree.nodes:
+            if node.type == 'OUTPUT_MATERIAL' and node.is_active_output:
+                output = node
+                break
+        if output is None:
+            continue
+        surface = output.inputs['Surface']
+        original = surface.links[0].from_socket if surface.links else None
+        added = []
+        if texture is not None:
+            emission = tree.nodes.new('ShaderNodeEmission')
+            transparent = tree.nodes.new('ShaderNodeBsdfTransparent')
+            mix = tree.nodes.new('ShaderNodeMixShader')
+            added += [emission, transparent, mix]
+            tree.links.new(skin_color(tree, texture, added), emission.inputs['Color'])
+            tree.links.new(texture.outputs['Alpha'], mix.inputs['Fac'])
+            tree.links.new(transparent.outputs['BSDF'], mix.inputs[1])
+            tree.links.new(emission.outputs['Emission'], mix.inputs[2])
+            shader = mix.outputs['Shader']
+        else:
+            holdout = tree.nodes.new('ShaderNodeHoldout')
+            added.append(holdout)
+            shader = holdout.outputs['Holdout']
+        tree.links.new(shader, surface)
+        changes.append((tree, surface, original, added))
+    return changes
+
+def restore_shading(changes):
+    """Undo use_emission_shading"""
+    for tree, surface, original, added in changes:
+        for node in added:
+            tree.nodes.remove(node)
+        if original is not None:
+            tree.links.new(original, surface)
+
+def read_render_result(path):
+    """Save the last render as a float EXR at path and read it back as a (height, width, 4) array, top row first"""
+    import numpy as np
+    bpy.data.images['Render Result'].save_render(filepath=path)
+    image = bpy.data.images.load(path)
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+        os.remove(path)
+    return pixels.reshape(height, width, 4)[::-1]
+
+def bake_job(scene, output_path, width, height, device, threads=DEFAULT_THREADS, spans=None):
+    """Bake the model's UV and lighting maps for gather rendering to an .npz file
+    
+    Two layers are baked: 'front' with the whole skin opaque (the nearest skin
+    surface of every pixel) and 'base' with the second layer transparent (the
+    surface behind it). Each has a lighting map (a white skin rendered as usual,
+    linear RGBA) and a UV map (skin UV in RG, coverage in A, from a 1 sample
+    render with skin materials emitting their UVs). Pixels of other materials
+    only appear in the lighting maps.
+    """
+    import numpy as np
+    global current_settings
+    if spans is None:
+        spans = []
+    
+    start_time = time.time()
+    use_lightmap(scene, None)
+    setup_rendering(scene, device, DEFAULT_BG_COLOR, width, height, threads)
+    current_settings = None  # Settings are overridden below, the next render job sets them up again
+    if scene.render.engine != 'CYCLES':
+        raise RuntimeError("Baking needs the Cycles render engine")
+    saved = []
+    override_setting(saved, scene.render, 'film_transparent', True)
+    override_setting(saved, scene.render.image_settings, 'file_format', 'OPEN_EXR')
+    override_setting(saved, scene.render.image_settings, 'color_depth', '32')
+    textures = []
+    for material in bpy.data.materials:
+        node = skin_texture_node(material)
+        if node is not None:
+            textures.append((node, node.image))
+    masks = [('front', make_mask_skin('mcskin_bake_front')), ('base', make_mask_skin('mcskin_bake_base', True))]
+    exr_path = output_path + ".exr"
+    maps = {}
+    spans.append(["setup", start_time, time.time()])
+    
+    try:
+        for layer, mask in masks:
+            for node, _ in textures:
+                node.image = mask
+            start_time = time.time()
+            bpy.ops.render.render(write_still=False)
+            maps[layer + '_light'] = read_render_result(exr_path)
+            
+            # UV pass: one sharp sample per pixel so UVs are never blended
+            uv_saved = []
+            override_setting(uv_saved, scene.cycles, 'samples', 1)
+            override_setting(uv_saved, scene.cycles, 'use_adaptive_sampling', False)
+            override_setting(uv_saved, scene.cycles, 'use_denoising', False)
+            override_setting(uv_saved, scene.cycles, 'filter_width', 0.01)
+            changes = use_emission_shading(uv_color, holdout_others=True)
+            try:
+                bpy.ops.render.render(write_still=False)
+                maps[layer + '_uv'] = read_render_result(exr_path)
+            finally:
+                restore_shading(changes)
+                restore_settings(uv_saved)
+            spans.append(["render", start_time, time.time()])
+        
+        start_time = time.time()
+        np.savez_compressed(output_path, width=width, height=height, blend_file=bpy.data.filepath,
+                            **{name: value.astype(np.float16) for name, value in maps.items()})
+        spans.append(["write", start_time, time.time()])
+    finally:
+        for node, image in textures:
+            node.image = image
+        for _, mask in masks:
+            bpy.data.images.remove(mask)
+        restore_settings(saved)
+    print(f"Bake completed, output to: {output_path}")
+
+# Lightmap resolution (the skin's UV space) and samples of the emission-only renders it allows
+LIGHTMAP_SIZE = 1024
+LIGHTMAP_SAMPLES = 16
+
+# Samples of the one-off lightmap bake, whatever quality the jobs render at
+LIGHTMAP_BAKE_SAMPLES = 128
+
+# (path, shading changes, overridden settings, image) of the lightmap in use, if any
+lightmap_state = None
+
+def bake_diffuse_lighting(scene, size):
+    """Bake the lighting of the skin surfaces (diffuse direct and indirect, without color) to a float image"""
+    lightmap = bpy.data.images.new("mcskin_lightmap", size, size, alpha=False, float_buffer=True)
+    targets = []
+    objects = []
+    for obj in scene.objects:
+        if obj.type != 'MESH':
+            continue
+        for slot in obj.material_slots:
+            material = slot.material
+            if material is None or skin_texture_node(material) is None:
+                continue
+            if obj not in objects:
+                objects.append(obj)
+            if any(tree == material.node_tree for tree, _ in targets):
+                continue
+            # The bake writes to the active image node of each material
+            target = material.node_tree.nodes.new('ShaderNodeTexImage')
+            target.image = lightmap
+            material.node_tree.nodes.active = target
+            targets.append((material.node_tree, target))
+    try:
+        if not objects:
+            raise RuntimeError("No objects with the skin material to bake")
+        bpy.ops.object.select_all(action='DESELECT')
+        for obj in objects:
+            obj.select_set(True)
+        bpy.context.view_layer.objects.active = objects[0]
+        bpy.ops.object.bake(type='DIFFUSE', pass_filter={'DIRECT', 'INDIRECT'}, margin=4, use_clear=True)
+    except Exception:
+        bpy.data.images.remove(lightmap)
+        raise
+    finally:
+        for tree, target in targets:
+            tree.nodes.remove(target)
+    return lightmap
+
+def bake_lightmap(scene, path, size=LIGHTMAP_SIZE, bake_samples=LIGHTMAP_BAKE_SAMPLES):
+    """Bake the pose's lighting into a UV-space lightmap saved as EXR at path
+    
+    The base layer is baked with the second layer transparent and the second
+    layer with the whole skin opaque, since every skin covers its base layer
+    differently; the second layer therefore casts no shadows. The bake uses
+    bake_samples and the .blend's light paths, not the job's quality.
+    """
+    import numpy as np
+    saved = []
+    override_setting(saved, scene.cycles, 'samples', bake_samples)
+    override_setting(saved, scene.cycles, 'use_adaptive_sampling', False)
+    override_setting(saved, scene.cycles, 'use_denoising', False)
+    for attr, value in (blend_quality or {}).items():
+        if attr not in ('use_denoising', 'denoiser'):
+            override_setting(saved, scene.cycles, attr, value)
+    textures = []
+    for material in bpy.data.materials:
+        node = skin_texture_node(material)
+        if node is not None:
+            textures.append((node, node.image))
+    masks = {}
+    baked = {}
+    try:
+        for layer, base_only in (('base', True), ('overlay', False)):
+            masks[layer] = make_mask_skin(f"mcskin_lightmap_{layer}", base_only)
+            for node, _ in textures:
+                node.image = masks[layer]
+            image = bake_diffuse_lighting(scene, size)
+            pixels = np.empty(size * size * 4, dtype=np.float32)
+            image.pixels.foreach_get(pixels)
+            bpy.data.images.remove(image)
+            baked[layer] = pixels.reshape(size, size, 4)
+        
+        # Second layer UV areas from the opaque bake (rows start at the bottom)
+        combined = baked['base']
+        scale = size / 64
+        for left, top, right, bottom in OVERLAY_AREAS:
+            rows = slice(size - int(bottom * scale), size - int(top * scale))
+            columns = slice(int(left * scale), int(right * scale))
+            combined[rows, columns] = baked['overlay'][rows, columns]
+        
+        lightmap = bpy.data.images.new("mcskin_lightmap", size, size, alpha=False, float_buffer=True)
+        try:
+            lightmap.pixels.foreach_set(combined.reshape(-1))
+            temp_path = path + ".tmp.exr"
+            lightmap.filepath_raw = temp_path
+            lightmap.file_format = 'OPEN_EXR'
+            lightmap.save()
+            os.replace(temp_path, path)
+        finally:
+            bpy.data.images.remove(lightmap)
+    finally:
+        for node, image in textures:
+            node.image = image
+        for mask in masks.values():
+            bpy.data.images.remove(mask)
+        restore_settings(saved)
+
+def use_lightmap(scene, path, size=LIGHTMAP_SIZE, spans=None, bake_samples=LIGHTMAP_BAKE_SAMPLES):
+    """Render skins as emission lit by the lightmap at path, baking it first if missing
+    
+    With a lightmap the skin needs no path tracing, so the render drops to
+    LIGHTMAP_SAMPLES samples (just for antialiasing) and no light bounces,
+    whatever the job's quality. None switches back to the .blend's own shading.
+    """
+    global lightmap_state
+    if lightmap_state is not None:
+        if lightmap_state[0] == path:
+            return
+        _, changes, saved, image = lightmap_state
+        lightmap_state = None
+        restore_shading(changes)
+        restore_settings(saved)
+        bpy.data.images.remove(image)
+    if not path:
+        return
+    
+    if not os.path.exists(path):
+        start_time = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        bake_lightmap(scene, path, size, bake_samples)
+        if spans is not None:
+            spans.append(["bake", start_time, time.time()])
+    
+    image = bpy.data.images.load(path)
+    saved = []
+    override_setting(saved, scene.cycles, 'samples', LIGHTMAP_SAMPLES)
+    override_setting(saved, scene.cycles, 'use_adaptive_sampling', False)
+    override_setting(saved, scene.cycles, 'use_denoising', False)
+    override_setting(saved, scene.cycles, 'max_bounces', 0)
+    changes = use_emission_shading(lightmap_color(image))
+    lightmap_state = (path, changes, saved, image)
+    print(f"Using lightmap: {path}")
+
+def render_job(scene, skin_path, output_path, width, height, device, bg_color, threads=DEFAULT_THREADS, spans=None,
+               lightmap_path=None, lightmap_size=LIGHTMAP_SIZE, quality=None,
+               lightmap_bake_samples=LIGHTMAP_BAKE_SAMPLES):
+    """Render one skin to output_path with the given settings
+    
+    When spans is a list, a [phase, start, end] entry is appended for each phase of the job.
+    With lightmap_path the skin is rendered emission-only from the pose's baked lighting (see use_lightmap).
+    quality holds the job's Cycles quality settings (see apply_quality).
+    """
+    global current_settings
+    if spans is None:
+        spans = []
+    
+    # Check if file exists
+    if not os.path.exists(skin_path):
+        raise FileNotFoundError(f"Skin file not found: {skin_path}")
+    
+    # Set render parameters (only when they changed since the previous job)
+    start_time = time.time()
+    settings = (width, height, device, bg_color, threads, quality)
+    if settings != current_settings:
+        use_lightmap(scene, None)  # Lightmap shading overrides some of the settings, drop it first
+        setup_rendering(scene, device, bg_color, width, height, threads, quality)
+        current_settings = settings
+    
+    # Set output path
+    scene.render.filepath = output_path
+    spans.append(["setup", start_time, time.time()])
+    use_lightmap(scene, lightmap_path, lightmap_size, spans, lightmap_bake_samples)
+    
+    # Replace skin texture
+    start_time = time.time()
+    if replace_skin_texture(skin_path):
+        print("Skin texture updated successfully")
+    else:
+        print("Warning: No skin texture nodes found, you may need to check the Blender file manually")
+    spans.append(["texture", start_time, time.time()])
+    
+    # Execute rendering, then save the result separately so the PNG write is timed on its own
+    print("Starting rendering...")
+    start_time = time.time()
+    bpy.ops.render.render(write_still=False)
+    spans.append(["render", start_time, time.time()])
+    start_time = time.time()
+    bpy.data.images['Render Result'].save_render(filepath=output_path)
+    spans.append(["write", start_time, time.time()])
+    print(f"Rendering completed, output to: {output_path}")
+
+def run_jobs(scene, jobs, threads=DEFAULT_THREADS):
+    """Render each job dict in turn, emitting a status line per job"""
+    for job in jobs:
+        job_id = job.get("id")
+        skin_path = job.get("skin_path", "")
+        start_time = time.time()
+        spans = []
+        emit_status(id=job_id, status="started")
+        try:
+            if job.get("bake"):
+                bake_job(scene,
+                         job["output_path"],
+                         int(job.get("width", DEFAULT_WIDTH)),
+                         int(job.get("height", DEFAULT_HEIGHT)),
+                         parse_device(job.get("device", DEFAULT_DEVICE)),
+                         int(job.get("threads", threads)),
+                         spans)
+                emit_status(id=job_id, status="done", output_path=job["output_path"],
+                            elapsed=time.time() - start_time, timings=spans)
+                continue
+            render_job(scene,
+                       skin_path,
+                       job["output_path"],
+                       int(job.get("width", DEFAULT_WIDTH)),
+                       int(job.get("height", DEFAULT_HEIGHT)),
+                       parse_device(job.get("device", DEFAULT_DEVICE)),
+                       parse_bg_color(job.get("bg_color", DEFAULT_BG_COLOR)),
+                       int(job.get("threads", threads)),
+                       spans,
+                       job.get("lightmap_path"),
+                       int(job.get("lightmap_size", LIGHTMAP_SIZE)),
+                       job.get("quality"),
+                       int(job.get("lightmap_bake_samples", LIGHTMAP_BAKE_SAMPLES)))
+            emit_status(id=job_id, status="done", output_path=job["output_path"],
+                        elapsed=time.time() - start_time, timings=spans)
+        except Exception as e:
+            print(f"Error rendering {skin_path}: {e}")
+            emit_status(id=job_id, status="failed", error=str(e),
+                        elapsed=time.time() - start_time, timings=spans)
+        finally:
+            # Drop the skin image so memory stays flat over thousands of jobs
+            if skin_path:
+                release_skin_image(skin_path)
+
+def read_stdin_jobs():
+    """Yield job dicts read from stdin until quit or EOF"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            emit_status(status="failed", error=f"Invalid job line: {e}")
+            continue
+        
+        if job.get("cmd") == "quit":
+            return
+        yield job
+
+def load_manifest(manifest_path):
+    """Load job dicts from a JSON or NDJSON manifest file"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    try:
+        data = json.loads(content)
+    except ValueError:
+        # Not a single JSON document, read as NDJSON
+        data = [json.loads(line) for line in content.splitlines() if line.strip()]
+    
+    defaults = {}
+    if isinstance(data, dict) and "jobs" in data:
+        defaults = data.get("defaults", {})
+        data = data["jobs"]
+    elif isinstance(data, dict):
+        data = [data]  # NDJSON with a single job
+    
+    jobs = []
+    for i, job in enumerate(data):
+        merged = dict(defaults)
+        merged.update(job)
+        merged.setdefault("id", str(i))
+        jobs.append(merged)
+    return jobs
+
+def run_worker(scene, threads=DEFAULT_THREADS):
+    """Render jobs read from stdin until quit or EOF"""
+    emit_status(status="ready", blend_file=bpy.data.filepath)
+    run_jobs(scene, read_stdin_jobs(), threads)
+    emit_status(status="exit")
+
+def run_manifest(scene, manifest_path, threads=DEFAULT_THREADS):
+    """Render every job listed in a manifest file"""
+    try:
+        jobs = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: Failed to read manifest {manifest_path}: {e}")
+        emit_status(status="failed", error=f"Invalid manifest: {e}")
+        sys.exit(1)
+    
+    print(f"Loaded {len(jobs)} jobs from manifest: {manifest_path}")
+    emit_status(status="ready", blend_file=bpy.data.filepath, total=len(jobs))
+    run_jobs(scene, jobs, threads)
+    emit_status(status="exit")
+
+def run_single(scene, argv, threads=DEFAULT_THREADS):
+    """Render a single skin from positional command line arguments"""
+    skin_path = argv[0]
+    output_path = argv[1]
+    
+    # Set default dimensions
+    width = DEFAULT_WIDTH
+    height = DEFAULT_HEIGHT
+    
+    # Set default device to CPU
+    device = DEFAULT_DEVICE
+    
+    # Set default background color
+    bg_color = DEFAULT_BG_COLOR
+    
+    # Get width and height parameters (if provided)
+    if len(argv) >= 4:
+        try:
+            width = int(argv[2])
+            height = int(argv[3])
+            print(f"Using custom dimensions: {width}x{height}")
+        except ValueError:
+            print("Warning: Width/height parameters are not valid integers, using default size 1024x1024")
+    
+    # Get device parameter (if provided)
+    if len(argv) >= 5:
+        device = parse_device(argv[4])
+    
+    # Get background color parameter (if provided)
+    if len(argv) >= 6:
+        bg_color = parse_bg_color(argv[5])
+    
+    print(f"Using render device: {device}")
+    print(f"Background color: {bg_color}")
+    
+    print(f"Skin path: {skin_path}")
+    print(f"Output path: {output_path}")
+    
+    try:
+        render_job(scene, skin_path, output_path, width, height, device, bg_color, threads)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    # Clean up temporary data
+    for img in bpy.data.images:
+        if img.name != bpy.data.images[0].name:  # Keep original image
+            bpy.data.images.remove(img)
+
+# Get command line arguments
+argv = sys.argv
+argv = argv[argv.index('--') + 1:] if '--' in argv else []  # Skip arguments before --
+
+# Check current blend file
+current_blend_file = bpy.data.filepath
+print(f"Current blend file: {current_blend_file}")
+
+# Get render thread count (if provided)
+try:
+    threads = int(pop_option(argv, '--threads', DEFAULT_THREADS))
+except ValueError:
+    print("Warning: Thread count is not a valid integer, using all cores")
+    threads = DEFAULT_THREADS
 
-# Execute rendering
-print("Starting rendering...")
-bpy.ops.render.render(write_still=True)
-print(f"Rendering completed, output to: {output_path}")
+# Get current scene
+scene = bpy.context.scene
 
-# Clean up temporary data
-for img in bpy.data.images:
-    if img.name != bpy.data.images[0].name:  # Keep original image
-        bpy.data.images.remove(img)
+if argv and argv[0] == '--worker':
+    run_worker(scene, threads)
+elif argv and argv[0] == '--manifest':
+    if len(argv) < 2:
+        print("Error: Missing manifest path")
+        sys.exit(1)
+    run_manifest(scene, argv[1], threads)
+elif len(argv) < 2:
+    print("Error: Missing parameters")
+    print("Usage: blender --background [blender_file] --python blender_render_script.py -- [skin_path] [output_path] [width] [height] [device] [bg_color]")
+    print("   or: blender --background [blender_file] --python blender_render_script.py -- --worker")
+    print("   or: blender --background [blender_file] --python blender_render_script.py -- --manifest [manifest_path]")
+    sys.exit(1)
+else:
+    run_single(scene, argv, threads)
 
-print("Script execution completed")
\ No newline at end of file
+print("Script execution completed")
@@ -0,0 +1,404 @@
+import os
+import re
+import json
+import queue
+import logging
+import logging.handlers
+import subprocess
+import threading
+import itertools
+import tempfile
+import time
+
+"""
+Persistent Blender worker client
+
+Starts blender_render_script.py in worker mode for one .blend file and sends it
+render jobs over stdin, so Blender startup and scene loading are paid once per
+model file instead of once per skin.
+
+run_manifest renders a whole group of jobs for one model file with a single
+Blender invocation using the script's manifest mode; `mcskin manifest` uses it
+to render a manifest file (see read_manifest) one model file at a time.
+
+Blender's console output is read line by line as it is produced. Cycles
+progress lines ("Sample 32/128", "Updating Shaders", ...) are parsed into live
+per-job progress, and the full output is spooled to a rotating log file
+rather than kept in memory.
+"""
+
+# Must match STATUS_PREFIX in blender_render_script.py
+STATUS_PREFIX = "@@MCSKIN "
+
+# Seconds to wait for Blender to load the model and report ready
+STARTUP_TIMEOUT = 120
+
+# Rotating log of all Blender console output
+LOG_FILE = os.path.join(os.path.expanduser('~'), '.mcskin_logs', 'blender.log')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+blender_log = logging.getLogger('mcskin.blender')
+blender_log.propagate = False
+log_settings = {'configured': False, 'echo': True}
+log_lock = threading.Lock()
+
+# Cycles progress: "Sample 32/128", "Rendering 32 / 128 samples" (Blender 4) and "Rendered 3/16 Tiles" (2.7x)
+SAMPLE_PATTERN = re.compile(r'\b(?:Sample|Rendering)\s+(\d+)\s*/\s*(\d+)')
+TILE_PATTERN = re.compile(r'\bRendered\s+(\d+)\s*/\s*(\d+)\s+Tiles')
+PHASE_WORDS = ('Synchronizing', 'Updating', 'Loading', 'Building', 'Initializing', 'Compiling',
+               'Waiting', 'Denoising', 'Finished', 'Sample', 'Rendering', 'Rendered')
+
+class BlenderWorkerError(Exception):
+    """Raised when the Blender worker process dies or reports an error"""
+
+def default_script_path():
+    """Path of blender_render_script.py next to this module"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_render_script.py")
+
+def configure_blender_log(path=LOG_FILE, echo=True, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """Send Blender output to a rotating log file (path None: no file); echo also prints it"""
+    with log_lock:
+        for handler in list(blender_log.handlers):
+            blender_log.removeHandler(handler)
+            handler.close()
+        handler = logging.NullHandler()
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                               encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            except OSError as e:
+                print(f"Cannot write Blender log {path}: {e}")
+        blender_log.addHandler(handler)
+        blender_log.setLevel(logging.INFO)
+        log_settings['configured'] = True
+        log_settings['echo'] = echo
+
+def log_blender_line(line, source=""):
+    """Write one line of Blender output to the log (and the console if echoing)"""
+    if not log_settings['configured']:
+        configure_blender_log()
+    blender_log.info(f"[{source}] {line}" if source else line)
+    if log_settings['echo']:
+        print(f"[Blender] {line}")
+
+def parse_progress(line):
+    """Parse a Cycles progress line into {'phase', 'sample', 'samples'}, or None"""
+    if not line.startswith('Fra:') and 'Tiles' not in line:
+        return None
+    progress = {'phase': None, 'sample': None, 'samples': None}
+    for field in line.split('|'):
+        field = field.strip()
+        if field.startswith(PHASE_WORDS):
+            progress['phase'] = field
+            break
+    match = SAMPLE_PATTERN.search(line) or TILE_PATTERN.search(line)
+    if match:
+        progress['sample'], progress['samples'] = int(match.group(1)), int(match.group(2))
+        progress['phase'] = 'Rendering'
+    if progress['phase'] is None:
+        return None
+    return progress
+
+def pump_output(stream, lines, on_line=None):
+    """Read Blender output as it arrives: queue status lines, pass others to on_line
+
+    on_line(line) defaults to writing the line to the Blender log.
+    """
+    for line in stream:
+        line = line.rstrip('\n')
+        if line.startswith(STATUS_PREFIX):
+            try:
+                lines.put(json.loads(line[len(STATUS_PREFIX):]))
+            except ValueError:
+                print(f"Invalid worker status line: {line}")
+        elif on_line:
+            on_line(line)
+        else:
+            log_blender_line(line)
+    # None marks the end of output (process exited)
+    lines.put(None)
+
+def affinity_setter(cpu_affinity):
+    """Return a preexec_fn that pins the child process to the given cores
+
+    The affinity is set before exec so every thread Blender starts inherits it.
+    Returns None when no pinning is requested or the platform lacks sched_setaffinity.
+    """
+    if not cpu_affinity or not hasattr(os, 'sched_setaffinity'):
+        return None
+    cores = set(cpu_affinity)
+
+    def set_affinity():
+        os.sched_setaffinity(0, cores)
+    return set_affinity
+
+class BlenderWorker:
+    """Long-lived Blender process that renders many skins for one model file"""
+
+    def __init__(self, blender_path, model_file, script_path=None, threads=0, cpu_affinity=None, job_defaults=None):
+        self.blender_path = blender_path
+        self.model_file = model_file
+        self.script_path = script_path or default_script_path()
+        self.threads = threads  # Cycles render threads (0 = all cores)
+        self.cpu_affinity = cpu_affinity  # Cores to pin the process to (Linux only)
+        self.job_defaults = job_defaults or {}  # Fields added to every job unless it sets them
+        self.process = None
+        self.lines = queue.Queue()  # Status lines read from Blender stdout
+        self.job_ids = itertools.count(1)
+        self.reader_thread = None
+        self.current_job_id = None  # Job being rendered, for progress reporting
+        self.progress_callback = None
+        self.first_output_at = None  # When Blender printed its first line
+        self.startup_spans = []  # [phase, start, end] of process spawn and .blend load
+
+    def build_command(self):
+        """Build the Blender command line for worker mode"""
+        cmd = [
+            self.blender_path,
+            '--background',
+            self.model_file,
+            '--python',
+            self.script_path,
+            '--',
+            '--worker'
+        ]
+        if self.threads:
+            cmd += ['--threads', str(self.threads)]
+        return cmd
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        """Start Blender and wait until the model is loaded"""
+        # Blender would silently fall back to its default scene
+        if not os.path.exists(self.model_file):
+            raise BlenderWorkerError(f"Model file not found: {self.model_file}")
+        cmd = self.build_command()
+        print(f"Starting Blender worker: {' '.join(cmd)}")
+        start_time = time.time()
+        self.first_output_at = None
+        self.process = subprocess.Popen(cmd,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        text=True,
+                                        encoding='utf-8',
+                                        errors='replace',
+                                        bufsize=1,
+                                        preexec_fn=affinity_setter(self.cpu_affinity))
+
+        # Read Blender output in the background so a blocking readline can time out
+        self.reader_thread = threading.Thread(target=pump_output, args=(self.process.stdout, self.lines, self._on_line),
+                                              daemon=True)
+        self.reader_thread.start()
+
+        status = self._wait_status(timeout)
+        if status.get('status') != 'ready':
+            self.kill()
+            raise BlenderWorkerError(f"Unexpected worker status: {status}")
+        # Blender prints its banner once running, before it reads the .blend file
+        ready_time = time.time()
+        loading_time = self.first_output_at or ready_time
+        self.startup_spans = [['spawn', start_time, loading_time], ['load', loading_time, ready_time]]
+        print(f"Blender worker ready: {self.model_file}")
+
+    @property
+    def pid(self):
+        """Process id of the running Blender, or None"""
+        return self.process.pid if self.process is not None else None
+
+    def is_alive(self):
+        """Check whether the Blender process is still running"""
+        return self.process is not None and self.process.poll() is None
+
+    def render(self, job, timeout=60, on_progress=None):
+        """Send one job to the worker and wait for its result
+
+        job is a dict with skin_path, output_path, width, height, device and bg_color.
+        on_progress(progress) is called from the reader thread with each parsed
+        Cycles progress line (see parse_progress) while the job renders.
+        Returns the status dict reported by Blender ('done' or 'failed'), with
+        its phase spans in 'timings' (see blender_render_script.py).
+        """
+        if not self.is_alive():
+            raise BlenderWorkerError("Blender worker is not running")
+
+        job = dict(self.job_defaults, **job)
+        job.setdefault('id', str(next(self.job_ids)))
+        self.current_job_id = job['id']
+        self.progress_callback = on_progress
+        try:
+            return self._send_and_wait(job, timeout)
+        finally:
+            self.progress_callback = None
+            self.current_job_id = None
+
+    def _send_and_wait(self, job, timeout):
+        """Write a job to Blender's stdin and wait for its final status"""
+        try:
+            self.process.stdin.write(json.dumps(job, ensure_ascii=False) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            self.kill()
+            raise BlenderWorkerError(f"Failed to send job to Blender worker: {e}")
+
+        # Skip stale status lines from earlier jobs (e.g. after a timeout); the
+        # timeout covers the whole job, not the wait for each status line
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = self._wait_status(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                # A stuck render blocks the whole process, so the worker can't be reused
+                self.kill()
+                raise subprocess.TimeoutExpired(self.build_command(), timeout)
+            if status.get('id') == job['id'] and status.get('status') != 'started':
+                return status
+
+    def close(self, timeout=10):
+        """Ask the worker to quit and wait for it to exit"""
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.write(json.dumps({'cmd': 'quit'}) + "\n")
+            self.process.stdin.flush()
+            self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        """Terminate the Blender process immediately"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def _on_line(self, line):
+        """Log a line of Blender output and report render progress"""
+        if self.first_output_at is None:
+            self.first_output_at = time.time()
+        log_blender_line(line, f"{os.path.basename(self.model_file)} pid {self.process.pid}")
+        callback = self.progress_callback
+        if callback is None:
+            return
+        progress = parse_progress(line)
+        if progress is not None:
+            try:
+                callback(progress)
+            except Exception as e:
+                print(f"Error reporting render progress: {e}")
+
+    def _wait_status(self, timeout):
+        """Wait for the next status line from the worker"""
+        try:
+            status = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            raise subprocess.TimeoutExpired(self.build_command(), timeout)
+        if status is None:
+            returncode = self.process.wait()
+            raise BlenderWorkerError(f"Blender worker exited with code {returncode}")
+        return status
+
+def read_manifest(manifest_path):
+    """Load job dicts from a JSON or NDJSON manifest file
+
+    Accepts the formats of the script's manifest mode (see load_manifest in
+    blender_render_script.py); jobs without an id are numbered in file order.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    try:
+        data = json.loads(content)
+    except ValueError:
+        # Not a single JSON document, read as NDJSON
+        data = [json.loads(line) for line in content.splitlines() if line.strip()]
+    defaults = {}
+    if isinstance(data, dict) and 'jobs' in data:
+        defaults = data.get('defaults', {})
+        data = data['jobs']
+    elif isinstance(data, dict):
+        data = [data]  # NDJSON with a single job
+    if not isinstance(data, list) or not all(isinstance(job, dict) for job in data):
+        raise ValueError("A manifest holds a list of job objects")
+    jobs = []
+    for i, job in enumerate(data):
+        merged = dict(defaults)
+        merged.update(job)
+        merged.setdefault('id', str(i))
+        jobs.append(merged)
+    return jobs
+
+def write_manifest(jobs, manifest_path):
+    """Write jobs as an NDJSON manifest"""
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        for job in jobs:
+            f.write(json.dumps(job, ensure_ascii=False) + "\n")
+
+def run_manifest(blender_path, model_file, jobs, on_status=None, timeout=60, script_path=None, threads=0):
+    """Render all jobs for one model file in a single Blender invocation
+
+    on_status is called with each status dict as Blender reports it ('started', 'done', 'failed').
+    timeout is the longest allowed gap between two status lines (i.e. per job).
+    Returns a dict mapping job id to its final status; jobs that never finished are marked 'failed'.
+    """
+    jobs = [dict(job) for job in jobs]
+    for i, job in enumerate(jobs):
+        job.setdefault('id', str(i))
+
+    fd, manifest_path = tempfile.mkstemp(prefix="mcskin_manifest_", suffix=".ndjson")
+    os.close(fd)
+    results = {}
+    try:
+        write_manifest(jobs, manifest_path)
+        cmd = [
+            blender_path,
+            '--background',
+            model_file,
+            '--python',
+            script_path or default_script_path(),
+            '--',
+            '--manifest',
+            manifest_path
+        ]
+        if threads:
+            cmd += ['--threads', str(threads)]
+        print(f"Executing command: {' '.join(cmd)}")
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   text=True,
+                                   encoding='utf-8',
+                                   errors='replace',
+                                   bufsize=1)
+        lines = queue.Queue()
+        threading.Thread(target=pump_output, args=(process.stdout, lines), daemon=True).start()
+
+        # Startup includes loading the .blend, so allow the longer startup timeout first
+        wait_timeout = max(timeout, STARTUP_TIMEOUT)
+        while True:
+            try:
+                status = lines.get(timeout=wait_timeout)
+            except queue.Empty:
+                print(f"Blender manifest run timed out: {model_file}")
+                process.kill()
+                break
+            if status is None:
+                break
+            wait_timeout = timeout
+            if status.get('id') is not None and status.get('status') in ('done', 'failed'):
+                results[status['id']] = status
+            if on_status:
+                on_status(status)
+        process.wait()
+    finally:
+        os.remove(manifest_path)
+
+    # Report jobs lost to a crash or timeout
+    for job in jobs:
+        if job['id'] not in results:
+            status = {'id': job['id'], 'status': 'failed', 'error': 'Blender exited before the job finished'}
+            results[job['id']] = status
+            if on_status:
+                on_status(status)
+    return results
@@ -0,0 +1,361 @@
+import os
+import sys
+import time
+import json
+import glob
+import signal
+import argparse
+import tempfile
+import threading
+import contextlib
+from blender_worker import LOG_FILE, configure_blender_log, read_manifest, run_manifest
+from render_pool import load_worker_layout, parse_worker_layout
+from render_service import RenderService, create_server, run_load
+from render_watch import FolderWatcher
+from render_backend import create_backend
+from render_quality import add_quality_arguments, quality_from_args
+from render_budget import parse_duration
+from render_timing import open_timing_log, load_timings, summarize_timings, write_chrome_trace
+from autotune import make_calibration_skins
+from benchmark import add_benchmark_arguments, benchmark_main
+from render_core import (BatchRenderer, ASPECT_RATIOS, MODEL_NUMS, MODEL_TYPES, batch_time_str, build_batch_jobs,
+                         detect_model_type, get_model_file)
+
+"""
+Headless command line for batch rendering (no tkinter needed)
+
+Uses the same job building, compositing and worker pool as the GUI. Progress
+is written to stdout as one JSON object per line (events 'batch', 'status',
+'started', 'progress', 'result' and 'finished'); other log messages go to
+stderr. Blender's own output is written to a rotating log file, and to stderr
+only with --echo-blender. The exit code is 0 when every render succeeded and
+1 otherwise.
+
+'serve' runs the local HTTP render service (see render_service.py) and
+'loadgen' sends it concurrent requests and prints the latency percentiles.
+'watch' renders skins as they are dropped into a folder (see render_watch.py).
+'manifest' renders a prepared JSON/NDJSON job list with one Blender invocation
+per model file (the script's manifest mode) and prints each job status.
+
+Usage:
+python -m mcskin render --blender [blender_path] --skins dir/ --pose 3 --ratio 16:9 --workers 8
+python -m mcskin render --blender [blender_path] --skins dir/ --quality draft --samples 8
+python -m mcskin render --blender [blender_path] --skins dir/ --workers 8 --budget 2h
+python -m mcskin resume --blender [blender_path] [output_dir]/[time]_render_journal.jsonl
+python -m mcskin serve --blender [blender_path] --workers 4 --port 8765
+python -m mcskin loadgen --url http://127.0.0.1:8765 --requests 200 --concurrency 16
+python -m mcskin watch --blender [blender_path] --dir uploads/ --output renders/ --workers 4
+python -m mcskin manifest --blender [blender_path] jobs.ndjson
+"""
+
+SKIN_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def find_skin_files(paths):
+    """Expand skin files and directories (searched recursively) into a sorted list of skin paths
+
+    Raises ValueError for a path that is neither a directory nor a skin image file.
+    """
+    skin_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, '**', '*'), recursive=True)
+            skin_paths.extend(sorted(p for p in found if p.lower().endswith(SKIN_EXTENSIONS)))
+        elif not os.path.isfile(path):
+            raise ValueError(f"Skin file or directory not found: {path}")
+        elif not path.lower().endswith(SKIN_EXTENSIONS):
+            raise ValueError(f"Not a skin image ({', '.join(SKIN_EXTENSIONS)}): {path}")
+        else:
+            skin_paths.append(path)
+    return skin_paths
+
+def progress_printer(stream):
+    """Progress callback writing each event as a JSON line"""
+    lock = threading.Lock()
+
+    def on_progress(event):
+        with lock:
+            stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+            stream.flush()
+    return on_progress
+
+def add_blender_arguments(parser):
+    """Options of every command that runs Blender"""
+    parser.add_argument('--blender', default=os.environ.get('MCSKIN_BLENDER'),
+                        help="Path to the Blender executable (default: $MCSKIN_BLENDER)")
+    parser.add_argument('--workers', help="Worker layout, e.g. 8 or 4x4 (default: tuned layout or 1)")
+    parser.add_argument('--backend', default='blender',
+                        help="Render backend: blender[:lightmap=1,lightmap_size=N,bake_samples=N] (lightmap: bake each "
+                             "pose's lighting once, then render skins emission-only), baked (gather from "
+                             "baked UV maps), raster[:ssaa=N] (NumPy software renderer) or "
+                             "fake[:latency=S,jitter=F,startup=S,failure_rate=P,crash_rate=P,seed=N] "
+                             "to run without Blender")
+    parser.add_argument('--log-file', default=LOG_FILE, help="Rotating log of Blender's output")
+    parser.add_argument('--echo-blender', action='store_true', help="Also print Blender's output to stderr")
+
+def add_worker_arguments(parser):
+    """Options of every command that renders jobs on Blender workers"""
+    add_blender_arguments(parser)
+    parser.add_argument('--timeout', type=float,
+                        help="Seconds before a single render is abandoned (default: adaptive, from past render times)")
+    parser.add_argument('--attempts', type=int, default=3,
+                        help="Attempts for a render that times out or crashes Blender before its skin is "
+                             "quarantined (default: 3)")
+    parser.add_argument('--timings', help="Append a per-phase timing record of every render to this JSONL file")
+    parser.add_argument('--trace', help="Write a Chrome trace of this run's worker timeline to this JSON file")
+
+def add_common_arguments(parser):
+    """Options shared by render and resume"""
+    add_worker_arguments(parser)
+    parser.add_argument('--no-cache', action='store_true', help="Always render, never reuse cached renders")
+    parser.add_argument('--budget', type=parse_duration,
+                        help="Time the whole batch may take, e.g. 2h or 90m: renders drop to fewer samples and "
+                             "then lower resolution as needed to finish in time")
+
+def worker_layout(args):
+    """(workers, threads) from --workers, else the tuned layout, else a single worker"""
+    if args.workers:
+        return parse_worker_layout(args.workers)
+    return load_worker_layout() or (1, 0)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="mcskin", description="Batch render Minecraft skins with Blender")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    render = commands.add_parser('render', help="Render a batch of skins")
+    render.add_argument('--skins', nargs='+', required=True, help="Skin files or directories")
+    render.add_argument('--output', default='.', help="Output directory (default: current directory)")
+    render.add_argument('--model', default='standard', choices=MODEL_TYPES + ['auto'],
+                        help="Body type; 'auto' detects slim arms from each skin")
+    render.add_argument('--pose', default='1', choices=MODEL_NUMS + ['all'], help="Pose model number or 'all'")
+    render.add_argument('--ratio', default='1:1', choices=list(ASPECT_RATIOS), help="Output aspect ratio")
+    render.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    render.add_argument('--bg-color', default='#00000000', help="Background color as #RRGGBB or #RRGGBBAA")
+    render.add_argument('--background-image', help="Image composited behind every render")
+    add_quality_arguments(render)
+    add_common_arguments(render)
+
+    resume = commands.add_parser('resume', help="Resume an interrupted batch from its journal")
+    resume.add_argument('journal', help="The batch's *_render_journal.jsonl file")
+    add_common_arguments(resume)
+
+    serve = commands.add_parser('serve', help="Run the local HTTP render service")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--queue-size', type=int, default=100, help="Jobs that may wait before requests are rejected")
+    serve.add_argument('--background-image', help="Image composited behind every render")
+    serve.add_argument('--verbose', action='store_true', help="Log every HTTP request")
+    add_worker_arguments(serve)
+
+    loadgen = commands.add_parser('loadgen', help="Measure render latency of a running service")
+    loadgen.add_argument('--url', default='http://127.0.0.1:8765')
+    loadgen.add_argument('--skins', nargs='*', help="Skins to send (default: generated calibration skins)")
+    loadgen.add_argument('--requests', type=int, default=100)
+    loadgen.add_argument('--concurrency', type=int, default=8)
+    loadgen.add_argument('--model', default='auto', choices=MODEL_TYPES + ['auto'])
+    loadgen.add_argument('--pose', default='1', choices=MODEL_NUMS)
+    loadgen.add_argument('--ratio', default='1:1', choices=list(ASPECT_RATIOS))
+
+    watch = commands.add_parser('watch', help="Render skins as they are added to a folder")
+    watch.add_argument('--dir', required=True, help="Folder to watch (including sub folders)")
+    watch.add_argument('--output', help="Output directory (default: [dir]/renders)")
+    watch.add_argument('--model', default='auto', choices=MODEL_TYPES + ['auto'])
+    watch.add_argument('--pose', default='1', choices=MODEL_NUMS)
+    watch.add_argument('--ratio', default='1:1', choices=list(ASPECT_RATIOS))
+    watch.add_argument('--device', default='CPU', choices=['CPU', 'GPU'])
+    watch.add_argument('--bg-color', default='#00000000', help="Background color as #RRGGBB or #RRGGBBAA")
+    watch.add_argument('--background-image', help="Image composited behind every render")
+    add_quality_arguments(watch)
+    watch.add_argument('--debounce', type=float, default=0.5, help="Seconds a file must stay unchanged")
+    watch.add_argument('--interval', type=float, default=2.0, help="Scan interval when polling")
+    watch.add_argument('--polling', action='store_true', help="Poll even where inotify is available")
+    add_worker_arguments(watch)
+
+    manifest = commands.add_parser('manifest', help="Render a job manifest with one Blender run per model file")
+    manifest.add_argument('file', help="JSON list of jobs, {\"defaults\": {...}, \"jobs\": [...]} or one JSON job "
+                                       "per line; a job's model_file (or model and pose) picks the .blend file")
+    manifest.add_argument('--blender', default=os.environ.get('MCSKIN_BLENDER'),
+                          help="Path to the Blender executable (default: $MCSKIN_BLENDER)")
+    manifest.add_argument('--threads', type=int, default=0, help="Render threads (default: all cores)")
+    manifest.add_argument('--timeout', type=float, default=60,
+                          help="Seconds a single job may take before the Blender run is abandoned (default: 60)")
+    manifest.add_argument('--log-file', default=LOG_FILE, help="Rotating log of Blender's output")
+    manifest.add_argument('--echo-blender', action='store_true', help="Also print Blender's output to stderr")
+
+    timings = commands.add_parser('timings', help="Summarize a --timings file by render phase")
+    timings.add_argument('file', help="JSONL file written with --timings")
+    timings.add_argument('--trace', help="Also convert the records to a Chrome trace JSON file")
+
+    benchmark = commands.add_parser('benchmark', help="Benchmark every model file and aspect ratio "
+                                                      "with a synthetic skin corpus")
+    add_blender_arguments(benchmark)
+    add_benchmark_arguments(benchmark)
+    return parser
+
+def render(args, backend, timing_log):
+    """Render a new batch or resume one, printing progress as JSON lines"""
+    workers, threads = worker_layout(args)
+    on_progress = progress_printer(sys.stdout)
+    renderer = BatchRenderer(args.blender, workers, threads, use_cache=not args.no_cache,
+                             timeout=args.timeout, max_attempts=args.attempts, on_progress=on_progress,
+                             timing_log=timing_log, backend=backend, budget=args.budget)
+
+    # Keep stdout for progress lines only
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.command == 'resume':
+            summary = renderer.resume(args.journal)
+        else:
+            skin_paths = args.skin_paths
+            if not skin_paths:
+                print("No skin images found", file=sys.stderr)
+                return 2
+            skin_files = [{'path': path, 'model': detect_model_type(path) if args.model == 'auto' else args.model}
+                          for path in skin_paths]
+            os.makedirs(args.output, exist_ok=True)
+            time_str = batch_time_str(args.output)
+            jobs = build_batch_jobs(skin_files, args.output, time_str, args.ratio, args.device, args.bg_color,
+                                    model_num=args.pose if args.pose != 'all' else '1',
+                                    all_poses=args.pose == 'all', quality=quality_from_args(args),
+                                    backend=backend)
+            summary = renderer.render(jobs, args.output, time_str, args.background_image)
+    return 0 if summary['failed'] == 0 else 1
+
+def watch(args, backend, timing_log):
+    """Watch a folder and render new skins until interrupted"""
+    workers, threads = worker_layout(args)
+    defaults = {'model': args.model, 'pose': args.pose, 'ratio': args.ratio, 'device': args.device,
+                'bg_color': args.bg_color, 'quality': quality_from_args(args)}
+    if args.background_image:
+        defaults['background_image'] = os.path.abspath(args.background_image)
+    watcher = FolderWatcher(args.blender, args.dir, args.output, workers, threads, defaults,
+                            debounce=args.debounce, interval=args.interval, use_inotify=not args.polling,
+                            timeout=args.timeout, max_attempts=args.attempts, on_progress=progress_printer(sys.stdout),
+                            timing_log=timing_log, backend=backend)
+    # Containers stop with SIGTERM; finish the queued renders first
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+def serve(args, backend, timing_log):
+    """Run the render service until interrupted"""
+    workers, threads = worker_layout(args)
+    service = RenderService(args.blender, workers, threads, queue_size=args.queue_size,
+                            background_image=args.background_image, timeout=args.timeout,
+                            max_attempts=args.attempts, timing_log=timing_log, backend=backend)
+    server = create_server(service, args.host, args.port, verbose=args.verbose)
+    service.start()
+    print(f"Listening on http://{args.host}:{server.server_port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+def render_manifest(args, jobs):
+    """Render manifest jobs, one Blender invocation per model file, printing each status as a JSON line"""
+    groups = {}
+    for job in jobs:
+        model_file = job.get('model_file') or get_model_file(job.get('model', 'standard'), str(job.get('pose', '1')))
+        groups.setdefault(model_file, []).append(job)
+    print_event = progress_printer(sys.stdout)
+    failed = 0
+    with contextlib.redirect_stdout(sys.stderr):
+        for model_file, group in groups.items():
+            def on_status(status, model_file=model_file):
+                print_event(dict(status, event='job', model_file=model_file))
+            results = run_manifest(args.blender, model_file, group, on_status=on_status, timeout=args.timeout,
+                                   threads=args.threads)
+            failed += sum(1 for status in results.values() if status.get('status') != 'done')
+    return 0 if failed == 0 else 1
+
+def loadgen(args):
+    """Send concurrent render requests and print the latency summary as JSON"""
+    with tempfile.TemporaryDirectory(prefix="mcskin_loadgen_") as skin_dir:
+        skin_paths = args.skin_paths or make_calibration_skins(skin_dir, 8)
+        summary = run_load(args.url, skin_paths, args.requests, args.concurrency,
+                           {'model': args.model, 'pose': args.pose, 'ratio': args.ratio})
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['failed'] == 0 else 1
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # Report bad --workers and --skins values as usage errors before anything starts
+    if getattr(args, 'workers', None):
+        try:
+            parse_worker_layout(args.workers)
+        except ValueError:
+            parser.error(f"Invalid worker layout: {args.workers} (e.g. 8 or 4x4)")
+    if args.command in ('render', 'loadgen'):
+        try:
+            args.skin_paths = find_skin_files(args.skins or [])
+        except ValueError as e:
+            parser.error(str(e))
+    if args.command == 'loadgen':
+        return loadgen(args)
+    if args.command == 'manifest':
+        try:
+            jobs = read_manifest(args.file)
+        except (OSError, ValueError) as e:
+            parser.error(f"Cannot read manifest {args.file}: {e}")
+        if not args.blender:
+            print("Blender executable not set, use --blender or $MCSKIN_BLENDER", file=sys.stderr)
+            return 2
+        configure_blender_log(args.log_file, echo=args.echo_blender)
+        return render_manifest(args, jobs)
+    if args.command == 'timings':
+        try:
+            records = load_timings(args.file)
+        except (OSError, ValueError) as e:
+            parser.error(f"Cannot read timings {args.file}: {e}")
+        if args.trace:
+            try:
+                write_chrome_trace(records, args.trace)
+            except (OSError, ValueError) as e:
+                parser.error(f"Cannot write trace {args.trace}: {e}")
+        print(json.dumps(summarize_timings(records), indent=2))
+        return 0
+    try:
+        backend = create_backend(args.backend, args.blender)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if backend.name in ('blender', 'baked') and not args.blender:
+        print("Blender executable not set, use --blender or $MCSKIN_BLENDER", file=sys.stderr)
+        return 2
+    configure_blender_log(args.log_file, echo=args.echo_blender)
+    if args.command == 'benchmark':
+        workers, threads = worker_layout(args)
+        return benchmark_main(args, workers, threads, backend)
+
+    # A trace is built from the timing records of this run, kept in a temporary file if not asked for
+    run_start = time.time()
+    timings_file = args.timings
+    if args.trace and not timings_file:
+        fd, timings_file = tempfile.mkstemp(prefix="mcskin_timings_", suffix=".jsonl")
+        os.close(fd)
+    timing_log = open_timing_log(timings_file)
+    try:
+        if args.command == 'serve':
+            return serve(args, backend, timing_log)
+        if args.command == 'watch':
+            return watch(args, backend, timing_log)
+        return render(args, backend, timing_log)
+    finally:
+        if timing_log is not None:
+            timing_log.close()
+        if args.trace and timing_log is not None:
+            records = [record for record in load_timings(timings_file) if (record.get('start') or 0) >= run_start]
+            write_chrome_trace(records, args.trace)
+            print(f"Trace written to: {args.trace}", file=sys.stderr)
+        if timings_file != args.timings:
+            os.remove(timings_file)
+
+if __name__ == "__main__":
+    sys.exit(main())
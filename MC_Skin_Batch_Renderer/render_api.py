@@ -0,0 +1,142 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from render_pool import RenderPool
+from render_scheduler import StreamScheduler
+from render_retry import RetryPolicy
+from render_quality import DEFAULT_QUALITY, quality_settings
+from render_core import ASPECT_RATIOS, SCRIPT_PATH, apply_background_image, detect_model_type, get_model_file, hex_to_rgb
+
+"""
+Embeddable rendering API
+
+render_skins() renders an iterable of skin jobs in-process and yields a
+RenderResult for each one as soon as it finishes (in completion order, not
+input order):
+
+    from render_api import render_skins
+    for result in render_skins(skin_jobs, blender_path, workers=4, as_bytes=True):
+        upload(result.id, result.data)
+
+Memory stays bounded for any number of jobs: the job iterator is only read a
+few jobs ahead of the workers, and when the caller stops consuming results
+the workers wait instead of piling results up.
+"""
+
+RenderResult = namedtuple('RenderResult', ['id', 'skin_path', 'status', 'output_path', 'data', 'error', 'elapsed'])
+RenderResult.__doc__ = """Result of one render job
+
+status is 'done' or 'failed'. data holds the PNG bytes when rendering with
+as_bytes (output_path is then None), elapsed is the Blender render time in seconds.
+"""
+
+# Marks the end of the result stream
+RESULTS_DONE = object()
+
+def prepare_job(job, index, output_dir):
+    """Fill in defaults for a job given to render_skins
+
+    A job needs a 'skin_path'. Optional: 'id', 'model' (standard, slim or auto),
+    'pose', 'model_file', 'ratio' or 'width'/'height', 'device', 'bg_color'
+    (#RRGGBBAA or 'r,g,b,a'), 'quality' (a preset name or a quality dict, see
+    render_quality.py) and 'output_path'.
+    """
+    job = dict(job)
+    job.setdefault('id', str(index))
+    if 'model_file' not in job:
+        model_type = job.get('model', 'standard')
+        if model_type == 'auto':
+            model_type = detect_model_type(job['skin_path'])
+        job['model_file'] = get_model_file(model_type, job.get('pose', '1'))
+    if 'width' not in job or 'height' not in job:
+        job['width'], job['height'] = ASPECT_RATIOS[job.get('ratio', '1:1')]
+    job.setdefault('device', 'CPU')
+    bg_color = job.get('bg_color', '#00000000')
+    job['bg_color'] = hex_to_rgb(bg_color) if bg_color.startswith('#') else bg_color
+    if not isinstance(job.get('quality'), dict):
+        job['quality'] = quality_settings(job.get('quality') or DEFAULT_QUALITY)
+    if not job.get('output_path'):
+        base_name = os.path.splitext(os.path.basename(job['skin_path']))[0]
+        job['output_path'] = os.path.join(output_dir, f"{index}_{base_name}_render.png")
+    return job
+
+def render_skins(jobs, blender_path, workers=1, threads=0, output_dir=None, as_bytes=False,
+                 background_image=None, timeout=None, max_pending=None, script_path=SCRIPT_PATH,
+                 max_attempts=3, timing_log=None, backend=None):
+    """Render skin jobs and yield a RenderResult for each as soon as it finishes
+
+    jobs can be any iterable of job dicts (see prepare_job), including a
+    generator that never holds the whole batch. Output files go to each job's
+    output_path, else to output_dir (a new temporary directory if not given);
+    with as_bytes the PNG is returned in RenderResult.data and no file is kept.
+    At most max_pending finished results (default: two per worker) wait for
+    the caller before the workers pause.
+    timeout fixes the seconds allowed per render (default: estimated from the
+    job's size and past render times); a job whose render times out or crashes
+    its worker is attempted up to max_attempts times on a fresh worker. Each attempt's phase timings are
+    written to timing_log (a render_timing.TimingLog) if given. backend
+    replaces Blender with another render backend (see render_backend.py).
+    Closing the generator early stops the workers after their current job.
+    """
+    temp_dir = None
+    if output_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix="mcskin_render_")
+        output_dir = temp_dir
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+
+    pool = RenderPool(blender_path, workers, script_path, threads=threads,
+                      retry_policy=RetryPolicy(timeout, max_attempts), timing_log=timing_log, backend=backend)
+    scheduler = StreamScheduler((prepare_job(job, index, output_dir) for index, job in enumerate(jobs)),
+                                window=pool.num_workers * 4)
+    results = queue.Queue(maxsize=max_pending or pool.num_workers * 2)
+
+    def post_process(job, status):
+        """Composite the background image before the render is finalized"""
+        if background_image and os.path.exists(status['output_path']):
+            apply_background_image(status['output_path'], background_image)
+
+    def on_result(slot, job, status):
+        """Hand a finished job to the caller; blocks while the caller is behind"""
+        data = None
+        output_path = job['output_path'] if status.get('status') == 'done' else None
+        if as_bytes and output_path:
+            try:
+                with open(output_path, 'rb') as f:
+                    data = f.read()
+                os.remove(output_path)
+            except OSError as e:
+                status = {'status': 'failed', 'error': f"Failed to read render: {e}"}
+            output_path = None
+        results.put(RenderResult(job['id'], job['skin_path'], status.get('status', 'failed'), output_path,
+                                 data, status.get('error'), status.get('elapsed')))
+
+    def run():
+        try:
+            pool.run_scheduler(scheduler, pool.num_workers, None, None, on_result, post_process)
+        finally:
+            results.put(RESULTS_DONE)
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    try:
+        while True:
+            result = results.get()
+            if result is RESULTS_DONE:
+                break
+            yield result
+        if scheduler.error is not None:
+            raise scheduler.error
+    finally:
+        # The caller stopped early: let running jobs finish without anyone waiting for them
+        pool.stop()
+        while runner.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if temp_dir and as_bytes:
+            shutil.rmtree(temp_dir, ignore_errors=True)
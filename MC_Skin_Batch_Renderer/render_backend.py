@@ -0,0 +1,433 @@
+import io
+import os
+import json
+import time
+import hashlib
+import random
+import threading
+import itertools
+import subprocess
+from PIL import Image
+from blender_worker import BlenderWorker, BlenderWorkerError
+from render_cache import hash_file, script_version
+
+"""
+Render backends
+
+A backend creates the workers a RenderPool renders on. Every worker has the
+BlenderWorker interface: start(), render(job, timeout, on_progress) returning a
+status dict, is_alive(), close(), kill(), plus model_file, pid and
+startup_spans. Failures are reported the same way too: BlenderWorkerError when
+the worker dies and subprocess.TimeoutExpired when a render takes too long.
+
+    blender   persistent Blender processes (the default); with lightmap=1 each
+              pose's lighting is baked once into a UV-space lightmap and skins
+              render emission-only with a few samples instead of path tracing
+    fake      no Blender at all: each render sleeps for a configurable latency,
+              fails or crashes at configurable rates and writes a placeholder
+              PNG, so the orchestrator (scheduling, caching, compositing,
+              journaling) can be tested and benchmarked on its own
+    raster    NumPy software renderer of the player model (render_raster.py):
+              no Blender needed and milliseconds per skin, but only an
+              approximation of the .blend poses and lighting
+    baked     deferred rendering (render_bake.py): Blender bakes each model's
+              UV and lighting maps once per resolution, then every skin is a
+              NumPy texture gather through them
+
+A backend's cache_tag tells apart its renders in the render cache; it is None
+only for plain Blender renders. model_error(model_file) says why a backend
+can't render a model file (None if it can), so such jobs fail without a worker.
+
+Backends are chosen with a spec such as "blender" or
+"blender:lightmap=1", "fake:latency=0.01,jitter=0.5,failure_rate=0.02",
+"raster:ssaa=1" or "baked"
+(see parse_backend_spec).
+"""
+
+# Baked lightmaps, next to the gather bakes of render_bake.py
+LIGHTMAP_DIR = os.path.join(os.path.expanduser('~'), '.mcskin_bakes')
+
+# Must match LIGHTMAP_SIZE and LIGHTMAP_BAKE_SAMPLES in blender_render_script.py
+LIGHTMAP_SIZE = 1024
+LIGHTMAP_BAKE_SAMPLES = 128
+
+def lightmap_path(model_file, size=LIGHTMAP_SIZE, bake_samples=LIGHTMAP_BAKE_SAMPLES, lightmap_dir=LIGHTMAP_DIR):
+    """Path of the baked lightmap of a model file, keyed by its contents, the bake settings and the render script"""
+    parts = {'model': hash_file(model_file), 'size': int(size), 'bake_samples': int(bake_samples),
+             'script': script_version()}
+    key = hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    return os.path.join(lightmap_dir, f"{name}_lightmap{int(size)}_{key[:16]}.exr")
+
+class BlenderBackend:
+    """Renders with persistent Blender workers
+
+    With lightmap, workers render emission-only from each model's baked
+    lighting (lightmap_size pixels square, baked at bake_samples by the first
+    job that needs it). The emission pass always renders a few samples without
+    bounces, so a job's quality preset only affects renders without lightmap.
+    """
+
+    name = 'blender'
+    persist_timings = True  # Render times are real, keep them for adaptive timeouts
+
+    def __init__(self, blender_path, script_path=None, lightmap=False, lightmap_size=LIGHTMAP_SIZE,
+                 bake_samples=LIGHTMAP_BAKE_SAMPLES):
+        self.blender_path = blender_path
+        self.script_path = script_path
+        self.lightmap = bool(lightmap)
+        self.lightmap_size = int(lightmap_size)
+        self.bake_samples = int(bake_samples)
+        self.cache_tag = f"lightmap{self.lightmap_size}:bake{self.bake_samples}" if self.lightmap else None
+        # Emission-only render times would shorten the timeouts of later full renders
+        self.persist_timings = not self.lightmap
+
+    def create_worker(self, model_file, threads=0, cpu_affinity=None):
+        """New (not yet started) worker for a model file"""
+        job_defaults = None
+        if self.lightmap:
+            job_defaults = {'lightmap_path': lightmap_path(model_file, self.lightmap_size, self.bake_samples),
+                            'lightmap_size': self.lightmap_size,
+                            'lightmap_bake_samples': self.bake_samples}
+        return BlenderWorker(self.blender_path, model_file, self.script_path, threads, cpu_affinity, job_defaults)
+
+    def model_error(self, model_file):
+        """Why this backend can't render a model file, or None"""
+        if not os.path.isfile(model_file):
+            return f"Model file not found: {model_file}"
+        return None
+
+class FakeBackend:
+    """Simulated renderer with configurable latency and failures
+
+    latency is the mean seconds per render, varied by +-jitter (a fraction of
+    it); startup the seconds a worker takes to start. failure_rate is the
+    share of renders reported as failed and crash_rate the share that kill
+    the worker. seed makes the sequence of latencies and failures repeatable.
+    """
+
+    name = 'fake'
+    cache_tag = 'fake'
+    persist_timings = False
+
+    def __init__(self, latency=0.0, jitter=0.0, startup=0.0, failure_rate=0.0, crash_rate=0.0, seed=0):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.startup = float(startup)
+        self.failure_rate = float(failure_rate)
+        self.crash_rate = float(crash_rate)
+        self.rng = random.Random(int(seed))
+        self.lock = threading.Lock()
+        self.placeholders = {}  # (width, height) -> PNG bytes
+        self.pids = itertools.count(1)
+
+    def create_worker(self, model_file, threads=0, cpu_affinity=None):
+        """New (not yet started) fake worker for a model file"""
+        return FakeWorker(self, model_file)
+
+    def model_error(self, model_file):
+        """Fake renders don't load the model file, so any will do"""
+        return None
+
+    def draw(self):
+        """(latency, outcome) of the next render; outcome is 'done', 'failed' or 'crash'"""
+        with self.lock:
+            latency = self.latency * (1 + self.jitter * (2 * self.rng.random() - 1))
+            roll = self.rng.random()
+        if roll < self.crash_rate:
+            return max(0.0, latency), 'crash'
+        if roll < self.crash_rate + self.failure_rate:
+            return max(0.0, latency), 'failed'
+        return max(0.0, latency), 'done'
+
+    def placeholder(self, width, height):
+        """Encoded transparent PNG of the given size, made once per size"""
+        key = (int(width), int(height))
+        with self.lock:
+            data = self.placeholders.get(key)
+        if data is None:
+            buffer = io.BytesIO()
+            Image.new('RGBA', key, (0, 0, 0, 0)).save(buffer, 'PNG')
+            data = buffer.getvalue()
+            with self.lock:
+                self.placeholders[key] = data
+        return data
+
+class FakeWorker:
+    """Worker of the fake backend, following the BlenderWorker interface"""
+
+    def __init__(self, backend, model_file):
+        self.backend = backend
+        self.model_file = model_file
+        self.alive = False
+        self.pid = None
+        self.startup_spans = []
+
+    def start(self, timeout=None):
+        """Pretend to start Blender and load the model"""
+        start_time = time.time()
+        if self.backend.startup:
+            time.sleep(self.backend.startup)
+        self.alive = True
+        self.pid = -next(self.backend.pids)  # Negative, so it can't be mistaken for a real process
+        ready_time = time.time()
+        self.startup_spans = [['spawn', start_time, start_time], ['load', start_time, ready_time]]
+
+    def is_alive(self):
+        """Whether the worker can take jobs"""
+        return self.alive
+
+    def render(self, job, timeout=60, on_progress=None):
+        """Simulate one render and write a placeholder PNG to the job's output path"""
+        if not self.alive:
+            raise BlenderWorkerError("Fake worker is not running")
+        latency, outcome = self.backend.draw()
+        start_time = time.time()
+        if timeout and latency > timeout:
+            time.sleep(timeout)
+            self.alive = False
+            raise subprocess.TimeoutExpired(['fake-render', self.model_file], timeout)
+        if on_progress:
+            on_progress({'phase': 'Rendering', 'sample': 1, 'samples': 1})
+        if latency:
+            time.sleep(latency)
+        render_end = time.time()
+        if outcome == 'crash':
+            self.alive = False
+            raise BlenderWorkerError("Fake worker crashed")
+        if outcome == 'failed':
+            return {'id': job.get('id'), 'status': 'failed', 'error': "Simulated render failure",
+                    'elapsed': render_end - start_time, 'timings': [['render', start_time, render_end]]}
+        with open(job['output_path'], 'wb') as f:
+            f.write(self.backend.placeholder(job.get('width', 1024), job.get('height', 1024)))
+        end_time = time.time()
+        return {'id': job.get('id'), 'status': 'done', 'output_path': job['output_path'],
+                'elapsed': end_time - start_time,
+                'timings': [['render', start_time, render_end], ['write', render_end, end_time]]}
+
+    def close(self, timeout=10):
+        """Stop the worker"""
+        self.alive = False
+
+    def kill(self):
+        """Stop the worker"""
+        self.alive = False
+
+class RasterBackend:
+    """Renders with the NumPy software rasterizer
+
+    ssaa is the supersampling factor (1 turns antialiasing off).
+    """
+
+    name = 'raster'
+    persist_timings = False  # Milliseconds per render, they'd skew the Blender history
+
+    def __init__(self, ssaa=2):
+        # Imported here so NumPy is only needed when this backend is used
+        import render_raster
+        self.ssaa = max(1, int(ssaa))
+        self.cache_tag = f"raster:ssaa={self.ssaa}"
+        self.raster = render_raster
+        self.pids = itertools.count(1)
+
+    def create_worker(self, model_file, threads=0, cpu_affinity=None):
+        """New (not yet started) rasterizer worker for a model file"""
+        return RasterWorker(self, model_file)
+
+    def model_error(self, model_file):
+        """Why the rasterizer can't render a model file, or None"""
+        from render_core import parse_model_file
+        parsed = parse_model_file(model_file)
+        if parsed is None:
+            return f"The raster backend only renders player models, not {os.path.basename(model_file)}"
+        if parsed[1] not in self.raster.POSES:
+            return f"The raster backend has no pose '{parsed[1]}' (poses: {', '.join(self.raster.POSES)})"
+        return None
+
+class RasterWorker:
+    """Worker of the raster backend, following the BlenderWorker interface"""
+
+    def __init__(self, backend, model_file):
+        from render_core import parse_model_file
+        self.backend = backend
+        self.model_file = model_file
+        # None for model files that aren't player models; their jobs fail
+        self.model_type, self.pose = parse_model_file(model_file) or (None, None)
+        self.alive = False
+        self.pid = None
+        self.startup_spans = []
+
+    def start(self, timeout=None):
+        """Nothing to load, just take a worker id"""
+        start_time = time.time()
+        self.alive = True
+        self.pid = -next(self.backend.pids)  # Negative, there is no separate process
+        self.startup_spans = [['spawn', start_time, start_time], ['load', start_time, start_time]]
+
+    def is_alive(self):
+        """Whether the worker can take jobs"""
+        return self.alive
+
+    def render(self, job, timeout=60, on_progress=None):
+        """Rasterize one skin to the job's output path"""
+        if not self.alive:
+            raise BlenderWorkerError("Raster worker is not running")
+        start_time = time.time()
+        try:
+            error = self.backend.model_error(self.model_file)
+            if error:
+                raise ValueError(error)
+            img = self.backend.raster.render_skin(job['skin_path'], self.model_type, self.pose,
+                                                  job.get('width', 1024), job.get('height', 1024),
+                                                  job.get('bg_color', '0,0,0,0'), self.backend.ssaa)
+            render_end = time.time()
+            img.save(job['output_path'])
+        except Exception as e:
+            end_time = time.time()
+            return {'id': job.get('id'), 'status': 'failed', 'error': str(e), 'elapsed': end_time - start_time,
+                    'timings': [['render', start_time, end_time]]}
+        end_time = time.time()
+        return {'id': job.get('id'), 'status': 'done', 'output_path': job['output_path'],
+                'elapsed': end_time - start_time,
+                'timings': [['render', start_time, render_end], ['write', render_end, end_time]]}
+
+    def close(self, timeout=10):
+        """Stop the worker"""
+        self.alive = False
+
+    def kill(self):
+        """Stop the worker"""
+        self.alive = False
+
+class BakedBackend:
+    """Renders by texture gather from maps baked once per model and resolution
+
+    Missing bakes are made by a Blender worker started just for them, which
+    may take up to bake_timeout seconds.
+    """
+
+    name = 'baked'
+    cache_tag = 'baked'
+    persist_timings = False  # Gathers take milliseconds, they'd skew the Blender history
+
+    def __init__(self, blender_path, script_path=None, bake_timeout=1800):
+        # Imported here so NumPy is only needed when this backend is used
+        import render_bake
+        self.blender_path = blender_path
+        self.script_path = script_path
+        self.bake_timeout = float(bake_timeout)
+        self.bake = render_bake
+        self.store = render_bake.BakeStore()
+        self.pids = itertools.count(1)
+
+    def create_worker(self, model_file, threads=0, cpu_affinity=None):
+        """New (not yet started) gather worker for a model file"""
+        return BakedWorker(self, model_file, threads, cpu_affinity)
+
+    def model_error(self, model_file):
+        """Why this backend can't bake a model file, or None"""
+        if not os.path.isfile(model_file):
+            return f"Model file not found: {model_file}"
+        return None
+
+class BakedWorker:
+    """Worker of the baked backend, following the BlenderWorker interface"""
+
+    def __init__(self, backend, model_file, threads=0, cpu_affinity=None):
+        self.backend = backend
+        self.model_file = model_file
+        self.threads = threads
+        self.cpu_affinity = cpu_affinity
+        self.alive = False
+        self.pid = None
+        self.startup_spans = []
+
+    def start(self, timeout=None):
+        """Nothing to load until the first job shows which bake is needed"""
+        start_time = time.time()
+        self.alive = True
+        self.pid = -next(self.backend.pids)  # Negative, there is no separate process
+        self.startup_spans = [['spawn', start_time, start_time], ['load', start_time, start_time]]
+
+    def is_alive(self):
+        """Whether the worker can take jobs"""
+        return self.alive
+
+    def run_bake(self, model_file, width, height, device, path):
+        """Bake a model's maps to path with a temporary Blender worker"""
+        worker = BlenderWorker(self.backend.blender_path, model_file, self.backend.script_path,
+                               self.threads, self.cpu_affinity)
+        try:
+            worker.start()
+            status = worker.render({'id': 'bake', 'bake': True, 'output_path': path, 'width': width,
+                                    'height': height, 'device': device}, timeout=self.backend.bake_timeout)
+        finally:
+            worker.close()
+        if status.get('status') != 'done':
+            raise BlenderWorkerError(f"Baking {os.path.basename(model_file)} failed: {status.get('error')}")
+
+    def render(self, job, timeout=60, on_progress=None):
+        """Render one skin to the job's output path by gathering through the model's bake"""
+        if not self.alive:
+            raise BlenderWorkerError("Baked worker is not running")
+        start_time = time.time()
+        timings = []
+        try:
+            bake, baked = self.backend.store.get(self.model_file, job.get('width', 1024), job.get('height', 1024),
+                                                 job.get('device', 'CPU'), self.run_bake)
+            render_start = time.time()
+            if baked:
+                timings.append(['bake', start_time, render_start])
+            img = self.backend.bake.render_baked(bake, job['skin_path'], job.get('bg_color', '0,0,0,0'))
+            render_end = time.time()
+            timings.append(['render', render_start, render_end])
+            img.save(job['output_path'])
+        except Exception as e:
+            end_time = time.time()
+            return {'id': job.get('id'), 'status': 'failed', 'error': str(e), 'elapsed': end_time - start_time,
+                    'timings': timings}
+        end_time = time.time()
+        timings.append(['write', render_end, end_time])
+        return {'id': job.get('id'), 'status': 'done', 'output_path': job['output_path'],
+                'elapsed': end_time - start_time, 'timings': timings}
+
+    def close(self, timeout=10):
+        """Stop the worker"""
+        self.alive = False
+
+    def kill(self):
+        """Stop the worker"""
+        self.alive = False
+
+BACKENDS = {'blender': BlenderBackend, 'fake': FakeBackend, 'raster': RasterBackend, 'baked': BakedBackend}
+
+def parse_backend_spec(text):
+    """Parse a backend spec such as 'fake:latency=0.05,failure_rate=0.1' into (name, options)"""
+    name, _, option_text = str(text).strip().partition(':')
+    name = name.strip().lower() or 'blender'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown render backend: {name} (choose from {', '.join(BACKENDS)})")
+    options = {}
+    for item in option_text.split(','):
+        if not item.strip():
+            continue
+        key, separator, value = item.partition('=')
+        if not separator:
+            raise ValueError(f"Invalid backend option: {item}")
+        try:
+            options[key.strip()] = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid value for backend option {key.strip()}: {value}")
+    return name, options
+
+def create_backend(spec='blender', blender_path=None, script_path=None):
+    """Create a backend from a spec string"""
+    name, options = parse_backend_spec(spec)
+    try:
+        if name in ('blender', 'baked'):
+            return BACKENDS[name](blender_path, script_path, **options)
+        return BACKENDS[name](**options)
+    except TypeError as e:
+        raise ValueError(f"Invalid options for the {name} backend: {e}")
+    except ImportError as e:
+        raise ValueError(f"The {name} backend is not available: {e}")
@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+from render_cache import hash_file, script_version
+from render_raster import parse_bg_color
+
+"""
+Deferred (UV lookup) rendering from baked model maps
+
+For a given .blend, camera and resolution only the skin texture changes between
+renders, so each model is baked once by Blender (a "bake" job of
+blender_render_script.py) into per-pixel maps:
+
+    front_uv, base_uv        skin UV in R and G, coverage in A
+    front_light, base_light  linear RGBA render of the model with a white skin
+
+'front' is the nearest skin surface of every pixel and 'base' the surface
+behind the second layer, used where the second layer texel is transparent.
+Rendering a skin is then a NumPy gather of its texels through the UV map,
+multiplied by the lighting map: milliseconds instead of a Cycles render.
+
+The result is close to, but not the same as, a Cycles render: light bouncing
+off the skin is white instead of skin coloured, second-layer texels seen
+through other second-layer holes are missed, and colours use the Standard
+view transform. Bakes are cached on disk, keyed by the model file, resolution,
+device and render script.
+"""
+
+# Baked model maps
+BAKE_DIR = os.path.join(os.path.expanduser('~'), '.mcskin_bakes')
+
+# Bumped when the bake file layout changes
+BAKE_FORMAT = 1
+
+def bake_key(model_file, width, height, device='CPU'):
+    """Key of the bake of a model file at a resolution"""
+    parts = {
+        'format': BAKE_FORMAT,
+        'model': hash_file(model_file),
+        'width': int(width),
+        'height': int(height),
+        'device': device,
+        'script': script_version()
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def bake_path(model_file, width, height, device='CPU', bake_dir=BAKE_DIR):
+    """Path of the bake file of a model file at a resolution"""
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    key = bake_key(model_file, width, height, device)
+    return os.path.join(bake_dir, f"{name}_{int(width)}x{int(height)}_{key[:16]}.npz")
+
+# Levels of the linear to sRGB lookup table
+SRGB_LEVELS = 4096
+
+def srgb_to_linear(values):
+    """sRGB encoded 0-1 values to linear"""
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+def linear_to_srgb(values):
+    """Linear 0-1 values to sRGB encoding"""
+    values = np.clip(values, 0.0, 1.0)
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+
+# Linear level -> 8 bit sRGB
+SRGB_TABLE = np.round(linear_to_srgb(np.linspace(0.0, 1.0, SRGB_LEVELS)) * 255).astype(np.uint8)
+
+def encode_srgb(values):
+    """Linear 0-1 values to 8 bit sRGB through SRGB_TABLE"""
+    return SRGB_TABLE[(np.clip(values, 0.0, 1.0) * (SRGB_LEVELS - 1) + 0.5).astype(np.intp)]
+
+class Bake:
+    """A loaded bake, reduced to the pixels the skin covers
+
+    Everything that doesn't depend on the skin is worked out here once, so a
+    render only gathers texels for the covered pixels.
+    """
+
+    def __init__(self, maps):
+        front_uv, base_uv = maps['front_uv'], maps['base_uv']
+        self.shape = front_uv.shape[:2]
+        covered = front_uv[..., 3] > 0.5
+        self.pixels = np.flatnonzero(covered)
+        self.front_uv = front_uv[covered][:, :2]
+        self.front_light = maps['front_light'][covered]
+        self.base_uv = base_uv[covered][:, :2]
+        self.base_covered = base_uv[covered][:, 3] > 0.5
+        self.base_light = maps['base_light'][covered]
+        # Pixels of other materials (scenery) come straight from the lighting render
+        light = maps['front_light']
+        scenery = ~covered & (light[..., 3] > 0)
+        self.background = np.zeros(self.shape + (4,), dtype=np.uint8)
+        self.background[scenery, :3] = encode_srgb(light[scenery, :3])
+        self.background[scenery, 3] = np.round(np.clip(light[scenery, 3], 0.0, 1.0) * 255)
+        self.texel_indices = {}  # skin size -> (front, base) flat texel indices
+        self.lock = threading.Lock()
+
+    def texel_index(self, uv, width, height):
+        """Flat texel index of each UV, as Blender's closest interpolation picks them"""
+        tu = np.clip((uv[:, 0] * width).astype(np.intp), 0, width - 1)
+        tv = np.clip(((1.0 - uv[:, 1]) * height).astype(np.intp), 0, height - 1)  # UV v runs bottom-up
+        return tv * width + tu
+
+    def indices(self, width, height):
+        """(front, base) texel indices for skins of a size (64x32 skins stretch like in Blender)"""
+        with self.lock:
+            indices = self.texel_indices.get((width, height))
+        if indices is None:
+            indices = (self.texel_index(self.front_uv, width, height), self.texel_index(self.base_uv, width, height))
+            with self.lock:
+                self.texel_indices[(width, height)] = indices
+        return indices
+
+def load_bake(path):
+    """Read a bake file into a Bake"""
+    with np.load(path) as data:
+        return Bake({name: data[name].astype(np.float32)
+                     for name in ('front_uv', 'front_light', 'base_uv', 'base_light')})
+
+def render_baked(bake, skin, bg_color=(0, 0, 0, 0)):
+    """Render a skin (path or PIL image) from a Bake; returns a PIL RGBA image"""
+    if isinstance(skin, Image.Image):
+        img = skin.convert('RGBA')
+    else:
+        with Image.open(skin) as opened:
+            img = opened.convert('RGBA')
+    texels = np.asarray(img, dtype=np.float32).reshape(-1, 4) / 255.0
+    texels[:, :3] = srgb_to_linear(texels[:, :3])
+
+    front, base = bake.indices(*img.size)
+    color = texels[front]
+    # Where the nearest texel is transparent, show the surface behind the second layer
+    see_through = color[:, 3] < 0.5
+    color[see_through] = texels[base[see_through]]
+    light = np.where(see_through[:, None], bake.base_light, bake.front_light)
+    visible = (color[:, 3] >= 0.5) & (~see_through | bake.base_covered)
+
+    # Texel times lighting; coverage from the antialiased lighting render
+    rgba = bake.background.copy().reshape(-1, 4)
+    pixels = bake.pixels[visible]
+    rgba[pixels, :3] = encode_srgb(color[visible, :3] * light[visible, :3])
+    rgba[pixels, 3] = np.round(np.clip(light[visible, 3], 0.0, 1.0) * 255)
+
+    output = Image.fromarray(rgba.reshape(bake.shape + (4,)), 'RGBA')
+    bg_color = parse_bg_color(bg_color)
+    if bg_color[3] > 0:
+        background = Image.new('RGBA', output.size, tuple(int(round(c * 255)) for c in bg_color))
+        output = Image.alpha_composite(background, output)
+    return output
+
+class BakeStore:
+    """Loaded bakes in memory, baking missing ones on demand"""
+
+    def __init__(self, bake_dir=BAKE_DIR):
+        self.bake_dir = bake_dir
+        self.bakes = {}  # bake path -> Bake
+        self.locks = {}  # bake path -> lock held while baking or loading
+        self.failures = {}  # bake path -> error of a failed bake, not retried in this run
+        self.lock = threading.Lock()
+
+    def get(self, model_file, width, height, device, bake_fn):
+        """(Bake, baked) for a model file at a resolution; baked tells whether it had to be baked now
+
+        bake_fn(model_file, width, height, device, path) writes a missing bake
+        file; it runs once per bake even when several workers ask for it, and
+        a failed bake isn't tried again (RuntimeError for later requests).
+        """
+        path = bake_path(model_file, width, height, device, self.bake_dir)
+        with self.lock:
+            if path in self.bakes:
+                return self.bakes[path], False
+            path_lock = self.locks.setdefault(path, threading.Lock())
+        with path_lock:
+            with self.lock:
+                if path in self.bakes:
+                    return self.bakes[path], False
+                if path in self.failures:
+                    raise RuntimeError(self.failures[path])
+            baked = not os.path.exists(path)
+            if baked:
+                os.makedirs(self.bake_dir, exist_ok=True)
+                temp_path = f"{path[:-4]}.{os.getpid()}.tmp.npz"
+                try:
+                    bake_fn(model_file, width, height, device, temp_path)
+                    os.replace(temp_path, path)
+                except Exception as e:
+                    with self.lock:
+                        self.failures[path] = str(e)
+                    raise
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            bake = load_bake(path)
+            with self.lock:
+                self.bakes[path] = bake
+        return bake, baked
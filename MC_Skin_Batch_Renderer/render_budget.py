@@ -0,0 +1,182 @@
+import re
+import time
+import threading
+from PIL import Image
+from render_retry import render_cost
+from render_scheduler import JobScheduler
+
+"""
+Time-budgeted rendering
+
+Given a deadline for the whole batch (e.g. 2 hours for 40k skins), the batch
+renders at the best quality level that still lets every remaining job finish
+in time. Levels step down from the requested quality by halving the Cycles
+samples (denoising low sample renders unless the quality turns denoising off)
+and then by rendering at a lower resolution that is scaled back up to the
+requested size.
+
+The level is picked again for every job handed to a worker: the measured
+throughput (worker seconds per render cost unit, a moving average of the
+finished renders) times the cost of the queued jobs at a level must fit into
+the time left before the deadline. Until the first render finishes, the rate
+comes from the render timing history, or the first renders calibrate at the
+requested quality. When renders get faster or slower, later jobs move to a
+higher or lower level.
+
+Renders below the requested quality are not stored in the render cache.
+"""
+
+# (fraction of the requested samples, resolution scale), best first
+BUDGET_LEVELS = [
+    (1.0, 1.0),
+    (0.5, 1.0),
+    (0.25, 1.0),
+    (0.125, 1.0),
+    (0.0625, 1.0),
+    (0.0625, 0.75),
+    (0.0625, 0.5)
+]
+
+# Fewest samples a budget level renders with
+MIN_SAMPLES = 4
+
+# Part of the time left kept in reserve for stragglers and retries
+DEFAULT_MARGIN = 0.1
+
+# Weight of a new measurement in the moving average
+SMOOTHING = 0.3
+
+DURATION_PATTERN = re.compile(r'^(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m)?(?:(\d+(?:\.\d+)?)s?)?$')
+
+def parse_duration(text):
+    """Seconds from '7200', '90m', '2h' or '1h30m'; raises ValueError"""
+    match = DURATION_PATTERN.match(str(text).strip().lower())
+    if not match or not any(match.groups()):
+        raise ValueError(f"Invalid duration: {text} (e.g. 7200, 90m, 2h or 1h30m)")
+    hours, minutes, seconds = (float(group or 0) for group in match.groups())
+    duration = hours * 3600 + minutes * 60 + seconds
+    if duration <= 0:
+        raise ValueError(f"Duration must be positive: {text}")
+    return duration
+
+def apply_level(job, level):
+    """Copy of a job rendered at a budget level (index into BUDGET_LEVELS)
+
+    The requested quality and size are kept in 'budget_base', so a job can be
+    moved to another level again (e.g. when it is retried).
+    """
+    base = job.get('budget_base') or {'quality': job.get('quality'), 'width': job['width'], 'height': job['height'],
+                                      'cache_key': job.get('cache_key')}
+    job = dict(job, budget_base=base, quality=base['quality'], width=base['width'], height=base['height'],
+               cache_key=base['cache_key'], budget_level=level, render_scale=1.0)
+    fraction, scale = BUDGET_LEVELS[level]
+    if level == 0:
+        return job
+    quality = dict(base['quality'] or {})
+    requested = int(quality.get('samples') or 128)
+    quality['samples'] = max(MIN_SAMPLES, min(requested, int(round(requested * fraction))))
+    if quality.get('denoise') is None:
+        quality['denoise'] = True  # Few samples are only usable denoised
+    quality['preset'] = 'custom'
+    job['quality'] = quality
+    job['width'] = max(16, int(round(base['width'] * scale)))
+    job['height'] = max(16, int(round(base['height'] * scale)))
+    job['render_scale'] = scale
+    # The render cache only holds renders at the requested quality
+    job.pop('cache_key', None)
+    return job
+
+def upscale_render(job, path):
+    """Scale a render made at a lower budget resolution back up to the requested size"""
+    base = job.get('budget_base')
+    if not base or job.get('render_scale', 1.0) >= 1.0:
+        return
+    with Image.open(path) as img:
+        upscaled = img.convert('RGBA').resize((base['width'], base['height']), Image.LANCZOS)
+    upscaled.save(path, 'PNG')
+
+class RenderBudget:
+    """Picks the quality level that lets the remaining renders finish by a deadline"""
+
+    def __init__(self, seconds, workers, start_time=None, timings=None, threads=0, margin=DEFAULT_MARGIN,
+                 on_change=None):
+        self.deadline = (start_time or time.time()) + seconds
+        self.workers = max(1, workers)
+        self.timings = timings  # render_retry.RenderTimings for a first estimate, or None
+        self.threads = threads
+        self.margin = margin
+        self.on_change = on_change  # on_change(info) when the level changes
+        self.rate = None  # Measured worker seconds per cost unit
+        self.level = None
+        self.started = {}  # job id -> time it was handed to a worker
+        self.lock = threading.Lock()
+
+    def job_rate(self, job):
+        """Seconds per cost unit: measured in this batch, else from the timing history, else None"""
+        if self.rate is not None:
+            return self.rate
+        if self.timings is not None:
+            return self.timings.rate(job['model_file'], self.threads)
+        return None
+
+    def choose(self, job, queued):
+        """Best level at which this job and the queued jobs after it finish in time"""
+        rate = self.job_rate(job)
+        if rate is None:
+            return 0  # Calibrate at the requested quality
+        time_left = (self.deadline - time.time()) * (1 - self.margin)
+        for level in range(len(BUDGET_LEVELS)):
+            seconds = rate * render_cost(apply_level(job, level))
+            # This job plus the queued ones, spread over the workers
+            if (queued / self.workers + 1) * seconds <= time_left:
+                return level
+        return len(BUDGET_LEVELS) - 1
+
+    def apply(self, job, queued):
+        """Job copy at the level chosen for it; queued is how many jobs are still waiting"""
+        with self.lock:
+            level = self.choose(job, queued)
+            self.started[job['id']] = time.time()
+            changed = level != self.level
+            self.level = level
+        job = apply_level(job, level)
+        if changed:
+            info = {'level': level, 'samples': job['quality'].get('samples') if job['quality'] else None,
+                    'render_scale': job['render_scale'], 'time_left': self.deadline - time.time(),
+                    'queued': queued}
+            print(f"Time budget: level {level}, {info['samples']} samples at {job['render_scale']:.0%} "
+                  f"resolution for {queued + 1} remaining renders")
+            if self.on_change:
+                self.on_change(info)
+        return job
+
+    def record(self, job, status):
+        """Measure a finished render of a job handed out by apply"""
+        with self.lock:
+            start_time = self.started.pop(job['id'], None)
+            if start_time is None or status.get('status') != 'done':
+                return
+            cost = render_cost(job)
+            if cost <= 0:
+                return
+            rate = (time.time() - start_time) / cost
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate += SMOOTHING * (rate - self.rate)
+
+class BudgetScheduler(JobScheduler):
+    """JobScheduler that hands out each job at the level its RenderBudget picks"""
+
+    def __init__(self, jobs, budget):
+        super().__init__(jobs)
+        self.budget = budget
+
+    def next_job(self, slot, current_model=None):
+        """Get the next job for a pool slot at the current budget level, or None when done"""
+        with self.lock:
+            job = self._pick(slot, current_model)
+            queued = sum(len(group) for group in self.groups.values())
+        if job is None:
+            return None
+        return self.budget.apply(job, queued)
@@ -0,0 +1,271 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from render_journal import copy_atomic
+from render_quality import quality_key
+
+"""
+Content-addressed render cache
+
+A finished render (after background compositing) is stored under a hash of
+everything that affects it: the skin's decoded pixels, the model .blend, the
+output size, device, background color, background image, render quality and
+the render script version. When a later batch asks for the same combination the
+cached PNG is hard-linked (or copied) to the new output path instead of
+starting Blender.
+
+The cache is bounded by size; the least recently used entries are evicted first.
+
+The same key drives deduplication within a batch: jobs whose skins have identical
+pixels and identical settings are rendered once and the result is copied to
+every requested output file.
+"""
+
+# Default cache location and size limit
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.mcskin_cache')
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+
+# Bump when the key layout changes so old entries are never reused
+CACHE_FORMAT = 1
+
+# Batches at least this large hash skins on a thread pool
+PARALLEL_HASH_THRESHOLD = 32
+
+# Memoized file content hashes keyed by (path, size, mtime)
+file_hash_cache = {}
+file_hash_lock = threading.Lock()
+
+def hash_file(path):
+    """SHA-256 of a file's contents (memoized while the file is unchanged)"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with file_hash_lock:
+        if memo_key in file_hash_cache:
+            return file_hash_cache[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    result = digest.hexdigest()
+    with file_hash_lock:
+        file_hash_cache[memo_key] = result
+    return result
+
+def hash_skin_pixels(skin_path):
+    """SHA-256 of a skin's decoded RGBA pixels, so re-encoded copies hash the same"""
+    with Image.open(skin_path) as img:
+        rgba = img.convert('RGBA')
+        digest = hashlib.sha256()
+        digest.update(f"{rgba.size[0]}x{rgba.size[1]}".encode('ascii'))
+        digest.update(rgba.tobytes())
+    return digest.hexdigest()
+
+def script_version():
+    """Version of the Blender render script (hash of its source)"""
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_render_script.py")
+    return hash_file(script_path)
+
+def render_key(job, background_image=None, skin_hash=None, backend=None):
+    """Cache key for a render job
+
+    job needs skin_path, model_file, width, height, device and bg_color.
+    skin_hash can be passed in when the pixels were already hashed. backend
+    is the render backend's cache_tag, None for plain Blender renders.
+    The job's 'quality' is part of the key unless it is standard quality.
+    """
+    parts = {
+        'format': CACHE_FORMAT,
+        'skin': skin_hash or hash_skin_pixels(job['skin_path']),
+        'model': hash_file(job['model_file']),
+        'width': int(job['width']),
+        'height': int(job['height']),
+        'device': job.get('device', 'CPU'),
+        'bg_color': job.get('bg_color'),
+        'background_image': hash_file(background_image) if background_image else None,
+        'script': script_version()
+    }
+    if backend:
+        parts['backend'] = backend  # Only set when not plain Blender, so those keys stay valid
+    quality = quality_key(job.get('quality'))
+    if quality:
+        parts['quality'] = quality
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """Size-bounded LRU cache of rendered PNGs on disk"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, use_hardlinks=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.use_hardlinks = use_hardlinks
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def entry_path(self, key):
+        """Where the cached PNG for a key is stored"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def fetch(self, key, output_path):
+        """Place the cached render for key at output_path; returns False on a miss"""
+        entry = self.entry_path(key)
+        if not os.path.exists(entry):
+            return False
+        try:
+            # Mark as recently used for LRU eviction
+            os.utime(entry)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if self.use_hardlinks:
+                try:
+                    os.link(entry, output_path)
+                    return True
+                except OSError:
+                    pass  # Different filesystem or no hardlink support, copy instead
+            copy_atomic(entry, output_path)
+            return True
+        except OSError as e:
+            print(f"Error reading render cache entry {entry}: {e}")
+            return False
+
+    def store(self, key, output_path):
+        """Copy a finished render into the cache"""
+        entry = self.entry_path(key)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Copy to a temporary file first so a half-written entry is never visible
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, entry)
+        except OSError as e:
+            print(f"Error writing render cache entry {entry}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self.lock:
+            self.total_bytes += os.path.getsize(entry)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """(path, last used time, size) for every cache entry"""
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits its limit"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+def hash_skins(skin_paths, max_workers=None):
+    """Hash the decoded pixels of many skins; unreadable skins map to None"""
+    skin_paths = list(dict.fromkeys(skin_paths))
+
+    def safe_hash(skin_path):
+        try:
+            return hash_skin_pixels(skin_path)
+        except (OSError, ValueError) as e:
+            print(f"Could not read skin {skin_path}: {e}")
+            return None
+
+    if len(skin_paths) < PARALLEL_HASH_THRESHOLD:
+        return {skin_path: safe_hash(skin_path) for skin_path in skin_paths}
+    # Decoding PNGs spends most of its time in zlib, which releases the GIL
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(skin_paths, executor.map(safe_hash, skin_paths)))
+
+def assign_render_keys(jobs, background_image=None, max_workers=None, backend=None):
+    """Set job['cache_key'] for every job whose skin could be read"""
+    skin_hashes = hash_skins([job['skin_path'] for job in jobs], max_workers)
+    for job in jobs:
+        skin_hash = skin_hashes.get(job['skin_path'])
+        if skin_hash:
+            job['cache_key'] = render_key(job, background_image, skin_hash, backend)
+
+def resolve_cached_jobs(cache, jobs):
+    """Split jobs into cache hits and misses
+
+    Jobs need a 'cache_key' (see assign_render_keys); jobs without one always miss.
+    Hits are materialized at their output path right away.
+    Returns (hit statuses keyed by job id, jobs that still need rendering).
+    """
+    hits = {}
+    misses = []
+    for job in jobs:
+        if job.get('cache_key') and cache.fetch(job['cache_key'], job['output_path']):
+            hits[job['id']] = {'id': job['id'], 'status': 'done', 'output_path': job['output_path'],
+                               'elapsed': 0.0, 'cached': True}
+        else:
+            misses.append(job)
+    return hits, misses
+
+def dedupe_jobs(jobs):
+    """Keep one job per render key
+
+    Returns (unique jobs, dict mapping a kept job's id to its duplicate jobs).
+    Jobs without a 'cache_key' are never merged.
+    """
+    unique_jobs = []
+    primaries = {}
+    duplicates = {}
+    for job in jobs:
+        key = job.get('cache_key')
+        if key and key in primaries:
+            duplicates.setdefault(primaries[key]['id'], []).append(job)
+        else:
+            if key:
+                primaries[key] = job
+            unique_jobs.append(job)
+    return unique_jobs, duplicates
+
+def fan_out(job, status, duplicates):
+    """Copy a finished render to the output files of its duplicates
+
+    Returns (duplicate job, status) pairs for progress reporting.
+    """
+    fanned = []
+    for duplicate in duplicates.get(job['id'], []):
+        duplicate_status = {'id': duplicate['id'], 'status': status['status'],
+                            'output_path': duplicate['output_path'], 'elapsed': 0.0,
+                            'duplicate_of': job['id']}
+        if status['status'] == 'done':
+            try:
+                copy_atomic(status['output_path'], duplicate['output_path'])
+            except OSError as e:
+                duplicate_status.update(status='failed', error=f"Failed to copy render: {e}")
+        else:
+            duplicate_status['error'] = status.get('error')
+        fanned.append((duplicate, duplicate_status))
+    return fanned
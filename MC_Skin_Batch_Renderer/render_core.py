@@ -0,0 +1,452 @@
+import os
+import re
+import time
+import datetime
+from PIL import Image
+from render_pool import RenderPool
+from render_retry import RetryPolicy
+from render_scheduler import write_output_manifest, expand_pose_jobs
+from render_quality import quality_settings
+from render_budget import RenderBudget, BudgetScheduler, upscale_render
+from render_journal import JobJournal, journal_path, reserve_journal, load_journal, completed_job_ids, JOURNAL_SUFFIX
+from render_cache import RenderCache, assign_render_keys, resolve_cached_jobs, dedupe_jobs, fan_out
+
+"""
+Rendering core shared by the GUI and the command line
+
+Everything needed to turn a list of skins into finished images without
+tkinter: job building (output names, model files, render settings), background
+compositing and BatchRenderer, which runs a batch through the journal,
+deduplication, render cache and worker pool and writes the output manifest.
+
+Progress is reported as event dicts (see BatchRenderer.run), which the GUI
+turns into progress bar updates and the CLI prints as JSON lines.
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_PATH = os.path.join(SCRIPT_DIR, "blender_render_script.py")
+MODEL_DIR = os.path.join(SCRIPT_DIR, "model")
+
+ASPECT_RATIOS = {'1:1': (1024, 1024), '4:3': (1024, 768), '3:4': (768, 1024), '16:9': (1024, 576), '9:16': (576, 1024)}
+MODEL_TYPES = ['standard', 'slim']
+MODEL_NUMS = ['1', '2', '3', '4', '5', 'a']
+
+# Shortest gap between two progress events of one job (phase changes are always reported)
+PROGRESS_INTERVAL = 0.5
+
+def get_model_file(model_type, model_num='1'):
+    """Select corresponding blender file based on model type and pose number"""
+    # Model a (original model 4) uses the same naming as the other models
+    if model_type == 'standard':
+        return os.path.join(MODEL_DIR, f"Steve-model{model_num}.blend")
+    else:
+        return os.path.join(MODEL_DIR, f"Alex-model{model_num}.blend")
+
+def available_poses(model_type, backend=None):
+    """Pose numbers that have a model file for the model type and that the backend (if given) can render"""
+    poses = []
+    for model_num in MODEL_NUMS:
+        model_file = get_model_file(model_type, model_num)
+        if os.path.isfile(model_file) and (backend is None or backend.model_error(model_file) is None):
+            poses.append(model_num)
+    return poses
+
+MODEL_FILE_PATTERN = re.compile(r'^(Steve|Alex)-model(\w+)\.blend$', re.IGNORECASE)
+
+def parse_model_file(model_file):
+    """('standard' or 'slim', pose) of a model file name, or None if it isn't a player model"""
+    match = MODEL_FILE_PATTERN.match(os.path.basename(model_file))
+    if not match:
+        return None
+    return ('slim' if match.group(1).lower() == 'alex' else 'standard'), match.group(2)
+
+def detect_model_type(skin_path):
+    """Guess standard or slim from the skin: slim arms leave x=54-55 of the arm rows empty"""
+    try:
+        with Image.open(skin_path) as img:
+            if img.size != (64, 64):
+                return 'standard'  # Legacy 64x32 skins are always standard
+            rgba = img.convert('RGBA')
+            if all(rgba.getpixel((x, y))[3] == 0 for x in (54, 55) for y in range(20, 32)):
+                return 'slim'
+    except (OSError, ValueError):
+        pass
+    return 'standard'
+
+def hex_to_rgb(hex_color):
+    """Convert hex color to RGB float values between 0-1"""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) == 6:
+        # RGB format
+        r, g, b = tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4))
+        a = 1.0  # Default opacity
+    elif len(hex_color) == 8:
+        # RGBA format
+        r, g, b, a = tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4, 6))
+    else:
+        # Default transparent
+        r, g, b, a = 0.0, 0.0, 0.0, 0.0
+    return f"{r},{g},{b},{a}"
+
+def format_duration(seconds):
+    """Format seconds as e.g. 1h2m3s"""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    seconds = int(seconds % 60)
+
+    if hours > 0:
+        return f"{hours}h{minutes}m{seconds}s"
+    elif minutes > 0:
+        return f"{minutes}m{seconds}s"
+    else:
+        return f"{seconds}s"
+
+def batch_time_str(output_dir=None):
+    """Timestamp used as prefix for a batch's output files, journal and manifest
+
+    With output_dir the name is reserved there (see reserve_journal), so it is
+    unique even for batches started in the same second.
+    """
+    time_str = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
+    return reserve_journal(output_dir, time_str) if output_dir else time_str
+
+def get_output_file(output_dir, skin_info, time_str, aspect_ratio, reserved_files=None, model_num=None):
+    """Generate output filename (ensure no conflict)
+
+    model_num is added to the name when rendering several poses per skin.
+    """
+    if reserved_files is None:
+        reserved_files = set()
+    skin_name = os.path.basename(skin_info['path'])
+    base_name = os.path.splitext(skin_name)[0]
+    if model_num is not None:
+        base_name = f"{base_name}_model{model_num}"
+    # Convert ratio format from '1:1' to '11', '4:3' to '43', etc.
+    ratio_code = aspect_ratio.replace(':', '')
+    output_file = os.path.join(output_dir, f"{time_str}_{base_name}_{skin_info['model']}_{ratio_code}_render.png")
+
+    # Ensure filename doesn't conflict with existing files or other jobs in this batch
+    counter = 1
+    while os.path.exists(output_file) or output_file in reserved_files:
+        output_file = os.path.join(output_dir, f"{time_str}_{base_name}_{skin_info['model']}_render_{counter}.png")
+        counter += 1
+    reserved_files.add(output_file)
+    return output_file
+
+def build_job(skin_info, output_file, aspect_ratio='1:1', device='CPU', bg_color='#00000000', quality=None):
+    """Build a render job for the Blender script (quality: see render_quality.py, default standard)"""
+    width, height = ASPECT_RATIOS[aspect_ratio]
+    return {
+        'skin_path': skin_info['path'],
+        'output_path': output_file,
+        'width': width,
+        'height': height,
+        'device': device,
+        'bg_color': hex_to_rgb(bg_color),
+        'quality': quality or quality_settings()
+    }
+
+def build_batch_jobs(skin_files, output_dir, time_str, aspect_ratio='1:1', device='CPU',
+                     bg_color='#00000000', model_num='1', all_poses=False, quality=None, backend=None):
+    """Build all jobs of a batch up front so output names are assigned deterministically
+
+    skin_files is a list of {'path': ..., 'model': 'standard' or 'slim'}. With
+    all_poses, each job renders the skin in every available pose of its model
+    type (see available_poses and expand_pose_jobs).
+    """
+    jobs = []
+    reserved_files = set()
+    for i, skin_info in enumerate(skin_files):
+        if all_poses:
+            # Multi-pose: one job per skin covering every pose, split per pose for the workers
+            job = {'id': str(i), 'skin_path': skin_info['path'], 'poses': []}
+            # Without any pose model, pose 1 fails with the missing model file
+            for pose_num in available_poses(skin_info['model'], backend) or MODEL_NUMS[:1]:
+                output_file = get_output_file(output_dir, skin_info, time_str, aspect_ratio, reserved_files, pose_num)
+                pose_job = build_job(skin_info, output_file, aspect_ratio, device, bg_color, quality)
+                pose_job['model_num'] = pose_num
+                pose_job['model_file'] = get_model_file(skin_info['model'], pose_num)
+                job['poses'].append(pose_job)
+        else:
+            output_file = get_output_file(output_dir, skin_info, time_str, aspect_ratio, reserved_files)
+            job = build_job(skin_info, output_file, aspect_ratio, device, bg_color, quality)
+            job['id'] = str(i)
+            job['model_file'] = get_model_file(skin_info['model'], model_num)
+        jobs.append(job)
+    return jobs
+
+def apply_background_image(rendered_image_path, background_image_path):
+    """Apply background image to rendered transparent image"""
+    try:
+        print("Starting background image application process")
+        print(f"  Rendered image: {rendered_image_path}")
+        print(f"  Background image: {background_image_path}")
+
+        # Open rendered image with transparent background
+        rendered_img = Image.open(rendered_image_path).convert("RGBA")
+        print(f"  Rendered image size: {rendered_img.size}")
+
+        # Open background image
+        bg_img = Image.open(background_image_path).convert("RGBA")
+        print(f"  Background image original size: {bg_img.size}")
+
+        # Calculate scaling factors to maintain aspect ratio
+        render_width, render_height = rendered_img.size
+        bg_width, bg_height = bg_img.size
+
+        # Calculate scaling factor for width and height
+        scale_x = render_width / bg_width
+        scale_y = render_height / bg_height
+
+        # Use the larger scaling factor to ensure the entire background is covered
+        scale = max(scale_x, scale_y)
+
+        # Calculate new background image dimensions
+        new_bg_width = int(bg_width * scale)
+        new_bg_height = int(bg_height * scale)
+
+        # Resize background image while maintaining aspect ratio
+        bg_img = bg_img.resize((new_bg_width, new_bg_height), Image.LANCZOS)
+        print(f"  Background image resized to: {bg_img.size} with scale factor {scale:.2f}")
+
+        # Create a new image with rendered size
+        bg_opaque = Image.new("RGBA", rendered_img.size, (255, 255, 255, 255))
+
+        # Calculate position to center the background image (may be cropped)
+        x_offset = (render_width - new_bg_width) // 2
+        y_offset = (render_height - new_bg_height) // 2
+
+        # Paste the resized background image onto the opaque background
+        bg_opaque.paste(bg_img, (x_offset, y_offset), bg_img)
+        print(f"  Background image centered at ({x_offset}, {y_offset})")
+
+        # Composite the rendered image on top of the opaque background
+        result_img = Image.alpha_composite(bg_opaque, rendered_img)
+        print("  Completed image compositing")
+
+        # Save the result (overwrite the original rendered image)
+        result_img.save(rendered_image_path, "PNG")
+        print("  Background image applied successfully")
+
+    except Exception as e:
+        print(f"Error applying background image: {e}")
+        import traceback
+        traceback.print_exc()
+
+class BatchRenderer:
+    """Runs batches of render jobs on a pool of Blender workers"""
+
+    def __init__(self, blender_path, workers=1, threads=0, use_cache=True, timeout=None,
+                 script_path=SCRIPT_PATH, on_progress=None, max_attempts=3, timing_log=None, backend=None,
+                 budget=None):
+        self.blender_path = blender_path
+        self.workers = workers
+        self.threads = threads
+        self.use_cache = use_cache
+        self.timeout = timeout  # None: adaptive per-job timeouts
+        self.max_attempts = max_attempts
+        self.timing_log = timing_log  # render_timing.TimingLog for per-phase job timings
+        self.backend = backend  # render_backend backend, None for Blender
+        self.script_path = script_path
+        self.on_progress = on_progress
+        self.budget = budget  # Seconds the batch may take (see render_budget.py), None renders at full quality
+
+    def emit(self, event, **fields):
+        """Report a progress event to the caller"""
+        if self.on_progress:
+            self.on_progress(dict(event=event, **fields))
+
+    def render(self, jobs, output_dir, time_str=None, background_image=None):
+        """Render a new batch; returns the batch summary (see run)
+
+        time_str should come from batch_time_str(output_dir); a time_str whose
+        journal another batch already wrote to gets a unique suffix instead.
+        """
+        if not time_str:
+            time_str = batch_time_str(output_dir)
+        elif os.path.exists(journal_path(output_dir, time_str)) and os.path.getsize(journal_path(output_dir, time_str)):
+            time_str = reserve_journal(output_dir, time_str)
+        journal = JobJournal(journal_path(output_dir, time_str))
+        journal.record_batch(jobs, time_str=time_str, background_image=background_image)
+        return self.run(jobs, output_dir, time_str, journal, background_image)
+
+    def resume(self, journal_file):
+        """Resume the batch recorded in a journal, keeping renders that are already done"""
+        settings, jobs, states, _ = load_journal(journal_file)
+        time_str = settings.get('time_str') or os.path.basename(journal_file)[:-len(JOURNAL_SUFFIX)]
+        output_dir = os.path.dirname(os.path.abspath(journal_file))
+        completed = {job_id: states[job_id] for job_id in completed_job_ids(states)}
+        journal = JobJournal(journal_file)
+        journal.record('resumed', completed=len(completed))
+        print(f"Resuming batch {time_str}: {len(completed)} renders already done")
+        return self.run(jobs, output_dir, time_str, journal, settings.get('background_image'), completed)
+
+    def run(self, jobs, output_dir, time_str, journal, background_image=None, completed=None):
+        """Render jobs, skipping those in completed (job id -> journal entry)
+
+        Emits 'status' (message), 'batch', 'started' (id, skin_path, completed, total),
+        'progress' (id, skin_path, completed, total, phase, sample, samples; at most every
+        PROGRESS_INTERVAL seconds per job unless the phase changes), 'result'
+        (id, status, output_path, error, attempts, quarantined, completed, total,
+        progress, remaining_time), 'budget' (level, samples, render_scale, time_left,
+        queued; when a time budget changes the render level) and 'finished' events.
+        Returns a summary dict with the per-job results and the manifest path.
+        """
+        completed = completed or {}
+        batch_start_time = time.time()
+        render_jobs = expand_pose_jobs(jobs)
+        total_renders = len(render_jobs)
+        cache = RenderCache() if self.use_cache else None
+        pool = RenderPool(self.blender_path, self.workers, self.script_path, threads=self.threads,
+                          retry_policy=RetryPolicy(self.timeout, self.max_attempts), timing_log=self.timing_log,
+                          backend=self.backend)
+        print(f"Rendering {len(jobs)} skins ({total_renders} renders) with {pool.num_workers} workers x {pool.threads or 'auto'} threads")
+        budget = None
+        if self.budget:
+            # The deadline counts from the start of the batch, hashing and cache lookups included
+            budget = RenderBudget(self.budget, pool.num_workers, batch_start_time, pool.retry_policy.timings,
+                                  pool.threads, on_change=lambda info: self.emit('budget', **info))
+            print(f"Time budget: {format_duration(self.budget)}")
+        self.emit('batch', time_str=time_str, skins=len(jobs), total=total_renders,
+                  completed=len(completed), workers=pool.num_workers, threads=pool.threads)
+
+        # Renders finished before an interruption count as done already
+        results = {}
+        for job_id, entry in completed.items():
+            results[job_id] = {'id': job_id, 'status': 'done', 'output_path': entry['output_path']}
+        progress = {'completed': len(completed), 'last_finish_time': batch_start_time}
+        render_times = []
+        remaining_jobs = [job for job in render_jobs if job['id'] not in completed]
+
+        last_progress = {}  # job id -> (time, phase) of the last progress event
+
+        def on_render_progress(slot, job, render_progress):
+            """Report live Cycles progress of a job, throttled"""
+            now = time.time()
+            last_time, last_phase = last_progress.get(job['id'], (0, None))
+            if render_progress['phase'] == last_phase and now - last_time < PROGRESS_INTERVAL:
+                return
+            last_progress[job['id']] = (now, render_progress['phase'])
+            self.emit('progress', id=job['id'], skin_path=job['skin_path'], completed=progress['completed'],
+                      total=total_renders, **render_progress)
+
+        def on_start(slot, job):
+            """Report a worker picking up a job"""
+            journal.record('started', job['id'])
+            self.emit('started', id=job['id'], skin_path=job['skin_path'],
+                      completed=progress['completed'], total=total_renders)
+
+        def post_process(job, status):
+            """Apply background image if enabled, then keep the result in the render cache"""
+            output_file = status['output_path']
+            if budget is not None and os.path.exists(output_file):
+                upscale_render(job, output_file)
+            if background_image and os.path.exists(output_file):
+                apply_background_image(output_file, background_image)
+                print(f"Successfully applied background image to: {job['output_path']}")
+            if cache and job.get('cache_key') and os.path.exists(output_file):
+                cache.store(job['cache_key'], output_file)
+
+        def on_result(slot, job, status):
+            """Record a finished job and the duplicates sharing its render"""
+            if budget is not None and 'budget_level' in job:
+                budget.record(job, status)
+                status.update(quality=job['quality'], render_scale=job['render_scale'])
+            record_result(job, status)
+            # Identical skins in this batch share the render
+            for duplicate, duplicate_status in fan_out(job, status, duplicates):
+                if 'render_scale' in status:
+                    duplicate_status.update(quality=status['quality'], render_scale=status['render_scale'])
+                results[duplicate['id']] = duplicate_status
+                record_result(duplicate, duplicate_status)
+
+        def record_result(job, status):
+            """Count one finished output towards progress"""
+            last_progress.pop(job['id'], None)
+            journal.record(status['status'], job['id'], output_path=job['output_path'],
+                           error=status.get('error'))
+            if status.get('duplicate_of') is not None and status['status'] == 'done':
+                print(f"Copied duplicate render to: {status['output_path']}")
+            elif status.get('cached'):
+                print(f"Reused cached render for: {status['output_path']}")
+            elif status['status'] == 'done':
+                print(f"Successfully rendered to: {status['output_path']}")
+            else:
+                # Rendering error, but continue with next skin
+                print(f"Error rendering {job['skin_path']}: {status.get('error')}")
+
+            # Record time since the previous finished skin (reflects parallel throughput)
+            finish_time = time.time()
+            if not status.get('cached') and status.get('duplicate_of') is None:
+                render_times.append(finish_time - progress['last_finish_time'])
+            progress['last_finish_time'] = finish_time
+            progress['completed'] += 1
+
+            # Predict the remaining time from the average time per render
+            remaining_time = None
+            if len(render_times) > 1:
+                avg_time = sum(render_times) / len(render_times)
+                remaining_time = avg_time * (total_renders - progress['completed'])
+
+            self.emit('result', id=job['id'], status=status['status'], output_path=job['output_path'],
+                      error=status.get('error'), cached=bool(status.get('cached')),
+                      duplicate_of=status.get('duplicate_of'), elapsed=status.get('elapsed'),
+                      attempts=status.get('attempts'), quarantined=bool(status.get('quarantined')),
+                      completed=progress['completed'], total=total_renders,
+                      progress=progress['completed'] / total_renders * 100,
+                      remaining_time=remaining_time)
+
+        # Hash skin pixels and settings; identical jobs are rendered once
+        self.emit('status', message="Checking for duplicate skins...")
+        assign_render_keys(remaining_jobs, background_image, backend=pool.backend.cache_tag)
+        pending_jobs, duplicates = dedupe_jobs(remaining_jobs)
+        duplicate_count = len(remaining_jobs) - len(pending_jobs)
+        if duplicate_count:
+            print(f"Found {duplicate_count} duplicate skins, rendering {len(pending_jobs)} unique jobs")
+
+        if cache:
+            # Skip Blender for jobs whose exact render is already cached
+            self.emit('status', message="Checking render cache...")
+            cached_results, pending_jobs = resolve_cached_jobs(cache, pending_jobs)
+            for job in remaining_jobs:
+                if job['id'] in cached_results:
+                    results[job['id']] = cached_results[job['id']]
+                    on_result(None, job, cached_results[job['id']])
+            print(f"Render cache: {len(cached_results)} hits, {len(pending_jobs)} to render")
+
+        progress['last_finish_time'] = time.time()
+        try:
+            if budget is not None:
+                # Each job gets its level when a worker picks it up
+                pool.run_scheduler(BudgetScheduler(pending_jobs, budget), min(pool.num_workers, len(pending_jobs)),
+                                   results, on_start, on_result, post_process, on_render_progress)
+            else:
+                results.update(pool.run(pending_jobs, on_start, on_result, post_process, on_render_progress))
+        except Exception as e:
+            print(f"Unknown error during batch rendering: {e}")
+
+        journal.record('finished')
+        journal.close()
+
+        # Record the results in the order the skins were added
+        manifest_file = os.path.join(output_dir, f"{time_str}_render_manifest.json")
+        try:
+            write_output_manifest(manifest_file, jobs, results)
+            print(f"Output manifest written to: {manifest_file}")
+        except OSError as e:
+            print(f"Error writing output manifest: {e}")
+            manifest_file = None
+
+        done = sum(1 for job in render_jobs if results.get(job['id'], {}).get('status') == 'done')
+        summary = {
+            'time_str': time_str,
+            'skins': len(jobs),
+            'total': total_renders,
+            'done': done,
+            'failed': total_renders - done,
+            'elapsed': time.time() - batch_start_time,
+            'manifest': manifest_file,
+            'results': results
+        }
+        self.emit('finished', **{key: value for key, value in summary.items() if key != 'results'})
+        return summary
@@ -0,0 +1,151 @@
+import os
+import glob
+import json
+import shutil
+import tempfile
+import threading
+
+"""
+Batch job journal
+
+Every batch appends its progress to {time}_render_journal.jsonl in the output
+directory: one 'queued' line per job (with the full job, so the batch can be
+rebuilt), then 'started', 'done' and 'failed' lines per render as they happen,
+and a final 'finished' line. The file is only ever appended to, so a crash
+leaves at most one truncated line at the end.
+
+Renders are written to a partial file next to the final output and moved into
+place only when they are complete, so a 'done' entry always points at a whole
+image. Resuming a batch skips renders that are done and still on disk and
+queues everything else again.
+"""
+
+JOURNAL_SUFFIX = "_render_journal.jsonl"
+
+def journal_path(output_dir, time_str):
+    """Journal file of the batch started at time_str"""
+    return os.path.join(output_dir, f"{time_str}{JOURNAL_SUFFIX}")
+
+def reserve_journal(output_dir, time_str):
+    """Claim a journal name no other batch in output_dir uses; returns its stem
+
+    The journal file is created exclusively, so two batches started in the same
+    second get time_str and time_str-2 instead of sharing one journal.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem = time_str
+    counter = 1
+    while True:
+        try:
+            with open(journal_path(output_dir, stem), 'x', encoding='utf-8'):
+                return stem
+        except FileExistsError:
+            counter += 1
+            stem = f"{time_str}-{counter}"
+
+def partial_output_path(output_path):
+    """Where a render is written before it is finalized"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.partial{ext or '.png'}"
+
+def finalize_output(partial_path, output_path):
+    """Atomically move a finished render to its final name"""
+    os.replace(partial_path, output_path)
+
+def copy_atomic(source_path, output_path):
+    """Copy a file so that output_path never holds a half-written copy"""
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, output_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class JobJournal:
+    """Append-only journal of one batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        # Start on a fresh line if a crash left the last line truncated
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def record(self, event, job_id=None, **fields):
+        """Append one event; done/failed events are synced to disk"""
+        entry = {'event': event}
+        if job_id is not None:
+            entry['id'] = job_id
+        entry.update(fields)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.file.flush()
+            if event in ('done', 'failed', 'finished'):
+                os.fsync(self.file.fileno())
+
+    def record_batch(self, jobs, **settings):
+        """Write the batch header and a 'queued' entry for every job"""
+        self.record('batch', jobs=len(jobs), **settings)
+        for job in jobs:
+            self.record('queued', job['id'], job=job)
+
+    def close(self):
+        """Close the journal file"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def load_journal(path):
+    """Read a journal back
+
+    Returns (batch settings, jobs in queue order, dict mapping render job id
+    to its last 'started'/'done'/'failed' entry, whether the batch finished).
+    """
+    settings = {}
+    jobs = []
+    states = {}
+    finished = False
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Truncated line from a crash
+            event = entry.get('event')
+            if event == 'batch':
+                settings = entry
+            elif event == 'queued':
+                jobs.append(entry['job'])
+            elif event in ('started', 'done', 'failed'):
+                states[entry['id']] = entry
+            elif event == 'finished':
+                finished = True
+    return settings, jobs, states, finished
+
+def completed_job_ids(states):
+    """Ids of renders that are done and whose output is still on disk"""
+    return {job_id for job_id, entry in states.items()
+            if entry['event'] == 'done' and os.path.exists(entry.get('output_path', ''))}
+
+def find_unfinished_journals(output_dir):
+    """Journals in output_dir whose batch never finished, newest first"""
+    unfinished = []
+    for path in sorted(glob.glob(os.path.join(output_dir, f"*{JOURNAL_SUFFIX}")), reverse=True):
+        try:
+            if not load_journal(path)[3]:
+                unfinished.append(path)
+        except OSError:
+            continue
+    return unfinished
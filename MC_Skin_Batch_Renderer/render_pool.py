@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from blender_worker import BlenderWorkerError
+from render_scheduler import JobScheduler
+from render_journal import partial_output_path, finalize_output
+from render_retry import RetryPolicy
+from render_timing import JobTimer
+from render_backend import BlenderBackend
+
+"""
+Parallel render pool
+
+Runs several persistent Blender workers (or workers of another backend, see
+render_backend.py) at once. All jobs go into one shared
+JobScheduler and every pool slot pulls the next job as soon as it is free,
+preferring jobs for the model file its warm worker already has loaded.
+
+The worker layout (workers x threads) splits the CPU between the workers: each
+Blender gets a fixed Cycles thread count and, on Linux, is pinned to its own
+disjoint set of cores so concurrent renders don't thrash each other's caches.
+
+Blender renders into a partial file that is moved to the job's output path
+only after post-processing, so an output file is never left half-written.
+
+Each render gets a timeout from the pool's RetryPolicy (by default derived from
+the job's cost and past render times). A render that timed out or crashed its
+worker is queued again and picked up by a fresh Blender worker, until the
+policy quarantines the skin; other failures are reported right away.
+
+With a timing log, every render attempt is written to it with the spans of
+its phases (see render_timing.py).
+"""
+
+def available_cores():
+    """CPU cores this process is allowed to run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def max_worker_count():
+    """Upper bound for the worker count setting"""
+    return len(available_cores())
+
+def parse_worker_layout(text):
+    """Parse a worker layout such as '8x8' into (workers, threads)
+
+    A bare number means that many workers with an automatic thread count.
+    """
+    text = str(text).lower().replace('×', 'x').replace('*', 'x').strip()
+    parts = text.split('x')
+    if len(parts) == 1:
+        return max(1, int(parts[0])), 0
+    if len(parts) == 2:
+        return max(1, int(parts[0])), max(0, int(parts[1]))
+    raise ValueError(f"Invalid worker layout: {text}")
+
+def resolve_worker_layout(workers, threads=0):
+    """Fill in the thread count: split the cores evenly when it is 0
+
+    A single worker with threads 0 keeps Blender's own auto-detection.
+    """
+    workers = max(1, int(workers))
+    threads = max(0, int(threads))
+    if threads == 0 and workers > 1:
+        threads = max(1, len(available_cores()) // workers)
+    return workers, threads
+
+def partition_cores(workers, threads):
+    """Split the available cores into one disjoint set per worker
+
+    Returns None when pinning is not supported or the layout needs more cores than available.
+    """
+    if not hasattr(os, 'sched_setaffinity') or threads <= 0:
+        return None
+    cores = available_cores()
+    if workers * threads > len(cores):
+        print(f"Worker layout {workers}x{threads} exceeds {len(cores)} cores, not pinning workers")
+        return None
+    return [cores[slot * threads:(slot + 1) * threads] for slot in range(workers)]
+
+# Where the tuned worker layout for this machine is stored (see autotune.py)
+LAYOUT_FILE = os.path.join(os.path.expanduser('~'), '.mcskin_worker_layout.json')
+
+def save_worker_layout(workers, threads, skins_per_minute=None, results=None, path=LAYOUT_FILE):
+    """Persist the tuned worker layout for this machine"""
+    data = {
+        'workers': workers,
+        'threads': threads,
+        'skins_per_minute': skins_per_minute,
+        'cpu_count': len(available_cores()),
+        'results': results or []
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+def load_worker_layout(path=LAYOUT_FILE):
+    """Load the tuned (workers, threads) layout, or None if there is none for this machine"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # A layout tuned on a different core count doesn't apply here
+    if data.get('cpu_count') != len(available_cores()):
+        return None
+    try:
+        return int(data['workers']), int(data['threads'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class RenderPool:
+    """Pool of persistent Blender workers pulling jobs from a shared queue"""
+
+    def __init__(self, blender_path, num_workers=1, script_path=None, timeout=None, threads=0, pin_cores=True,
+                 retry_policy=None, timing_log=None, backend=None):
+        self.blender_path = blender_path
+        self.backend = backend or BlenderBackend(blender_path, script_path)
+        self.num_workers, self.threads = resolve_worker_layout(num_workers, threads)
+        self.script_path = script_path
+        self.timeout = timeout  # Fixed seconds per render, None for adaptive timeouts
+        self.retry_policy = retry_policy or RetryPolicy(timeout)
+        self.timing_log = timing_log  # render_timing.TimingLog or None
+        self.core_sets = partition_cores(self.num_workers, self.threads) if pin_cores else None
+        self.stop_event = threading.Event()
+        self.callback_lock = threading.Lock()  # Callbacks run one at a time
+
+    def stop(self):
+        """Stop handing out new jobs (running jobs finish)"""
+        self.stop_event.set()
+
+    def run(self, jobs, on_start=None, on_result=None, post_process=None, on_progress=None):
+        """Render jobs in parallel and wait until all are finished
+
+        Each job is a dict with a 'model_file' and an 'id' plus the fields of a
+        Blender worker job. on_start(slot, job) is called when a worker picks up
+        a job and on_result(slot, job, status) when it finishes; both are called
+        under a lock, so they may update shared progress state.
+        post_process(job, status) runs in the worker thread without the lock
+        for successfully rendered jobs (e.g. background compositing), before
+        status['output_path'] (a partial file) is moved to the job's output path.
+        on_progress(slot, job, progress) is called under the lock with the live
+        Cycles progress of a rendering job (see blender_worker.parse_progress).
+        Failed renders are retried according to the retry policy; only the
+        final attempt is reported, with its 'attempts' count.
+        Returns a dict mapping job id to its final status.
+        """
+        results = {}
+        self.run_scheduler(JobScheduler(jobs), min(self.num_workers, len(jobs)), results,
+                           on_start, on_result, post_process, on_progress)
+        return results
+
+    def run_scheduler(self, scheduler, num_threads, results=None, on_start=None, on_result=None, post_process=None,
+                      on_progress=None):
+        """Serve jobs from a scheduler with num_threads workers until it runs dry
+
+        Like run(), but the jobs come from any object with next_job(slot, current_model)
+        (e.g. a StreamScheduler). Statuses are only collected when results is a dict.
+        """
+        threads = []
+        for slot in range(num_threads):
+            thread = threading.Thread(target=self._worker_loop,
+                                      args=(slot, scheduler, results, on_start, on_result, post_process,
+                                            on_progress),
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+        if self.backend.persist_timings:
+            self.retry_policy.timings.save()
+
+    def create_worker(self, slot, model_file):
+        """Create the backend's worker for a pool slot"""
+        cpu_affinity = self.core_sets[slot] if self.core_sets else None
+        return self.backend.create_worker(model_file, self.threads, cpu_affinity)
+
+    def _worker_loop(self, slot, scheduler, results, on_start, on_result, post_process, on_progress):
+        """Take jobs from the scheduler until it is empty"""
+        worker = None
+        try:
+            while not self.stop_event.is_set():
+                current_model = worker.model_file if worker is not None and worker.is_alive() else None
+                job = scheduler.next_job(slot, current_model)
+                if job is None:
+                    break
+                timer = JobTimer()
+                timer.add('queue_wait', scheduler.queued_since(job['id']), time.time())
+
+                # Don't spend a worker on a skin that already failed too often
+                quarantine_error = self.retry_policy.quarantine_error(job)
+                if quarantine_error:
+                    self._report(slot, job, {'id': job['id'], 'status': 'failed', 'error': quarantine_error,
+                                             'quarantined': True}, results, on_result)
+                    continue
+
+                # A missing or unsupported model fails the same way on every attempt
+                model_error = self.backend.model_error(job['model_file'])
+                if model_error:
+                    status = {'id': job['id'], 'status': 'failed', 'error': model_error}
+                    self._log_timing(slot, None, job, status, timer)
+                    self._report(slot, job, status, results, on_result)
+                    continue
+
+                # Keep the warm worker if it already has this model loaded
+                if worker is None or worker.model_file != job['model_file'] or not worker.is_alive():
+                    if worker is not None:
+                        worker.close()
+                    worker = None
+                    try:
+                        worker = self.create_worker(slot, job['model_file'])
+                        worker.start()
+                        timer.extend(worker.startup_spans)
+                    except (BlenderWorkerError, subprocess.TimeoutExpired, OSError) as e:
+                        print(f"Failed to start Blender worker for {job['model_file']}: {e}")
+                        if worker is not None:
+                            worker.kill()
+                        worker = None
+                        status = {'id': job['id'], 'status': 'failed', 'error': str(e)}
+                        self._log_timing(slot, None, job, status, timer)
+                        self._report(slot, job, status, results, on_result)
+                        continue
+
+                if on_start:
+                    with self.callback_lock:
+                        on_start(slot, job)
+
+                # Render to a partial file, it only gets the real name once complete
+                partial_path = partial_output_path(job['output_path'])
+                attempt = self.retry_policy.attempt(job)
+                timeout = self.retry_policy.timeout_for(job, self.threads, attempt)
+                pid = worker.pid
+                start_time = time.time()
+                transient = False  # Only a dead or hung worker is worth another attempt
+                try:
+                    status = worker.render(dict(job, output_path=partial_path), timeout=timeout,
+                                           on_progress=self._progress_reporter(slot, job, on_progress))
+                except subprocess.TimeoutExpired:
+                    # The worker was killed, the next job starts a fresh one
+                    status = {'id': job['id'], 'status': 'failed', 'error': f"Rendering timed out after {timeout:.0f}s"}
+                    worker = None
+                    transient = True
+                except BlenderWorkerError as e:
+                    status = {'id': job['id'], 'status': 'failed', 'error': str(e)}
+                    worker = None
+                    transient = True
+                timer.add('blender', start_time, time.time())
+                timer.extend(status.pop('timings', None))
+                if status.get('status') == 'done' and not status.get('elapsed'):
+                    status['elapsed'] = time.time() - start_time
+
+                if self.retry_policy.record(job, status, self.threads, transient):
+                    self._log_timing(slot, pid, job, status, timer)
+                    # Retry on a fresh worker in case this one is in a bad state
+                    print(f"Render of {job['skin_path']} failed (attempt {attempt}): {status.get('error')}, retrying")
+                    if worker is not None:
+                        worker.close()
+                        worker = None
+                    self._finalize(job, status, partial_path)
+                    scheduler.put(job)
+                    continue
+
+                if post_process and status.get('status') == 'done':
+                    with timer.phase('post_process'):
+                        try:
+                            post_process(job, status)
+                        except Exception as e:
+                            print(f"Error post-processing {job.get('output_path')}: {e}")
+                with timer.phase('finalize'):
+                    status = self._finalize(job, status, partial_path)
+
+                self._log_timing(slot, pid, job, status, timer)
+                self._report(slot, job, status, results, on_result)
+        finally:
+            if worker is not None:
+                worker.close()
+
+    def _log_timing(self, slot, pid, job, status, timer):
+        """Write the timing record of a render attempt to the timing log"""
+        if self.timing_log is None:
+            return
+        record = timer.record(job, status, slot=slot, pid=pid, attempt=status.get('attempts', 1))
+        try:
+            self.timing_log.write(record)
+        except (OSError, ValueError) as e:
+            print(f"Error writing timing record: {e}")
+
+    def _progress_reporter(self, slot, job, on_progress):
+        """Progress callback for one job, or None when nobody listens"""
+        if on_progress is None:
+            return None
+
+        def report(progress):
+            with self.callback_lock:
+                on_progress(slot, job, progress)
+        return report
+
+    def _finalize(self, job, status, partial_path):
+        """Move a finished render into place, or clean up after a failed one"""
+        if status.get('status') == 'done':
+            try:
+                finalize_output(partial_path, job['output_path'])
+                return dict(status, output_path=job['output_path'])
+            except OSError as e:
+                status = {'id': job['id'], 'status': 'failed', 'error': f"Failed to finalize output: {e}"}
+        if os.path.exists(partial_path):
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+        return status
+
+    def _report(self, slot, job, status, results, on_result):
+        """Record a job result and notify the caller"""
+        with self.callback_lock:
+            if results is not None:
+                results[job['id']] = status
+            if on_result:
+                on_result(slot, job, status)
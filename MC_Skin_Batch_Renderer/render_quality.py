@@ -0,0 +1,89 @@
+"""
+Render quality presets
+
+A job's 'quality' is a dict of Cycles settings that blender_render_script.py
+applies on top of the .blend file:
+
+    samples             samples per pixel (adaptive sampling stays on)
+    adaptive_threshold  noise level at which adaptive sampling stops a pixel
+    max_bounces         total light bounces
+    denoise             denoise the result with OpenImageDenoise (runs on the CPU)
+    clamp_direct        clamp of direct light samples (0 disables clamping)
+    clamp_indirect      clamp of indirect light samples, removes fireflies
+
+A setting that is None keeps the .blend's own value. The presets range from
+draft (thumbnails and previews, about ten times faster than standard) to final
+(print-quality posters); 'standard' is what every render used before presets
+existed. Changing any setting of a preset makes it 'custom'.
+
+Only Blender renders use the quality. With the blender backend's lightmap
+option the skin pass always renders a few samples without bounces (the
+lighting comes from the lightmap, baked at fixed settings), so samples and
+light paths have no effect there; the raster, baked and fake backends ignore
+the quality entirely.
+"""
+
+QUALITY_SETTINGS = ('samples', 'adaptive_threshold', 'max_bounces', 'denoise', 'clamp_direct', 'clamp_indirect')
+
+QUALITY_PRESETS = {
+    'draft': {'samples': 16, 'adaptive_threshold': 0.1, 'max_bounces': 2, 'denoise': True,
+              'clamp_direct': 0.0, 'clamp_indirect': 1.0},
+    'standard': {'samples': 128, 'adaptive_threshold': None, 'max_bounces': None, 'denoise': None,
+                 'clamp_direct': None, 'clamp_indirect': None},
+    'final': {'samples': 512, 'adaptive_threshold': 0.005, 'max_bounces': 12, 'denoise': True,
+              'clamp_direct': 0.0, 'clamp_indirect': 10.0},
+}
+QUALITY_NAMES = list(QUALITY_PRESETS) + ['custom']
+DEFAULT_QUALITY = 'standard'
+
+def quality_settings(preset=DEFAULT_QUALITY, **overrides):
+    """Quality dict of a preset ('custom' starts from standard), with settings overridden
+
+    The result carries the preset name under 'preset'; it is 'custom' when an
+    override changes a setting of the preset. Overrides that are None are ignored.
+    """
+    if preset not in QUALITY_NAMES:
+        raise ValueError(f"Unknown quality preset: {preset} (choose from {', '.join(QUALITY_NAMES)})")
+    quality = dict(QUALITY_PRESETS.get(preset, QUALITY_PRESETS[DEFAULT_QUALITY]))
+    for name, value in overrides.items():
+        if name not in QUALITY_SETTINGS:
+            raise ValueError(f"Unknown quality setting: {name}")
+        if value is not None and value != quality[name]:
+            quality[name] = value
+            preset = 'custom'
+    quality['preset'] = preset
+    return quality
+
+def quality_key(quality):
+    """The settings of a quality dict for cache keys, None for standard quality (so older keys stay valid)"""
+    if not quality:
+        return None
+    settings = {name: quality.get(name) for name in QUALITY_SETTINGS}
+    if settings == QUALITY_PRESETS[DEFAULT_QUALITY]:
+        return None
+    return settings
+
+def quality_samples(quality):
+    """Samples per pixel of a quality dict"""
+    return int((quality or {}).get('samples') or QUALITY_PRESETS[DEFAULT_QUALITY]['samples'])
+
+def add_quality_arguments(parser):
+    """Quality preset options of commands that render new jobs"""
+    parser.add_argument('--quality', default=DEFAULT_QUALITY, choices=QUALITY_NAMES,
+                        help="Render quality preset: draft (about 10x faster, for previews), standard or "
+                             "final (print quality); the options below override single settings. Ignored "
+                             "by the lightmap, raster, baked and fake backends")
+    parser.add_argument('--samples', type=int, help="Cycles samples per pixel")
+    parser.add_argument('--adaptive-threshold', type=float, help="Adaptive sampling noise threshold")
+    parser.add_argument('--max-bounces', type=int, help="Maximum light bounces")
+    parser.add_argument('--denoise', dest='denoise', action='store_const', const=True,
+                        help="Denoise with OpenImageDenoise")
+    parser.add_argument('--no-denoise', dest='denoise', action='store_const', const=False)
+    parser.add_argument('--clamp-direct', type=float, help="Clamp direct light samples (0 disables)")
+    parser.add_argument('--clamp-indirect', type=float, help="Clamp indirect light samples (0 disables)")
+
+def quality_from_args(args):
+    """Quality dict from the options added by add_quality_arguments"""
+    return quality_settings(args.quality, samples=args.samples, adaptive_threshold=args.adaptive_threshold,
+                            max_bounces=args.max_bounces, denoise=args.denoise, clamp_direct=args.clamp_direct,
+                            clamp_indirect=args.clamp_indirect)
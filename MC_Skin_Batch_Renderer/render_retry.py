@@ -0,0 +1,189 @@
+import os
+import json
+import threading
+from render_quality import quality_samples
+
+"""
+Adaptive render timeouts and retries
+
+A render's timeout is derived from its estimated cost instead of a fixed 60
+seconds: the pixel count times the sample count, scaled by how long renders of
+the same model file at the same thread count took before on this machine.
+Measured render times are kept in a small history file, so a 4K render on a
+slow node gets minutes while a 256px preview is abandoned after seconds.
+
+A render that timed out or killed its worker is retried on a fresh Blender
+worker with a longer timeout. After max_attempts such failures the skin is
+quarantined: its remaining jobs fail immediately, so one broken file can't
+keep a worker slot busy. Quarantine is keyed by the skin's content hash where
+the job has one, so a skin fixed in place renders again. Failures the worker
+reports itself (unreadable skin, unsupported pose, ...) would fail the same
+way again; they fail at once and don't count toward quarantine.
+"""
+
+# Measured render times per model file and thread count
+TIMINGS_FILE = os.path.join(os.path.expanduser('~'), '.mcskin_render_timings.json')
+
+# Cycles samples of the standard quality preset (see render_quality.py)
+DEFAULT_SAMPLES = 128
+
+# Seconds per cost unit (one megapixel at DEFAULT_SAMPLES) before anything was measured
+DEFAULT_SECONDS_PER_UNIT = 30.0
+
+# Weight of a new measurement in the moving average
+SMOOTHING = 0.2
+
+def render_cost(job):
+    """Relative cost of a render job: megapixels times samples / DEFAULT_SAMPLES"""
+    pixels = int(job.get('width', 1024)) * int(job.get('height', 1024))
+    samples = quality_samples(job.get('quality'))
+    return pixels / 1e6 * samples / DEFAULT_SAMPLES
+
+def timing_key(model_file, threads):
+    """History key for a model file rendered with a given thread count"""
+    return f"{os.path.basename(model_file)}@{threads or 'auto'}"
+
+class RenderTimings:
+    """Moving average of render seconds per cost unit, persisted between runs"""
+
+    def __init__(self, path=TIMINGS_FILE):
+        self.path = path
+        self.rates = {}  # timing key -> {'rate': seconds per unit, 'count': measurements}
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path:
+            self.load()
+
+    def load(self):
+        """Read the history file; a missing or broken file starts empty"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.rates = {key: value for key, value in data.get('rates', {}).items() if value.get('rate', 0) > 0}
+        except (OSError, ValueError, AttributeError):
+            self.rates = {}
+
+    def save(self):
+        """Write the history file if anything was measured"""
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            data = {'rates': dict(self.rates)}
+            self.dirty = False
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+        except OSError as e:
+            print(f"Cannot save render timings {self.path}: {e}")
+
+    def observe(self, job, threads, elapsed):
+        """Add the measured render time of a finished job"""
+        cost = render_cost(job)
+        if not elapsed or elapsed <= 0 or cost <= 0:
+            return
+        key = timing_key(job['model_file'], threads)
+        rate = elapsed / cost
+        with self.lock:
+            entry = self.rates.get(key)
+            if entry is None:
+                self.rates[key] = {'rate': rate, 'count': 1}
+            else:
+                entry['rate'] += SMOOTHING * (rate - entry['rate'])
+                entry['count'] += 1
+            self.dirty = True
+
+    def rate(self, model_file, threads):
+        """Seconds per cost unit for a model file, or None if never measured
+
+        Falls back to the slowest model measured at the same thread count.
+        """
+        key = timing_key(model_file, threads)
+        suffix = key[key.rindex('@'):]
+        with self.lock:
+            if key in self.rates:
+                return self.rates[key]['rate']
+            similar = [entry['rate'] for other, entry in self.rates.items() if other.endswith(suffix)]
+        return max(similar) if similar else None
+
+    def estimate(self, job, threads):
+        """Expected render seconds for a job"""
+        rate = self.rate(job['model_file'], threads)
+        if rate is None:
+            rate = DEFAULT_SECONDS_PER_UNIT
+        return rate * render_cost(job)
+
+class RetryPolicy:
+    """Decides each job's timeout and whether a failed job gets another attempt
+
+    timeout fixes the first attempt's timeout in seconds; None derives it from
+    the job's estimated cost (factor times the expected time plus slack,
+    clamped to min_timeout..max_timeout). Each retry multiplies the timeout
+    by backoff. A job whose render times out or kills its worker is attempted
+    at most max_attempts times, after which its skin is quarantined.
+    """
+
+    def __init__(self, timeout=None, max_attempts=3, timings=None, factor=4.0, slack=15.0,
+                 min_timeout=20.0, max_timeout=3600.0, backoff=2.0):
+        self.timeout = timeout
+        self.max_attempts = max(1, int(max_attempts))
+        self.timings = timings if timings is not None else RenderTimings()
+        self.factor = factor
+        self.slack = slack
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff = backoff
+        self.attempts = {}  # job id -> failed attempts so far
+        self.quarantined = {}  # quarantine key (see quarantine_key) -> error of its last attempt
+        self.lock = threading.Lock()
+
+    def timeout_for(self, job, threads=0, attempt=1):
+        """Seconds to wait for one attempt of a job (attempt counts from 1)"""
+        if self.timeout:
+            timeout = float(self.timeout)
+        else:
+            expected = self.timings.estimate(job, threads)
+            timeout = min(self.max_timeout, max(self.min_timeout, expected * self.factor + self.slack))
+        return timeout * self.backoff ** (attempt - 1)
+
+    def attempt(self, job):
+        """Number of the attempt about to start for a job"""
+        with self.lock:
+            return self.attempts.get(job['id'], 0) + 1
+
+    def quarantine_key(self, job):
+        """The skin a job renders: its path plus its content hash when the job has one (e.g. watcher jobs)"""
+        return job.get('skin_path'), job.get('content_hash')
+
+    def quarantine_error(self, job):
+        """Error to fail a job with because its skin is quarantined, or None"""
+        with self.lock:
+            error = self.quarantined.get(self.quarantine_key(job))
+            if error is None:
+                return None
+            self.attempts.pop(job['id'], None)
+        return f"Skin quarantined after {self.max_attempts} failed attempts: {error}"
+
+    def record(self, job, status, threads=0, transient=False):
+        """Account for a finished attempt; returns True if the job should be retried
+
+        transient marks a failure of the worker (timeout or crash) rather than
+        of the job; only those are retried and count toward quarantine.
+        Successful renders feed the timing history. Sets status['attempts'] and,
+        for a skin that used up its attempts, status['quarantined'].
+        """
+        with self.lock:
+            attempts = self.attempts.pop(job['id'], 0) + 1
+            status['attempts'] = attempts
+            if status.get('status') == 'done' or not transient:
+                retry = False
+            elif attempts < self.max_attempts:
+                self.attempts[job['id']] = attempts
+                retry = True
+            else:
+                retry = False
+                if self.max_attempts > 1:
+                    status['quarantined'] = True
+                    self.quarantined[self.quarantine_key(job)] = status.get('error')
+        if status.get('status') == 'done':
+            self.timings.observe(job, threads, status.get('elapsed'))
+        return retry
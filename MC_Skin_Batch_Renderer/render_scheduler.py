@@ -0,0 +1,245 @@
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+
+"""
+Render job scheduler
+
+Reorders a batch into per-model-file groups so each warm Blender worker keeps
+rendering the scene it already has loaded. Mixed standard/slim batches no longer
+alternate between Steve and Alex scene loads. The original order is only
+restored in the output manifest.
+
+A multi-pose job renders one skin through several pose model files. It is split
+into one sub-job per pose, so each pose is served by a warm worker that already
+has that .blend loaded, and the sub-results are merged back into a single job.
+
+StreamScheduler does the same for a job iterator of unknown length, looking
+ahead only a bounded number of jobs so arbitrarily long streams fit in memory.
+QueueScheduler serves a live, bounded queue (e.g. the render service): idle
+slots wait for new jobs instead of finishing.
+"""
+
+class JobScheduler:
+    """Hands out jobs grouped by model file to minimize .blend reloads"""
+
+    def __init__(self, jobs):
+        self.groups = OrderedDict()  # model file -> queue of jobs (original order within a group)
+        self.queued_at = {}  # job id -> time it was queued
+        for job in jobs:
+            self._add(job)
+        self.slot_models = {}  # pool slot -> model file its worker has loaded
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(group) for group in self.groups.values())
+
+    def put(self, job):
+        """Queue a job again (e.g. for a retry)"""
+        with self.lock:
+            self._add(job)
+
+    def queued_since(self, job_id):
+        """Time a handed out job was queued (once per job), or None"""
+        with self.lock:
+            return self.queued_at.pop(job_id, None)
+
+    def _add(self, job):
+        """Append a job to its model group without locking"""
+        self.groups.setdefault(job['model_file'], deque()).append(job)
+        self.queued_at[job['id']] = time.time()
+
+    def next_job(self, slot, current_model=None):
+        """Get the next job for a pool slot, or None when everything is handed out
+
+        A slot keeps getting jobs for the model it has loaded. When that group is
+        empty it switches to the group with the most remaining jobs per worker
+        already serving it, so workers spread across groups instead of piling up.
+        """
+        with self.lock:
+            return self._pick(slot, current_model)
+
+    def _pick(self, slot, current_model):
+        """next_job without locking"""
+        if current_model and self.groups.get(current_model):
+            self.slot_models[slot] = current_model
+            return self.groups[current_model].popleft()
+
+        candidates = [model for model, group in self.groups.items() if group]
+        if not candidates:
+            self.slot_models.pop(slot, None)
+            return None
+
+        def load(model):
+            serving = sum(1 for s, m in self.slot_models.items() if m == model and s != slot)
+            return len(self.groups[model]) / (serving + 1)
+
+        model = max(candidates, key=load)
+        self.slot_models[slot] = model
+        return self.groups[model].popleft()
+
+class StreamScheduler(JobScheduler):
+    """JobScheduler fed lazily from an iterator, holding at most window jobs at a time"""
+
+    def __init__(self, job_iter, window=16):
+        super().__init__([])
+        self.job_iter = iter(job_iter)
+        self.window = max(1, window)
+        self.buffered = 0
+        self.exhausted = False
+        self.error = None  # Exception raised by the iterator, if any
+
+    def __len__(self):
+        with self.lock:
+            return self.buffered
+
+    def put(self, job):
+        """Queue a job again (e.g. for a retry)"""
+        with self.lock:
+            self._add(job)
+            self.buffered += 1
+
+    def next_job(self, slot, current_model=None):
+        """Get the next job for a pool slot, or None when the iterator is used up"""
+        with self.lock:
+            # Top up the look-ahead window so the slot can find a job for its model
+            while not self.exhausted and self.buffered < self.window:
+                try:
+                    job = next(self.job_iter)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+                except Exception as e:
+                    # Stop reading; the caller can re-raise the error once running jobs finish
+                    self.error = e
+                    self.exhausted = True
+                    break
+                self._add(job)
+                self.buffered += 1
+            job = self._pick(slot, current_model)
+            if job is not None:
+                self.buffered -= 1
+            return job
+
+class QueueScheduler(JobScheduler):
+    """Bounded job queue for long-running services; next_job waits until a job arrives or it is closed"""
+
+    def __init__(self, maxsize=100):
+        super().__init__([])
+        self.maxsize = maxsize
+        self.closed = False
+        self.available = threading.Condition(self.lock)
+
+    def submit(self, job):
+        """Queue a new job; raises queue.Full when the queue is at its limit"""
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Scheduler is closed")
+            if sum(len(group) for group in self.groups.values()) >= self.maxsize:
+                raise queue.Full
+            self._add(job)
+            self.available.notify()
+
+    def put(self, job):
+        """Queue a job again (e.g. for a retry), ignoring the size limit"""
+        with self.lock:
+            self._add(job)
+            self.available.notify()
+
+    def close(self):
+        """Stop waiting for jobs; slots finish once the queue is empty"""
+        with self.lock:
+            self.closed = True
+            self.available.notify_all()
+
+    def next_job(self, slot, current_model=None):
+        """Wait for the next job for a pool slot; None once closed and empty"""
+        with self.lock:
+            while not self.closed and not any(self.groups.values()):
+                # Idle slots don't count as serving a model while they wait
+                self.slot_models.pop(slot, None)
+                self.available.wait()
+            return self._pick(slot, current_model)
+
+def expand_pose_jobs(jobs):
+    """Split multi-pose jobs into one render job per pose
+
+    A multi-pose job has a 'poses' list of per-pose jobs (each with model_num,
+    model_file and output_path). Other jobs are passed through unchanged.
+    """
+    render_jobs = []
+    for job in jobs:
+        if 'poses' not in job:
+            render_jobs.append(job)
+            continue
+        for pose_job in job['poses']:
+            render_job = dict(pose_job)
+            render_job['id'] = f"{job['id']}:{pose_job['model_num']}"
+            render_job['parent_id'] = job['id']
+            render_jobs.append(render_job)
+    return render_jobs
+
+def merge_pose_results(job, results):
+    """Combine the per-pose results of a multi-pose job into one status"""
+    outputs = []
+    for pose_job in job['poses']:
+        status = results.get(f"{job['id']}:{pose_job['model_num']}", {})
+        outputs.append({
+            'model_num': pose_job['model_num'],
+            'model_file': pose_job['model_file'],
+            'output_path': pose_job['output_path'],
+            'quality': status.get('quality', pose_job.get('quality')),
+            'render_scale': status.get('render_scale', 1.0),
+            'status': status.get('status', 'pending'),
+            'error': status.get('error'),
+            'elapsed': status.get('elapsed'),
+            'attempts': status.get('attempts'),
+            'quarantined': bool(status.get('quarantined'))
+        })
+    if all(output['status'] == 'done' for output in outputs):
+        overall = 'done'
+    elif any(output['status'] == 'failed' for output in outputs):
+        overall = 'failed'
+    else:
+        overall = 'pending'
+    return {'id': job['id'], 'status': overall, 'outputs': outputs}
+
+def write_output_manifest(manifest_path, jobs, results):
+    """Write the batch results in the original job order
+
+    jobs is the batch in the order the user added the skins; results maps job id
+    to the final status reported by the render pool. Each output records the
+    quality and render_scale it was rendered at (lower under a time budget).
+    """
+    entries = []
+    for index, job in enumerate(jobs):
+        if 'poses' in job:
+            merged = merge_pose_results(job, results)
+            entries.append({
+                'index': index,
+                'skin_path': job['skin_path'],
+                'status': merged['status'],
+                'quality': job['poses'][0].get('quality') if job['poses'] else None,
+                'outputs': merged['outputs']
+            })
+            continue
+        status = results.get(job['id'], {})
+        entries.append({
+            'index': index,
+            'skin_path': job['skin_path'],
+            'model_file': job['model_file'],
+            'output_path': job['output_path'],
+            'quality': status.get('quality', job.get('quality')),
+            'render_scale': status.get('render_scale', 1.0),
+            'status': status.get('status', 'pending'),
+            'error': status.get('error'),
+            'elapsed': status.get('elapsed'),
+            'attempts': status.get('attempts'),
+            'quarantined': bool(status.get('quarantined'))
+        })
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    return entries
@@ -0,0 +1,370 @@
+import io
+import os
+import json
+import math
+import time
+import queue
+import shutil
+import itertools
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from render_pool import RenderPool
+from render_scheduler import QueueScheduler
+from render_retry import RetryPolicy
+from render_api import prepare_job
+from render_quality import DEFAULT_QUALITY, QUALITY_PRESETS, quality_settings
+from render_core import ASPECT_RATIOS, MODEL_NUMS, MODEL_TYPES, SCRIPT_PATH, apply_background_image
+
+"""
+Local HTTP render service
+
+Keeps a pool of warm Blender workers behind a bounded job queue. Jobs are
+grouped by model file, so each worker keeps serving the .blend it has loaded.
+
+Endpoints:
+POST /render?model=auto&pose=1&ratio=1:1&device=CPU&bg_color=00000000&quality=standard[&wait=1]
+    Body is the skin PNG. Returns 202 with the job id, or with wait=1 the
+    rendered PNG once it is done. 503 (with Retry-After) when the queue is full.
+GET /jobs/<id>          Job status and timings as JSON
+GET /jobs/<id>/result   The rendered PNG (202 with the status while not finished)
+GET /stats              Queue length, worker layout and job counts
+
+run_load() is a stand-in client that sends concurrent render requests and
+reports the latency percentiles.
+"""
+
+# Skins are tiny; anything bigger is not a skin
+MAX_UPLOAD_BYTES = 1024 * 1024
+
+# Finished jobs kept for status/result requests before their files are removed
+DEFAULT_MAX_HISTORY = 1000
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def parse_render_params(query):
+    """Render settings from the query string of a /render request; raises ValueError"""
+    params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+    model = params.get('model', 'auto')
+    if model not in MODEL_TYPES + ['auto']:
+        raise ValueError(f"Invalid model: {model}")
+    pose = params.get('pose', '1')
+    if pose not in MODEL_NUMS:
+        raise ValueError(f"Invalid pose: {pose}")
+    ratio = params.get('ratio', '1:1')
+    if ratio not in ASPECT_RATIOS:
+        raise ValueError(f"Invalid ratio: {ratio}")
+    device = params.get('device', 'CPU').upper()
+    if device not in ('CPU', 'GPU'):
+        raise ValueError(f"Invalid device: {device}")
+    bg_color = '#' + params.get('bg_color', '00000000').lstrip('#')
+    if len(bg_color) not in (7, 9):
+        raise ValueError(f"Invalid bg_color: {bg_color}")
+    quality = params.get('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"Invalid quality: {quality}")
+    job = {'model': model, 'pose': pose, 'ratio': ratio, 'device': device, 'bg_color': bg_color,
+           'quality': quality_settings(quality)}
+    return job, params.get('wait', '0').lower() in ('1', 'true', 'yes')
+
+class RenderService:
+    """Bounded render queue served by a pool of warm Blender workers"""
+
+    def __init__(self, blender_path, workers=1, threads=0, queue_size=100, spool_dir=None,
+                 background_image=None, timeout=None, max_history=DEFAULT_MAX_HISTORY, script_path=SCRIPT_PATH,
+                 max_attempts=3, timing_log=None, backend=None):
+        self.pool = RenderPool(blender_path, workers, script_path, threads=threads,
+                               retry_policy=RetryPolicy(timeout, max_attempts), timing_log=timing_log,
+                               backend=backend)
+        self.scheduler = QueueScheduler(queue_size)
+        self.background_image = background_image
+        self.max_history = max_history
+        self.own_spool_dir = spool_dir is None
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="mcskin_service_")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.jobs = OrderedDict()  # job id -> record, oldest first
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.runner = None
+
+    def start(self):
+        """Start the worker pool in the background"""
+        self.runner = threading.Thread(target=self.pool.run_scheduler,
+                                       args=(self.scheduler, self.pool.num_workers, None,
+                                             self._on_start, self._on_result, self._post_process),
+                                       daemon=True)
+        self.runner.start()
+        print(f"Render service started with {self.pool.num_workers} workers x {self.pool.threads or 'auto'} threads")
+
+    def stop(self):
+        """Finish queued jobs, shut the workers down and remove the spool directory"""
+        self.scheduler.close()
+        if self.runner is not None:
+            self.runner.join()
+        if self.own_spool_dir:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def submit(self, skin_data, params):
+        """Queue a skin for rendering; raises queue.Full when the queue is at its limit"""
+        job_id = str(next(self.ids))
+        skin_path = os.path.join(self.spool_dir, f"{job_id}_skin.png")
+        with open(skin_path, 'wb') as f:
+            f.write(skin_data)
+        job = prepare_job(dict(params, id=job_id, skin_path=skin_path,
+                               output_path=os.path.join(self.spool_dir, f"{job_id}_render.png")),
+                          job_id, self.spool_dir)
+        record = {'id': job_id, 'status': 'queued', 'submitted_at': time.time(), 'started_at': None,
+                  'finished_at': None, 'output_path': None, 'error': None, 'elapsed': None,
+                  'finished': threading.Event()}
+        with self.lock:
+            self.jobs[job_id] = record
+        try:
+            self.scheduler.submit(job)
+        except queue.Full:
+            with self.lock:
+                self.jobs.pop(job_id, None)
+            os.remove(skin_path)
+            raise
+        return record
+
+    def get(self, job_id):
+        """The record of a job, or None if unknown"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """Wait until a job is finished; returns its record"""
+        record = self.get(job_id)
+        if record is not None:
+            record['finished'].wait(timeout)
+        return record
+
+    def describe(self, record):
+        """Public JSON view of a job record"""
+        info = {key: record[key] for key in ('id', 'status', 'submitted_at', 'started_at', 'finished_at',
+                                             'error', 'elapsed')}
+        if record['started_at']:
+            info['queue_time'] = record['started_at'] - record['submitted_at']
+        if record['finished_at']:
+            info['latency'] = record['finished_at'] - record['submitted_at']
+        return info
+
+    def stats(self):
+        """Service counters for /stats"""
+        with self.lock:
+            counts = {}
+            for record in self.jobs.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+        return {'queued': len(self.scheduler), 'queue_size': self.scheduler.maxsize,
+                'workers': self.pool.num_workers, 'threads': self.pool.threads, 'jobs': counts}
+
+    def _on_start(self, slot, job):
+        record = self.get(job['id'])
+        if record is not None:
+            record['status'] = 'started'
+            record['started_at'] = time.time()
+
+    def _post_process(self, job, status):
+        if self.background_image and os.path.exists(status['output_path']):
+            apply_background_image(status['output_path'], self.background_image)
+
+    def _on_result(self, slot, job, status):
+        record = self.get(job['id'])
+        if record is None:
+            return
+        record['status'] = status.get('status', 'failed')
+        record['error'] = status.get('error')
+        record['elapsed'] = status.get('elapsed')
+        record['output_path'] = job['output_path'] if record['status'] == 'done' else None
+        record['finished_at'] = time.time()
+        # The uploaded skin is no longer needed
+        if os.path.exists(job['skin_path']):
+            os.remove(job['skin_path'])
+        record['finished'].set()
+        self._trim_history()
+
+    def _trim_history(self):
+        """Forget the oldest finished jobs beyond max_history and delete their renders"""
+        with self.lock:
+            finished = [job_id for job_id, record in self.jobs.items() if record['finished'].is_set()]
+            for job_id in finished[:max(0, len(finished) - self.max_history)]:
+                record = self.jobs.pop(job_id)
+                if record['output_path'] and os.path.exists(record['output_path']):
+                    os.remove(record['output_path'])
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a RenderService (set as the server's 'service' attribute)"""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_render(self, record):
+        """Reply with the rendered PNG of a finished job"""
+        try:
+            with open(record['output_path'], 'rb') as f:
+                body = f.read()
+        except (OSError, TypeError):
+            self.send_json(410, {'error': "Render is no longer available"})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Job-Id', record['id'])
+        self.send_header('X-Render-Time', f"{record['elapsed'] or 0:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_record(self, record):
+        """Reply with the render, or with the job status if it has none"""
+        service = self.server.service
+        if record['status'] == 'done':
+            self.send_render(record)
+        elif record['status'] == 'failed':
+            self.send_json(500, service.describe(record))
+        else:
+            self.send_json(202, service.describe(record))
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/render':
+            self.send_json(404, {'error': "Not found"})
+            return
+        try:
+            params, wait = parse_render_params(url.query)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            self.send_json(413 if length > 0 else 400, {'error': "Expected a skin PNG up to 1 MB"})
+            return
+        skin_data = self.rfile.read(length)
+        try:
+            with Image.open(io.BytesIO(skin_data)) as img:
+                img.verify()
+        except Exception:
+            self.send_json(400, {'error': "Body is not a readable image"})
+            return
+
+        service = self.server.service
+        try:
+            record = service.submit(skin_data, params)
+        except queue.Full:
+            self.send_json(503, {'error': "Render queue is full"}, {'Retry-After': '1'})
+            return
+
+        if wait:
+            service.wait(record['id'], self.server.wait_timeout)
+            self.send_record(record)
+        else:
+            self.send_json(202, dict(service.describe(record), status_url=f"/jobs/{record['id']}",
+                                     result_url=f"/jobs/{record['id']}/result"))
+
+    def do_GET(self):
+        parts = urllib.parse.urlparse(self.path).path.strip('/').split('/')
+        service = self.server.service
+        if parts == ['stats']:
+            self.send_json(200, service.stats())
+            return
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            record = service.get(parts[1])
+            if record is None:
+                self.send_json(404, {'error': "Unknown job"})
+            elif len(parts) == 2:
+                self.send_json(200, service.describe(record))
+            elif parts[2] == 'result':
+                self.send_record(record)
+            else:
+                self.send_json(404, {'error': "Not found"})
+            return
+        self.send_json(404, {'error': "Not found"})
+
+def create_server(service, host='127.0.0.1', port=8765, wait_timeout=300, verbose=False):
+    """HTTP server for a render service (call serve_forever() to run it)"""
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.wait_timeout = wait_timeout
+    server.verbose = verbose
+    return server
+
+def run_load(url, skin_paths, requests=100, concurrency=8, params=None, timeout=300):
+    """Send render requests (wait=1) to a running service and summarize the latencies
+
+    Requests rejected with 503 are retried after Retry-After; their latency
+    counts from the first attempt.
+    """
+    skins = []
+    for path in skin_paths:
+        with open(path, 'rb') as f:
+            skins.append(f.read())
+    query = urllib.parse.urlencode(dict(params or {}, wait=1))
+    render_url = f"{url.rstrip('/')}/render?{query}"
+
+    def send(index):
+        data = skins[index % len(skins)]
+        start_time = time.perf_counter()
+        retries = 0
+        while True:
+            request = urllib.request.Request(render_url, data=data, method='POST',
+                                             headers={'Content-Type': 'image/png'})
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                    ok = response.status == 200
+                    break
+            except urllib.error.HTTPError as e:
+                if e.code == 503:
+                    retries += 1
+                    time.sleep(float(e.headers.get('Retry-After') or 1))
+                    continue
+                ok = False
+                break
+            except OSError:
+                ok = False
+                break
+        return ok, time.perf_counter() - start_time, retries
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for ok, latency, _ in outcomes if ok]
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'failed': requests - len(latencies),
+        'retries': sum(retries for _, _, retries in outcomes),
+        'elapsed': elapsed,
+        'renders_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p90': percentile(latencies, 90),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': max(latencies) if latencies else None
+    }
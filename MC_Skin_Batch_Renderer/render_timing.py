@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+"""
+Per-job render timing
+
+Every render attempt produces one timing record with the spans of its phases,
+so the time of a batch can be broken down instead of only measured per skin:
+
+    queue_wait    job waiting in the scheduler for a free worker slot
+    spawn         starting the Blender process (only when a worker was started)
+    load          Blender loading the model .blend file (ditto)
+    blender       the whole job round trip to the worker, containing:
+      setup       applying render settings (setup_rendering, skipped if unchanged)
+      texture     replacing the skin texture (replace_skin_texture)
+      render      Cycles rendering
+      write       saving the PNG
+    post_process  background image compositing and render cache store
+    finalize      moving the finished render into place
+
+Spans inside 'blender' are measured by blender_render_script.py. All times are
+epoch seconds, so spans from Blender and the orchestrator share one timeline.
+
+A TimingLog appends the records to a JSONL file, one line per attempt:
+
+    {"id": "3", "skin_path": "...", "model_file": "...", "slot": 1, "pid": 4242,
+     "attempt": 1, "status": "done", "start": ..., "end": ..., "total": 9.8,
+     "phases": {"queue_wait": 0.0, "render": 8.9, ...},
+     "spans": [["queue_wait", start, end], ...]}
+"""
+
+class JobTimer:
+    """Collects the phase spans of one render attempt"""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, phase, start, end):
+        """Add a span measured elsewhere (e.g. by Blender)"""
+        if start is not None and end is not None:
+            self.spans.append([phase, start, end])
+
+    def extend(self, spans):
+        """Add [phase, start, end] spans, ignoring malformed entries"""
+        for span in spans or []:
+            try:
+                phase, start, end = span
+                self.add(str(phase), float(start), float(end))
+            except (TypeError, ValueError):
+                continue
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a span"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start_time, time.time())
+
+    def record(self, job, status, **fields):
+        """Build the timing record of the attempt"""
+        phases = {}
+        for phase, start, end in self.spans:
+            phases[phase] = phases.get(phase, 0.0) + (end - start)
+        start = min((span[1] for span in self.spans), default=None)
+        end = max((span[2] for span in self.spans), default=None)
+        record = {
+            'id': job['id'],
+            'skin_path': job.get('skin_path'),
+            'model_file': os.path.basename(job.get('model_file', '')),
+            'width': job.get('width'),
+            'height': job.get('height'),
+            'status': status.get('status'),
+            'error': status.get('error'),
+            'start': start,
+            'end': end,
+            'total': end - start if start is not None else None,
+            'phases': phases,
+            'spans': sorted(self.spans, key=lambda span: span[1])
+        }
+        record.update(fields)
+        return record
+
+class TimingLog:
+    """Appends timing records to a JSONL file"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        """Write one record; the line is flushed so the file can be followed live"""
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        """Close the file"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def open_timing_log(path):
+    """TimingLog for a path, or None when no path is given or it can't be opened"""
+    if not path:
+        return None
+    try:
+        return TimingLog(path)
+    except OSError as e:
+        print(f"Cannot write timing log {path}: {e}")
+        return None
+
+def load_timings(path):
+    """Read the timing records of a JSONL file, skipping broken lines"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def summarize_timings(records):
+    """Per-phase totals of timing records, to see where render time goes
+
+    share is the phase's fraction of the summed job time; 'blender' contains
+    setup, texture, render and write, so shares don't add up to one.
+    """
+    phases = {}
+    job_time = 0.0
+    for record in records:
+        job_time += record.get('total') or 0.0
+        for phase, seconds in record.get('phases', {}).items():
+            entry = phases.setdefault(phase, {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+    for entry in phases.values():
+        entry['mean'] = entry['total'] / entry['count']
+        entry['share'] = entry['total'] / job_time if job_time else None
+    return {
+        'jobs': len(records),
+        'failed': sum(1 for record in records if record.get('status') != 'done'),
+        'job_time': job_time,
+        'phases': dict(sorted(phases.items(), key=lambda item: item[1]['total'], reverse=True))
+    }
+
+# Trace process ids: worker slots and the scheduler queue get separate groups
+TRACE_WORKERS_PID = 1
+TRACE_QUEUE_PID = 2
+
+def chrome_trace(records):
+    """Convert timing records to a Chrome trace-event document
+
+    Every pool slot is one thread of the 'workers' process, showing each job
+    with its phases nested inside it. Queue waits are async events of the
+    'queue' process, since they overlap the jobs running before them.
+    The result opens in chrome://tracing, Perfetto or speedscope.
+    """
+    starts = [record['start'] for record in records if record.get('start') is not None]
+    origin = min(starts) if starts else 0.0
+
+    def micros(seconds):
+        return round((seconds - origin) * 1e6, 1)
+
+    events = [
+        {'ph': 'M', 'name': 'process_name', 'pid': TRACE_WORKERS_PID, 'args': {'name': 'workers'}},
+        {'ph': 'M', 'name': 'process_name', 'pid': TRACE_QUEUE_PID, 'args': {'name': 'queue'}}
+    ]
+    slots = set()
+    for index, record in enumerate(records):
+        spans = record.get('spans') or []
+        slot = record.get('slot') or 0
+        slots.add(slot)
+        job_spans = [span for span in spans if span[0] != 'queue_wait']
+        name = os.path.basename(record.get('skin_path') or str(record.get('id')))
+        for phase, start, end in spans:
+            if phase == 'queue_wait':
+                # Async pairs need an id that is unique per attempt
+                event = {'name': name, 'cat': 'queue_wait', 'pid': TRACE_QUEUE_PID, 'tid': 0, 'id': index,
+                         'args': {'id': record.get('id')}}
+                events.append(dict(event, ph='b', ts=micros(start)))
+                events.append(dict(event, ph='e', ts=micros(end)))
+        if not job_spans:
+            continue
+        job_start = min(span[1] for span in job_spans)
+        job_end = max(span[2] for span in job_spans)
+        events.append({'ph': 'X', 'name': name, 'cat': 'job', 'pid': TRACE_WORKERS_PID, 'tid': slot,
+                       'ts': micros(job_start), 'dur': round((job_end - job_start) * 1e6, 1),
+                       'args': {'id': record.get('id'), 'status': record.get('status'),
+                                'attempt': record.get('attempt'), 'model_file': record.get('model_file'),
+                                'worker_pid': record.get('pid'), 'error': record.get('error')}})
+        for phase, start, end in job_spans:
+            events.append({'ph': 'X', 'name': phase, 'cat': 'phase', 'pid': TRACE_WORKERS_PID, 'tid': slot,
+                           'ts': micros(start), 'dur': round((end - start) * 1e6, 1)})
+    for slot in sorted(slots):
+        events.append({'ph': 'M', 'name': 'thread_name', 'pid': TRACE_WORKERS_PID, 'tid': slot,
+                       'args': {'name': f"slot {slot}"}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(records, path):
+    """Write timing records as a Chrome trace-event JSON file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(records), f)
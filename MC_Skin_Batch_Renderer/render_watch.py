@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import errno
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from render_pool import RenderPool
+from render_scheduler import QueueScheduler
+from render_retry import RetryPolicy
+from render_api import prepare_job
+from render_cache import hash_file
+from render_core import SCRIPT_PATH, apply_background_image
+
+"""
+Watch-folder rendering
+
+Watches a directory tree for new or changed skin PNGs and renders each one as
+soon as it has stopped changing (debounced). On Linux changes are reported by
+inotify; elsewhere, or when inotify is unavailable, the tree is polled.
+
+Render settings come from the command line defaults, overridden by an
+mcskin_watch.json file in the skin's folder or any parent folder up to the
+watched directory (the nearest file wins per setting), e.g.
+{"model": "auto", "pose": "3", "ratio": "16:9", "bg_color": "#ffffffff", "quality": "draft"}
+
+Outputs go to the output directory (mirroring the sub folders) next to
+processed_index.jsonl, which records the content hash of every rendered skin.
+A skin is rendered again only when its content changes, also across restarts.
+"""
+
+WATCH_SETTINGS_FILE = "mcskin_watch.json"
+INDEX_FILE = "processed_index.jsonl"
+SKIN_EXTENSIONS = ('.png',)
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def is_skin_file(path):
+    """Whether a path looks like a skin image"""
+    return path.lower().endswith(SKIN_EXTENSIONS) and not os.path.basename(path).startswith('.')
+
+def walk_skins(root, exclude_dirs=()):
+    """All skin files under root, skipping the excluded directories"""
+    exclude_dirs = {os.path.abspath(d) for d in exclude_dirs}
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [d for d in dir_names if os.path.abspath(os.path.join(dir_path, d)) not in exclude_dirs]
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if is_skin_file(path):
+                yield path
+
+class PollingWatcher:
+    """Reports changed skins by rescanning the tree every interval seconds"""
+
+    def __init__(self, root, exclude_dirs=(), interval=2.0):
+        self.root = root
+        self.exclude_dirs = exclude_dirs
+        self.interval = interval
+        self.signatures = self.scan()
+
+    def scan(self):
+        """(size, mtime) of every skin file"""
+        signatures = {}
+        for path in walk_skins(self.root, self.exclude_dirs):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signatures[path] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def poll(self, timeout):
+        """Paths that changed since the last call (waits up to timeout seconds)"""
+        time.sleep(min(timeout, self.interval))
+        signatures = self.scan()
+        changed = [path for path, signature in signatures.items() if self.signatures.get(path) != signature]
+        self.signatures = signatures
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Reports changed skins using Linux inotify; raises OSError where unavailable"""
+
+    MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+    def __init__(self, root, exclude_dirs=()):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.exclude_dirs = {os.path.abspath(d) for d in exclude_dirs}
+        self.watches = {}  # watch descriptor -> directory
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        """Watch a directory and all directories below it"""
+        for dir_path, dir_names, _ in os.walk(root):
+            dir_names[:] = [d for d in dir_names
+                            if os.path.abspath(os.path.join(dir_path, d)) not in self.exclude_dirs]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {dir_path}")
+            self.watches[wd] = dir_path
+
+    def poll(self, timeout):
+        """Paths that changed (waits up to timeout seconds); None if events were lost"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            dir_path = self.watches.get(wd)
+            if dir_path is None or not name:
+                continue
+            path = os.path.join(dir_path, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.abspath(path) not in self.exclude_dirs:
+                    # New folder: watch it and pick up skins that were copied in with it
+                    self.add_tree(path)
+                    changed.extend(walk_skins(path, self.exclude_dirs))
+            elif is_skin_file(path):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(root, exclude_dirs=(), interval=2.0, use_inotify=True):
+    """inotify watcher when possible, polling otherwise"""
+    if use_inotify:
+        try:
+            return InotifyWatcher(root, exclude_dirs)
+        except (OSError, AttributeError) as e:
+            print(f"inotify not available ({e}), polling every {interval}s")
+    return PollingWatcher(root, exclude_dirs, interval)
+
+class ProcessedIndex:
+    """Append-only record of the skins that were rendered, keyed by path and content hash"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # skin path -> last entry
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated line from a crash
+                    self.entries[entry['skin_path']] = entry
+
+    def is_processed(self, skin_path, content_hash):
+        """Whether this exact skin content was already rendered (or failed to render)"""
+        with self.lock:
+            entry = self.entries.get(skin_path)
+        return entry is not None and entry.get('hash') == content_hash
+
+    def record(self, skin_path, content_hash, status, output_path=None, error=None):
+        """Remember the outcome for a skin"""
+        entry = {'skin_path': skin_path, 'hash': content_hash, 'status': status,
+                 'output_path': output_path, 'error': error, 'time': time.time()}
+        with self.lock:
+            self.entries[skin_path] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+class FolderWatcher:
+    """Renders skins dropped into a watched directory, each content once"""
+
+    def __init__(self, blender_path, watch_dir, output_dir=None, workers=1, threads=0, defaults=None,
+                 debounce=0.5, interval=2.0, use_inotify=True, timeout=None, queue_size=1000,
+                 script_path=SCRIPT_PATH, on_progress=None, max_attempts=3, timing_log=None, backend=None):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.output_dir = os.path.abspath(output_dir or os.path.join(watch_dir, "renders"))
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.defaults = dict(defaults or {})
+        self.debounce = debounce
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.on_progress = on_progress
+        self.index = ProcessedIndex(os.path.join(self.output_dir, INDEX_FILE))
+        self.pool = RenderPool(blender_path, workers, script_path, threads=threads,
+                               retry_policy=RetryPolicy(timeout, max_attempts), timing_log=timing_log,
+                               backend=backend)
+        self.scheduler = QueueScheduler(queue_size)
+        self.pending = {}  # skin path -> time of its last change
+        self.in_flight = set()  # skin paths queued or rendering
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def emit(self, event, **fields):
+        """Report a progress event to the caller"""
+        if self.on_progress:
+            self.on_progress(dict(event=event, **fields))
+
+    def folder_settings(self, skin_path):
+        """Defaults merged with the mcskin_watch.json files from the watch root down to the skin's folder"""
+        settings = dict(self.defaults)
+        rel_dir = os.path.relpath(os.path.dirname(os.path.abspath(skin_path)), self.watch_dir)
+        dir_path = self.watch_dir
+        for part in [''] + ([] if rel_dir == '.' else rel_dir.split(os.sep)):
+            dir_path = os.path.join(dir_path, part)
+            settings_path = os.path.join(dir_path, WATCH_SETTINGS_FILE)
+            if os.path.exists(settings_path):
+                try:
+                    with open(settings_path, 'r', encoding='utf-8') as f:
+                        settings.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"Ignoring invalid {settings_path}: {e}")
+        return settings
+
+    def output_path(self, skin_path, settings):
+        """Output file for a skin, mirroring its sub folder below the watched directory"""
+        rel_path = os.path.relpath(os.path.abspath(skin_path), self.watch_dir)
+        base_name = os.path.splitext(rel_path)[0]
+        ratio_code = settings.get('ratio', '1:1').replace(':', '')
+        return os.path.join(self.output_dir, f"{base_name}_pose{settings.get('pose', '1')}_{ratio_code}_render.png")
+
+    def queue_skin(self, skin_path):
+        """Queue a skin whose content has not been rendered yet"""
+        try:
+            content_hash = hash_file(skin_path)
+        except OSError:
+            return  # Removed again before we got to it
+        if content_hash is None or self.index.is_processed(skin_path, content_hash):
+            return
+        with self.lock:
+            if skin_path in self.in_flight:
+                # Still rendering the old content; look at it again afterwards
+                self.pending[skin_path] = time.time()
+                return
+            self.in_flight.add(skin_path)
+
+        settings = self.folder_settings(skin_path)
+        output_path = self.output_path(skin_path, settings)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        try:
+            job = prepare_job(dict(settings, id=skin_path, skin_path=skin_path, output_path=output_path),
+                              skin_path, self.output_dir)
+            job['content_hash'] = content_hash
+            self.scheduler.submit(job)
+        except (KeyError, ValueError, AttributeError) as e:
+            # Bad settings in mcskin_watch.json; don't retry until the skin changes
+            with self.lock:
+                self.in_flight.discard(skin_path)
+            self.index.record(skin_path, content_hash, 'failed', error=f"Invalid settings: {e}")
+            self.emit('result', skin_path=skin_path, status='failed', error=f"Invalid settings: {e}")
+            return
+        except queue.Full:
+            with self.lock:
+                self.in_flight.discard(skin_path)
+                self.pending[skin_path] = time.time()
+            return
+        self.emit('queued', skin_path=skin_path, output_path=output_path)
+
+    def _post_process(self, job, status):
+        background_image = job.get('background_image')
+        if background_image and os.path.exists(status['output_path']):
+            apply_background_image(status['output_path'], background_image)
+
+    def _on_result(self, slot, job, status):
+        skin_path = job['skin_path']
+        self.index.record(skin_path, job['content_hash'], status.get('status', 'failed'),
+                          job['output_path'] if status.get('status') == 'done' else None, status.get('error'))
+        with self.lock:
+            self.in_flight.discard(skin_path)
+        self.emit('result', skin_path=skin_path, status=status.get('status', 'failed'),
+                  output_path=job['output_path'], error=status.get('error'), elapsed=status.get('elapsed'))
+
+    def stop(self):
+        """Stop watching; queued renders are finished first"""
+        self.stop_event.set()
+
+    def run(self):
+        """Watch and render until stop() is called"""
+        watcher = create_watcher(self.watch_dir, [self.output_dir], self.interval, self.use_inotify)
+        runner = threading.Thread(target=self.pool.run_scheduler,
+                                  args=(self.scheduler, self.pool.num_workers, None, None,
+                                        self._on_result, self._post_process),
+                                  daemon=True)
+        runner.start()
+        print(f"Watching {self.watch_dir}, writing renders to {self.output_dir}")
+
+        # Skins that arrived while we were not running
+        for skin_path in walk_skins(self.watch_dir, [self.output_dir]):
+            self.queue_skin(skin_path)
+
+        try:
+            while not self.stop_event.is_set():
+                changed = watcher.poll(self.debounce / 2 if self.pending else 1.0)
+                if changed is None:
+                    # Events were lost, fall back to a full scan
+                    changed = list(walk_skins(self.watch_dir, [self.output_dir]))
+                now = time.time()
+                with self.lock:
+                    for skin_path in changed:
+                        self.pending[skin_path] = now
+                    # Files that stopped changing for the debounce time are ready
+                    ready = [path for path, changed_at in self.pending.items()
+                             if now - changed_at >= self.debounce and path not in self.in_flight]
+                    for skin_path in ready:
+                        del self.pending[skin_path]
+                for skin_path in ready:
+                    if os.path.exists(skin_path):
+                        self.queue_skin(skin_path)
+        finally:
+            watcher.close()
+            self.scheduler.close()
+            runner.join()